@@ -0,0 +1,27 @@
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Performance benchmarks for the Numbas compiler.
+
+    Run them from the top of the repository, e.g. ``python -m benchmarks.run``.
+"""
+
+import os
+import sys
+
+NUMBAS_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the compiler's modules import each other as top-level modules
+sys.path.insert(0,os.path.join(NUMBAS_PATH,'bin'))
@@ -0,0 +1,113 @@
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Time escaping a large exam XML document for settings.js, and measure the peak memory used.
+
+    Compares the old encoder, which made four passes with ``re.sub``, against ``xml2js.encode`` and ``xml2js.write_encoded``.
+
+    Usage: python -m benchmarks.encode [--size MB] [--repeat N] [exam file]
+"""
+
+from . import NUMBAS_PATH
+import io
+import os
+import re
+import time
+import tracemalloc
+from optparse import OptionParser
+
+from exam import Exam
+import xml2js
+
+def re_sub_encode(xml):
+    """
+        The encoder used before ``xml2js.encode`` was written, for comparison
+    """
+    xml = xml.strip()
+    xml = re.sub('\r','',xml)
+    xml = re.sub('\\\\','\\\\\\\\',xml)
+    xml = re.sub('\n',r'\\n',xml)
+    xml = re.sub('"','\\"',xml)
+    return xml
+
+def write_re_sub(xml):
+    out = io.StringIO()
+    out.write(re_sub_encode(xml))
+    return out
+
+def write_encode(xml):
+    out = io.StringIO()
+    out.write(xml2js.encode(xml))
+    return out
+
+def write_streamed(xml):
+    out = io.StringIO()
+    xml2js.write_encoded(out,xml)
+    return out
+
+def make_exam_xml(source,size):
+    """
+        Make an exam XML document at least ``size`` bytes long, by repeating the questions in the given exam
+    """
+    exam = Exam.fromstring(source)
+    examXML = exam.tostring()
+    copies = max(1,-(-size//len(examXML.encode('utf-8'))))
+    for group in exam.question_groups:
+        group.questions *= copies
+    return exam.tostring()
+
+def measure(fn,xml,repeat):
+    """
+        Return the median time in milliseconds and the peak memory allocated while writing ``xml`` with ``fn``
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(xml)
+        times.append((time.perf_counter()-start)*1000)
+    times.sort()
+
+    tracemalloc.start()
+    out = fn(xml)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return times[len(times)//2], peak, out.getvalue()
+
+def run():
+    parser = OptionParser(usage="usage: %prog [options] [source]")
+    parser.add_option('--size',dest='size',type='float',default=10,help='Size of the exam XML, in megabytes')
+    parser.add_option('--repeat',dest='repeat',type='int',default=5,help='Number of times to repeat each measurement')
+    (options,args) = parser.parse_args()
+
+    source_path = args[0] if args else os.path.join(NUMBAS_PATH,'tests','stability-test.exam')
+    with open(source_path,encoding='utf-8') as f:
+        source = f.read()
+
+    xml = make_exam_xml(source,int(options.size*1024*1024))
+    print('Exam XML: %i bytes' % len(xml.encode('utf-8')))
+
+    expected = None
+    print('%-28s %12s %16s' % ('encoder','time (ms)','peak memory (MB)'))
+    for name, fn in [('re.sub, four passes',write_re_sub),('xml2js.encode',write_encode),('xml2js.write_encoded',write_streamed)]:
+        ms, peak, output = measure(fn,xml,options.repeat)
+        if expected is None:
+            expected = output
+        elif output != expected:
+            raise Exception('%s gave different output' % name)
+        print('%-28s %12.1f %16.1f' % (name,ms,peak/1024/1024))
+
+if __name__ == '__main__':
+    run()
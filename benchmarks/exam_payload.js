@@ -0,0 +1,62 @@
+/*
+Copyright 2011-18 Newcastle University
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+*/
+
+/** @file Time how long node.js takes to load exam payloads produced by benchmarks/exam_payload.py.
+ *
+ * Usage: node exam_payload.js <repeat> <xml payload> <json payload>
+ *
+ * Each payload file contains an object literal with the properties that settings.js gives `Numbas.rawxml` for the exam definition.
+ * Evaluating the object is timed for both formats; if it has an `examJSON` property, that's also parsed with JSON.parse.
+ * Prints a JSON array with the median times, in milliseconds, for each file.
+ */
+
+var fs = require('fs');
+var vm = require('vm');
+
+function median(times) {
+    times.sort(function(a,b){ return a-b; });
+    return times[Math.floor(times.length/2)];
+}
+
+function time(fn,repeat) {
+    var times = [];
+    var result;
+    for(var i=0;i<repeat;i++) {
+        var start = process.hrtime.bigint();
+        result = fn();
+        times.push(Number(process.hrtime.bigint()-start)/1e6);
+    }
+    return {result: result, ms: median(times)};
+}
+
+var repeat = parseInt(process.argv[2]);
+var results = process.argv.slice(3).map(function(path) {
+    var source = fs.readFileSync(path,'utf-8');
+    var run = 0;
+    var evaluated = time(function() {
+        // a different comment each time stops V8 reusing the compiled script
+        return new vm.Script(source+'\n//'+(run++)).runInThisContext();
+    },repeat);
+    var parse_ms = null;
+    if(evaluated.result.examJSON!==undefined) {
+        parse_ms = time(function() {
+            return JSON.parse(evaluated.result.examJSON);
+        },repeat).ms;
+    }
+    return {eval_ms: evaluated.ms, parse_ms: parse_ms};
+});
+
+console.log(JSON.stringify(results));
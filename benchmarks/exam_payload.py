@@ -0,0 +1,134 @@
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Compare the two encodings of the exam definition in settings.js: an escaped string of XML,
+    and the ``--json-exam`` encoding, which is the structure as JSON loaded with ``JSON.parse`` plus a string of XML holding only the content fragments.
+
+    Reports the size of each payload, raw and gzipped, the time taken to produce it, and the time taken by node.js to load it.
+    Building the DOM can't be measured without a browser, so only the work done before that - evaluating the string literals,
+    and parsing the JSON - is timed. The amount of XML text left for the browser to parse, and the number of elements made
+    from the JSON with DOM calls, are reported instead.
+
+    Usage: python -m benchmarks.exam_payload [--copies N] [--repeat N] [exam file]
+"""
+
+from . import NUMBAS_PATH
+import gzip
+import json
+import os
+import subprocess
+import tempfile
+import time
+import xml.etree.ElementTree as etree
+from optparse import OptionParser
+
+from exam import Exam
+import xml2js
+
+def timed(fn,repeat):
+    """
+        Run ``fn`` ``repeat`` times, and return its result and the median time taken, in milliseconds
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter()-start)*1000)
+    times.sort()
+    return result, times[len(times)//2]
+
+def count_elements(structure):
+    """
+        The number of elements in a JsonML structure produced by ``xml2js.exam_json``
+    """
+    return 1+sum(count_elements(child) for child in structure[1:] if isinstance(child,list))
+
+def encode_xml(examXML):
+    return '({examXML: "%s"})' % xml2js.encode(examXML)
+
+def encode_json(examXML):
+    structure, content = xml2js.exam_json(etree.fromstring(examXML))
+    return '({examJSON: %s, examContent: "%s"})' % (xml2js.json_literal(structure),xml2js.encode(content)), structure, content
+
+def make_payloads(source,copies=1,repeat=5):
+    """
+        Build the XML and JSON payloads for the given exam source, with each question group's questions repeated ``copies`` times
+    """
+    exam = Exam.fromstring(source)
+    for group in exam.question_groups:
+        group.questions *= copies
+    examXML = exam.tostring()
+
+    xml_payload, xml_time = timed(lambda: encode_xml(examXML),repeat)
+    (json_payload, structure, content), json_time = timed(lambda: encode_json(examXML),repeat)
+
+    return {
+        'xml': {
+            'payload': xml_payload,
+            'encode_ms': xml_time,
+            'xml_text': len(examXML),
+            'built': 0,
+        },
+        'json': {
+            'payload': json_payload,
+            'encode_ms': json_time,
+            'xml_text': len(content),
+            'built': count_elements(structure),
+        },
+    }
+
+def run_node(paths,repeat):
+    script = os.path.join(NUMBAS_PATH,'benchmarks','exam_payload.js')
+    out = subprocess.check_output(['node',script,str(repeat)]+paths)
+    return json.loads(out.decode('utf-8'))
+
+def run():
+    parser = OptionParser(usage="usage: %prog [options] [source]")
+    parser.add_option('--copies',dest='copies',type='int',default=20,help='Number of copies of each question to put in the exam')
+    parser.add_option('--repeat',dest='repeat',type='int',default=10,help='Number of times to repeat each measurement')
+    (options,args) = parser.parse_args()
+
+    source_path = args[0] if args else os.path.join(NUMBAS_PATH,'tests','stability-test.exam')
+    with open(source_path,encoding='utf-8') as f:
+        source = f.read()
+
+    payloads = make_payloads(source,options.copies,options.repeat)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = []
+        for kind in ('xml','json'):
+            path = os.path.join(tmpdir,kind+'.js')
+            with open(path,'w',encoding='utf-8') as f:
+                f.write(payloads[kind]['payload'])
+            paths.append(path)
+        node_results = run_node(paths,options.repeat)
+
+    print('%-6s %10s %10s %12s %10s %11s %14s %14s' % ('format','bytes','gzipped','encode (ms)','eval (ms)','parse (ms)','XML text (ch)','DOM-built elts'))
+    for kind, node_result in zip(('xml','json'),node_results):
+        payload = payloads[kind]
+        data = payload['payload'].encode('utf-8')
+        print('%-6s %10i %10i %12.2f %10.2f %11s %14i %14i' % (
+            kind,
+            len(data),
+            len(gzip.compress(data)),
+            payload['encode_ms'],
+            node_result['eval_ms'],
+            '%.2f' % node_result['parse_ms'] if node_result['parse_ms'] is not None else '-',
+            payload['xml_text'],
+            payload['built'],
+        ))
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,208 @@
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Generate synthetic exams of a given size, for benchmarking.
+
+    Exams are written in the original ``.exam`` format, so loading one exercises the parser and every migration.
+    The ``exam_question_groups`` migration puts all the questions in one group, so ``split_groups`` can be used on the migrated data to divide them into several groups.
+
+    Usage: python -m benchmarks.generate [options] [output file]
+"""
+
+from . import NUMBAS_PATH
+import sys
+from optparse import OptionParser
+
+from examparser import printdata, writedata
+
+PART_TYPES = ['jme','numberentry','matrix','patternmatch','1_n_2','m_n_2','m_n_x','gapfill','information']
+
+WORDS = 'the of a function value equation matrix derivative integral limit vector series root sum product set graph'.split(' ')
+
+class ExamSize(object):
+    """
+        The dimensions of a synthetic exam
+    """
+    def __init__(self,groups=4,questions=10,parts=1,choices=10,answers=10,content_length=2000,variables=10):
+        self.groups = groups                    # number of question groups
+        self.questions = questions              # number of questions in each group
+        self.parts = parts                      # number of parts of each type in each question
+        self.choices = choices                  # number of choices in multiple choice parts
+        self.answers = answers                  # number of answers in match choices with answers parts
+        self.content_length = content_length    # approximate length in characters of each question statement and advice
+        self.variables = variables              # number of variables in each question
+
+    def todict(self):
+        return dict(self.__dict__)
+
+def make_content(length,seed):
+    """
+        HTML with some maths in it, roughly ``length`` characters long
+    """
+    paragraphs = []
+    total = 0
+    i = seed
+    while total < length:
+        words = ' '.join(WORDS[(i*7+j*3) % len(WORDS)] for j in range(12))
+        paragraph = '<p>Paragraph {i}: {words}, where $x_{{{i}}} = \\var{{v{i}}}$ and $\\simplify{{{{a}}x^2+{{b}}x}}$.</p>'.format(i=i,words=words)
+        paragraphs.append(paragraph)
+        total += len(paragraph)+1
+        i += 1
+    return '\n'.join(paragraphs)
+
+def make_part(kind,size,n):
+    prompt = '<p>Part {}: answer this {} part.</p>'.format(n,kind)
+    part = {'type': kind, 'marks': 1, 'prompt': prompt}
+    if kind=='jme':
+        part.update({'answer': 'x^{}+sin(y)'.format(n+2), 'checkingtype': 'absdiff', 'checkingaccuracy': 0.001, 'vsetrangepoints': 5, 'vsetrange': [0,1]})
+    elif kind=='numberentry':
+        part.update({'minvalue': n+0.5, 'maxvalue': n+0.75})
+    elif kind=='matrix':
+        part.update({'correctanswer': 'id({})'.format(n%4+2), 'numrows': n%4+2, 'numcolumns': n%4+2, 'tolerance': 0})
+    elif kind=='patternmatch':
+        part.update({'answer': 'hello{}'.format(n), 'displayanswer': 'hello{}'.format(n)})
+    elif kind in ('1_n_2','m_n_2'):
+        part.update({
+            'minmarks': 0,
+            'maxmarks': 0,
+            'shufflechoices': True,
+            'displaytype': 'radiogroup' if kind=='1_n_2' else 'checkbox',
+            'displaycolumns': 0,
+            'minanswers': 0,
+            'maxanswers': 0,
+            'choices': ['Choice {} $\\var{{c{}}}$'.format(i,i) for i in range(size.choices)],
+            'matrix': [1 if (i+n)%3==0 else 0 for i in range(size.choices)],
+            'distractors': ['Distractor {}'.format(i) if i%2 else '' for i in range(size.choices)],
+        })
+    elif kind=='m_n_x':
+        part.update({
+            'minmarks': 0,
+            'maxmarks': 0,
+            'minanswers': 0,
+            'maxanswers': 0,
+            'shufflechoices': False,
+            'shuffleanswers': False,
+            'choices': ['Choice {}'.format(i) for i in range(size.choices)],
+            'answers': ['Answer {}'.format(i) for i in range(size.answers)],
+            'matrix': [[1 if i==j else 0 for j in range(size.answers)] for i in range(size.choices)],
+        })
+    elif kind=='gapfill':
+        part['prompt'] = '<p>Gap {n}a: [[0]] and gap {n}b: [[1]]</p>'.format(n=n)
+        part['gaps'] = [make_part('jme',size,n),make_part('numberentry',size,n)]
+    return part
+
+def make_question(size,n):
+    content = make_content(size.content_length,n)
+    return {
+        'name': 'Question {}'.format(n),
+        'tags': [],
+        'metadata': {'notes': '', 'description': 'Question {} of a synthetic exam'.format(n)},
+        'statement': content,
+        'extensions': [],
+        'advice': content,
+        'rulesets': {},
+        'variables': dict(('v{}'.format(i),'random(1..{})'.format(i+2)) for i in range(size.variables)),
+        'functions': {
+            'f': {'parameters': [['x','number']], 'type': 'number', 'language': 'jme', 'definition': 'x^{}'.format(n%5+1)},
+        },
+        'parts': [make_part(kind,size,i) for i in range(size.parts) for kind in PART_TYPES],
+    }
+
+def make_exam_data(size):
+    """
+        The data for an exam of the given size, in the original format
+    """
+    return {
+        'name': 'Synthetic exam',
+        'metadata': {'notes': '', 'description': 'A synthetic exam for benchmarking'},
+        'duration': 0,
+        'percentpass': 50,
+        'shufflequestions': False,
+        'navigation': {
+            'allowregen': True,
+            'reverse': True,
+            'browse': True,
+            'showfrontpage': False,
+            'onleave': {'action': 'none', 'message': ''},
+            'preventleave': False,
+        },
+        'timing': {
+            'timeout': {'action': 'none', 'message': ''},
+            'timedwarning': {'action': 'none', 'message': ''},
+        },
+        'feedback': {
+            'showactualmark': True,
+            'showtotalmark': True,
+            'showanswerstate': True,
+            'allowrevealanswer': True,
+            'advicethreshold': 0,
+        },
+        'extensions': [],
+        'questions': [make_question(size,n) for n in range(size.groups*size.questions)],
+    }
+
+def make_exam_source(size):
+    """
+        The source of an exam of the given size, in the ``.exam`` format
+    """
+    return printdata(make_exam_data(size))
+
+def split_groups(data,groups):
+    """
+        Divide the questions in a migrated exam's first question group into ``groups`` groups of equal size
+    """
+    questions = data['question_groups'][0]['questions']
+    per_group = -(-len(questions)//groups)
+    data['question_groups'] = [
+        {
+            'name': 'Group {}'.format(i),
+            'pickingStrategy': 'all-ordered',
+            'pickQuestions': 0,
+            'questions': questions[i*per_group:(i+1)*per_group],
+        }
+        for i in range(groups)
+    ]
+    return data
+
+def add_size_options(parser):
+    """
+        Add options setting the dimensions of the exam to an ``OptionParser``
+    """
+    default = ExamSize()
+    parser.add_option('--groups',dest='groups',type='int',default=default.groups,help='Number of question groups')
+    parser.add_option('--questions',dest='questions',type='int',default=default.questions,help='Number of questions in each group')
+    parser.add_option('--parts',dest='parts',type='int',default=default.parts,help='Number of parts of each type in each question')
+    parser.add_option('--choices',dest='choices',type='int',default=default.choices,help='Number of choices in multiple choice parts')
+    parser.add_option('--answers',dest='answers',type='int',default=default.answers,help='Number of answers in match choices with answers parts')
+    parser.add_option('--content-length',dest='content_length',type='int',default=default.content_length,help='Length in characters of each question statement')
+    parser.add_option('--variables',dest='variables',type='int',default=default.variables,help='Number of variables in each question')
+
+def size_from_options(options):
+    return ExamSize(**dict((key,getattr(options,key)) for key in ExamSize().todict()))
+
+def run():
+    parser = OptionParser(usage="usage: %prog [options] [output file]")
+    add_size_options(parser)
+    (options,args) = parser.parse_args()
+
+    data = make_exam_data(size_from_options(options))
+    if args:
+        with open(args[0],'w',encoding='utf-8') as f:
+            writedata(data,f)
+    else:
+        writedata(data,sys.stdout)
+
+if __name__ == '__main__':
+    run()
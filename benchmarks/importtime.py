@@ -0,0 +1,132 @@
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Measure how long the command-line compiler takes to start.
+
+    Times importing ``numbas`` with ``python -X importtime``, and running ``numbas.py --help``, each in a fresh interpreter.
+    The modules which take longest to import are listed, to find out what's responsible for any slowdown.
+
+    Results can be saved with ``--output`` and compared with ``--compare``, in the same way as ``benchmarks.run``.
+
+    Usage:
+        python -m benchmarks.importtime [--repeat N] [--output results.json]
+        python -m benchmarks.importtime --compare old.json new.json [--threshold 0.1]
+"""
+
+from . import NUMBAS_PATH
+from .run import summarise, compare, git_commit
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+
+BIN_PATH = os.path.join(NUMBAS_PATH,'bin')
+
+def import_times(module='numbas'):
+    """
+        Import ``module`` in a new interpreter with ``-X importtime``.
+        Returns a dictionary mapping the name of each module imported to its cumulative import time, in milliseconds, and the modules imported directly by ``module``.
+    """
+    process = subprocess.run([sys.executable,'-X','importtime','-c','import '+module],cwd=BIN_PATH,stdout=subprocess.PIPE,stderr=subprocess.PIPE,check=True)
+    times = {}
+    direct = []
+    for line in process.stderr.decode('utf-8').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name)-len(name.lstrip()))//2
+        name = name.strip()
+        times[name] = int(cumulative_us)/1000
+        if depth==1:
+            direct.append(name)
+    return times, direct
+
+def help_time():
+    """
+        The time taken to run ``numbas.py --help``, in milliseconds
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable,os.path.join(BIN_PATH,'numbas.py'),'--help'],stdout=subprocess.DEVNULL,check=True)
+    return (time.perf_counter()-start)*1000
+
+def run_benchmarks(repeat,top):
+    # one run first, so that any bytecode caches are written before the timed runs
+    import_times()
+
+    import_ms = []
+    runs = []
+    for i in range(repeat):
+        times, direct = import_times()
+        import_ms.append(times['numbas'])
+        runs.append((times,direct))
+    help_ms = [help_time() for i in range(repeat)]
+
+    benchmarks = {
+        'import numbas': summarise(import_ms),
+        'numbas.py --help': summarise(help_ms),
+    }
+
+    times, direct = sorted(runs,key=lambda run: run[0]['numbas'])[len(runs)//2]
+    slowest = sorted(direct,key=lambda name: -times[name])[:top]
+
+    print('%-28s %11s %10s' % ('Benchmark','median (ms)','min (ms)'))
+    for name,result in benchmarks.items():
+        print('%-28s %11.1f %10.1f' % (name,result['median_ms'],result['min_ms']))
+    print('')
+    print('Slowest modules imported by numbas:')
+    for name in slowest:
+        print('%-28s %11.1f' % (name,times[name]))
+
+    return {
+        'repeat': repeat,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'commit': git_commit(),
+        'benchmarks': benchmarks,
+        'imports': dict((name,times[name]) for name in direct),
+    }
+
+def run():
+    parser = OptionParser(usage="usage: %prog [options]\n       %prog --compare old.json new.json")
+    parser.add_option('--repeat',dest='repeat',type='int',default=10,help='Number of times to repeat each measurement')
+    parser.add_option('--top',dest='top',type='int',default=10,help='Number of slowest imports to list')
+    parser.add_option('-o','--output',dest='output',help='Write the results to this JSON file')
+    parser.add_option('--compare',dest='compare',action='store_true',default=False,help='Compare two JSON files of results')
+    parser.add_option('--threshold',dest='threshold',type='float',default=0.1,help='Fractional increase in median time counted as a regression')
+    (options,args) = parser.parse_args()
+
+    if options.compare:
+        if len(args)!=2:
+            parser.error('--compare needs two results files')
+        results = []
+        for path in args:
+            with open(path,encoding='utf-8') as f:
+                results.append(json.load(f))
+        regressions = compare(results[0],results[1],options.threshold)
+        if regressions:
+            print('%i regression%s' % (len(regressions),'' if len(regressions)==1 else 's'))
+            sys.exit(1)
+        return
+
+    results = run_benchmarks(options.repeat,options.top)
+    if options.output:
+        with open(options.output,'w',encoding='utf-8') as f:
+            json.dump(results,f,indent=1)
+
+if __name__ == '__main__':
+    run()
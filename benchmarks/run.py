@@ -0,0 +1,180 @@
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Time each stage of compiling a synthetic exam, made by ``benchmarks.generate``.
+
+    The results are printed, and can be saved to a JSON file with ``--output``.
+    Two saved results can be compared with ``--compare``: any benchmark whose median time has increased by more than ``--threshold`` is reported as a regression, and the exit status is 1.
+
+    Usage:
+        python -m benchmarks.run [size options] [--repeat N] [--output results.json]
+        python -m benchmarks.run --compare old.json new.json [--threshold 0.1]
+"""
+
+from . import NUMBAS_PATH
+from .generate import add_size_options, size_from_options, make_exam_source, split_groups
+import contextlib
+import copy
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from examparser import ExamParser
+from numbasobject import NumbasObject
+from exam import Exam
+from numbas import NumbasCompiler, make_option_parser
+import xml2js
+
+def measure(fn,repeat,setup=None):
+    """
+        Run ``fn`` ``repeat`` times, and return the times taken, in milliseconds.
+        If ``setup`` is given, it's called before each run, outside the timing, and its result is passed to ``fn``.
+    """
+    times = []
+    for i in range(repeat):
+        args = (setup(),) if setup is not None else ()
+        start = time.perf_counter()
+        fn(*args)
+        times.append((time.perf_counter()-start)*1000)
+    return times
+
+def summarise(times):
+    ordered = sorted(times)
+    return {
+        'median_ms': ordered[len(ordered)//2],
+        'min_ms': ordered[0],
+        'max_ms': ordered[-1],
+        'times_ms': times,
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git','rev-parse','HEAD'],cwd=NUMBAS_PATH,stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def compile_options(source,output):
+    """
+        Options for ``NumbasCompiler``, as if ``numbas.py`` had been run with no options
+    """
+    options = make_option_parser().get_default_values()
+    options.path = NUMBAS_PATH
+    options.source = source
+    options.output = output
+    options.zip = True
+    return options
+
+def run_benchmarks(size,repeat):
+    """
+        Time each stage of compiling an exam of the given size. Returns a dictionary of results for each stage.
+    """
+    source = make_exam_source(size)
+
+    parsed = ExamParser().parse(source)
+    migrated = NumbasObject(data=copy.deepcopy(parsed),version='1')
+    data = split_groups(migrated.data,size.groups)
+    exam = Exam.fromDATA(data)
+    examXML = exam.tostring()
+    versioned_source = str(NumbasObject(data=data,version=migrated.version))
+
+    benchmarks = {}
+    def bench(name,fn,setup=None):
+        times = measure(fn,repeat,setup)
+        benchmarks[name] = summarise(times)
+        print('%-28s %11.1f %10.1f' % (name,benchmarks[name]['median_ms'],benchmarks[name]['min_ms']))
+
+    print('%-28s %11s %10s' % ('Benchmark','median (ms)','min (ms)'))
+    bench('ExamParser.parse',lambda: ExamParser().parse(source))
+    bench('NumbasObject migrations',lambda data: NumbasObject(data=data,version='1'),setup=lambda: copy.deepcopy(parsed))
+    bench('Exam.fromDATA',lambda: Exam.fromDATA(data))
+    # a new exam object for each run, so nothing made by an earlier run is used again
+    bench('Exam.tostring',lambda exam: exam.tostring(),setup=lambda: Exam.fromDATA(data))
+    bench('xml2js.encode',lambda: xml2js.encode(examXML))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        options = compile_options(versioned_source,os.path.join(tmpdir,'exam.zip'))
+        def compile_exam():
+            with contextlib.redirect_stdout(io.StringIO()):
+                NumbasCompiler(options).compile()
+        bench('NumbasCompiler.compile',compile_exam)
+
+    return {
+        'size': size.todict(),
+        'repeat': repeat,
+        'source_bytes': len(source.encode('utf-8')),
+        'xml_bytes': len(examXML.encode('utf-8')),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'commit': git_commit(),
+        'benchmarks': benchmarks,
+    }
+
+def compare(old,new,threshold):
+    """
+        Compare the median times of the benchmarks in two sets of results.
+        Returns the names of the benchmarks whose median time increased by more than ``threshold``, as a fraction of the old time.
+    """
+    if old.get('size') != new.get('size'):
+        print('Warning: the results are for exams of different sizes')
+
+    regressions = []
+    print('%-28s %12s %12s %8s' % ('Benchmark','old (ms)','new (ms)','change'))
+    for name,new_result in new['benchmarks'].items():
+        if name not in old['benchmarks']:
+            continue
+        old_ms = old['benchmarks'][name]['median_ms']
+        new_ms = new_result['median_ms']
+        change = (new_ms-old_ms)/old_ms if old_ms else 0
+        regression = change > threshold
+        if regression:
+            regressions.append(name)
+        print('%-28s %12.1f %12.1f %+7.1f%%%s' % (name,old_ms,new_ms,change*100,'  REGRESSION' if regression else ''))
+    return regressions
+
+def run():
+    parser = OptionParser(usage="usage: %prog [options]\n       %prog --compare old.json new.json")
+    add_size_options(parser)
+    parser.add_option('--repeat',dest='repeat',type='int',default=5,help='Number of times to repeat each measurement')
+    parser.add_option('-o','--output',dest='output',help='Write the results to this JSON file')
+    parser.add_option('--compare',dest='compare',action='store_true',default=False,help='Compare two JSON files of results')
+    parser.add_option('--threshold',dest='threshold',type='float',default=0.1,help='Fractional increase in median time counted as a regression')
+    (options,args) = parser.parse_args()
+
+    if options.compare:
+        if len(args)!=2:
+            parser.error('--compare needs two results files')
+        results = []
+        for path in args:
+            with open(path,encoding='utf-8') as f:
+                results.append(json.load(f))
+        regressions = compare(results[0],results[1],options.threshold)
+        if regressions:
+            print('%i regression%s' % (len(regressions),'' if len(regressions)==1 else 's'))
+            sys.exit(1)
+        return
+
+    results = run_benchmarks(size_from_options(options),options.repeat)
+    if options.output:
+        with open(options.output,'w',encoding='utf-8') as f:
+            json.dump(results,f,indent=1)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,107 @@
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Load-test the asyncio compile service in ``bin/service.py``.
+
+    A number of stand-in clients make requests at once, as a web app would: a bulk client rebuilds synthetic exams one after another,
+    while preview clients each ask for an exam, wait for it, and pause before asking again.
+    The time taken by each request is reported separately for previews and bulk rebuilds, to show that previews go first.
+
+    Usage: python -m benchmarks.service_load [--workers N] [--concurrency N] [--previews N] [--bulk N] [--timeout S] [size options]
+"""
+
+from . import NUMBAS_PATH
+from .generate import add_size_options, size_from_options, make_exam_source
+import asyncio
+import random
+import time
+from optparse import OptionParser
+
+from service import CompileService, PREVIEW, BULK
+
+def percentile(times,p):
+    if not times:
+        return float('nan')
+    ordered = sorted(times)
+    return ordered[min(len(ordered)-1,int(p*len(ordered)))]
+
+async def preview_client(service,source,requests,think_time,results):
+    """
+        Ask for a preview, wait for it, then pause for up to ``think_time`` seconds before asking again
+    """
+    for i in range(requests):
+        start = time.perf_counter()
+        try:
+            await service.compile_exam(source,priority=PREVIEW)
+            results['preview'].append(time.perf_counter()-start)
+        except asyncio.TimeoutError:
+            results['timeouts'] += 1
+        except Exception:
+            results['errors'] += 1
+        await asyncio.sleep(random.uniform(0,think_time))
+
+async def bulk_client(service,source,requests,results):
+    """
+        Ask for ``requests`` rebuilds all at once, as a batch job would
+    """
+    async def rebuild():
+        start = time.perf_counter()
+        try:
+            await service.compile_exam(source,priority=BULK,zip=True)
+            results['bulk'].append(time.perf_counter()-start)
+        except asyncio.TimeoutError:
+            results['timeouts'] += 1
+        except Exception:
+            results['errors'] += 1
+    await asyncio.gather(*[rebuild() for i in range(requests)])
+
+async def load_test(options,source):
+    results = {'preview': [], 'bulk': [], 'timeouts': 0, 'errors': 0}
+    async with CompileService(workers=options.workers,concurrency=options.concurrency,timeout=options.timeout) as service:
+        # compile once on every worker first, so the time taken to start the processes isn't counted
+        # a cold compile can take longer than the timeout being tested, so there's no time limit on these
+        await asyncio.gather(*[service.compile_exam(source,timeout=None) for i in range(options.workers)])
+
+        start = time.perf_counter()
+        clients = [bulk_client(service,source,options.bulk,results)]
+        clients += [preview_client(service,source,options.preview_requests,options.think_time,results) for i in range(options.previews)]
+        await asyncio.gather(*clients)
+        duration = time.perf_counter()-start
+
+    completed = len(results['preview'])+len(results['bulk'])
+    print('%i requests completed in %.1f s: %.1f per second. %i timed out, %i failed.' % (completed,duration,completed/duration,results['timeouts'],results['errors']))
+    print('%-10s %8s %10s %10s %10s' % ('priority','requests','p50 (ms)','p90 (ms)','max (ms)'))
+    for kind in ('preview','bulk'):
+        times = results[kind]
+        print('%-10s %8i %10.0f %10.0f %10.0f' % (kind,len(times),percentile(times,0.5)*1000,percentile(times,0.9)*1000,max(times or [float('nan')])*1000))
+
+def run():
+    parser = OptionParser(usage="usage: %prog [options]")
+    add_size_options(parser)
+    parser.add_option('--workers',dest='workers',type='int',default=4,help='Number of worker processes')
+    parser.add_option('--concurrency',dest='concurrency',type='int',default=None,help='Number of compiles allowed at once. Defaults to the number of workers.')
+    parser.add_option('--timeout',dest='timeout',type='float',default=None,help='Timeout for each request, in seconds')
+    parser.add_option('--previews',dest='previews',type='int',default=4,help='Number of preview clients')
+    parser.add_option('--preview-requests',dest='preview_requests',type='int',default=5,help='Number of requests made by each preview client')
+    parser.add_option('--think-time',dest='think_time',type='float',default=0.2,help='Longest pause between requests by a preview client, in seconds')
+    parser.add_option('--bulk',dest='bulk',type='int',default=40,help='Number of bulk rebuilds')
+    parser.set_defaults(groups=1,questions=2)
+    (options,args) = parser.parse_args()
+
+    source = make_exam_source(size_from_options(options))
+    asyncio.run(load_test(options,source))
+
+if __name__ == '__main__':
+    run()
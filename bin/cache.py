@@ -0,0 +1,235 @@
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    A cache of compiled packages, stored on disk.
+
+    Each package is stored under a hash of everything that goes into it: the exam source, the contents of the theme and its parents,
+    the extensions and resources the exam uses, the locale files, the options which change the output, and the compiler itself.
+    Any change to one of those gives a different key, so entries never need to be invalidated.
+
+    When the cache grows bigger than its maximum size, the least recently used packages are deleted.
+    Reading a package updates its modification time, so the modification time records when it was last used.
+
+    Compiled theme templates are kept in the ``templates`` directory inside the cache. They count towards its size, and are deleted, oldest first, along with the packages.
+"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+import zlib
+
+# the compile options which change the package that's produced
+OUTPUT_OPTIONS = ['theme','locale','scorm','zip','minify','hash_filenames','gzip','lazy_questions','json_exam','mathjax_url','expect_index_html','followlinks']
+
+# the directory inside the cache where compiled theme templates are kept
+TEMPLATES_DIR = 'templates'
+
+COMPILER_PATH = os.path.dirname(os.path.abspath(__file__))
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+def fingerprint(path,filter=None):
+    """
+        A hash of the contents of the file or directory at ``path``. If ``filter`` is given, only files whose names it accepts are included.
+
+        Reading every file is slow, so the hash is kept, and only recalculated when the size or modification time of a file changes.
+    """
+    if os.path.isdir(path):
+        files = []
+        for root,dirs,names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                if filter is None or filter(name):
+                    files.append(os.path.join(root,name))
+    elif os.path.exists(path):
+        files = [path]
+    else:
+        return None
+
+    signature = []
+    for file in files:
+        stat = os.stat(file)
+        signature.append((os.path.relpath(file,path),stat.st_size,stat.st_mtime_ns))
+    signature = tuple(signature)
+
+    with _fingerprints_lock:
+        known = _fingerprints.get(path)
+    if known is not None and known[0]==signature:
+        return known[1]
+
+    digest = hashlib.sha256()
+    for file,(name,_,_) in zip(files,signature):
+        digest.update(name.encode('utf-8')+b'\0')
+        with open(file,'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    digest = digest.hexdigest()
+
+    with _fingerprints_lock:
+        _fingerprints[path] = (signature,digest)
+    return digest
+
+def compiler_fingerprint(numbas_path):
+    """
+        A hash of the compiler's code, and the runtime and SCORM files it adds to every package
+    """
+    return {
+        'bin': fingerprint(COMPILER_PATH,lambda name: name.endswith('.py')),
+        'runtime': fingerprint(os.path.join(numbas_path,'runtime')),
+        'scormfiles': fingerprint(os.path.join(numbas_path,'scormfiles')),
+    }
+
+def cache_key(compiler):
+    """
+        The key for the package a compiler will produce. The exam must already have been parsed.
+    """
+    options = compiler.options
+    path = options.path
+    resources = [x if isinstance(x,list) else [x,x] for x in compiler.resources]
+    components = {
+        'source': hashlib.sha256(options.source.encode('utf-8')).hexdigest(),
+        'themes': [fingerprint(themepath) for themepath in compiler.themepaths],
+        'extensions': [[x,fingerprint(os.path.join(path,'extensions',x))] for x in compiler.extensions],
+        'resources': [[name,fingerprint(os.path.join(path,src))] for name,src in resources],
+        'locales': fingerprint(os.path.join(path,'locales')),
+        'options': dict((name,getattr(options,name,None)) for name in OUTPUT_OPTIONS),
+        'compiler': compiler_fingerprint(path),
+    }
+    return hashlib.sha256(json.dumps(components,sort_keys=True).encode('utf-8')).hexdigest()
+
+class OutputCache(object):
+    """
+        A cache of packages in ``directory``, holding at most ``max_size`` bytes.
+
+        Each package is stored as an uncompressed zip file. ``stats`` counts the hits, misses, stores and evictions made by this object.
+    """
+    def __init__(self,directory,max_size=1<<30):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        os.makedirs(directory,exist_ok=True)
+
+    def path(self,key):
+        return os.path.join(self.directory,key+'.zip')
+
+    def get(self,key):
+        """
+            The files in the package stored under ``key``, as a dictionary mapping paths to bytes, or None if it isn't in the cache.
+            A package which can't be read, for example because it was cut short, is deleted and counted as a miss.
+        """
+        path = self.path(key)
+        try:
+            with open(path,'rb') as f:
+                data = f.read()
+            with zipfile.ZipFile(io.BytesIO(data)) as z:
+                files = dict((name,z.read(name)) for name in z.namelist())
+            os.utime(path)
+        except (OSError,zipfile.BadZipFile,zlib.error,EOFError):
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            with self.lock:
+                self.stats['misses'] += 1
+            return None
+        with self.lock:
+            self.stats['hits'] += 1
+        return files
+
+    def put(self,key,files):
+        """
+            Store a package under ``key``, then evict old packages if the cache is too big.
+            The package is given as a dictionary mapping the path of each file to a function which writes the file's contents to a binary file object,
+            so each file is streamed into the cache rather than being held in memory.
+        """
+        # write to a temporary file and then rename it, so other processes never see a partly-written package
+        path = self.path(key)
+        tmp_path = '%s.%i.%i.tmp' % (path,os.getpid(),threading.get_ident())
+        try:
+            with zipfile.ZipFile(tmp_path,'w',zipfile.ZIP_STORED) as z:
+                for name in sorted(files):
+                    info = zipfile.ZipInfo(name)
+                    info.external_attr = 0o644<<16
+                    with z.open(info,'w') as f:
+                        files[name](f)
+            os.replace(tmp_path,path)
+        except:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self.lock:
+            self.stats['stores'] += 1
+        self.evict()
+
+    def entries(self):
+        """
+            The packages and compiled templates in the cache, as (modification time, size, path) tuples, least recently used first
+        """
+        templates_dir = os.path.join(self.directory,TEMPLATES_DIR)
+        paths = [os.path.join(self.directory,name) for name in os.listdir(self.directory) if name.endswith('.zip')]
+        if os.path.isdir(templates_dir):
+            paths += [os.path.join(templates_dir,name) for name in os.listdir(templates_dir) if name.endswith('.cache')]
+        entries = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime,stat.st_size,path))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        """
+            Delete the least recently used packages until the cache is no bigger than its maximum size
+        """
+        entries = self.entries()
+        total = sum(size for _,size,_ in entries)
+        for mtime,size,path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self.lock:
+                self.stats['evictions'] += 1
+
+    def size(self):
+        return sum(size for _,size,_ in self.entries())
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(directory,max_size=1<<30):
+    """
+        The ``OutputCache`` for ``directory``. The same object is used for every compile in this process, so its statistics cover all of them.
+    """
+    directory = os.path.abspath(directory)
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = OutputCache(directory,max_size)
+        cache = _caches[directory]
+        cache.max_size = max_size
+        return cache
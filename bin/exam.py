@@ -16,12 +16,17 @@
 
 
 import re
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
 import xml.etree.ElementTree as etree
 from numbasobject import NumbasObject
 from examparser import strcons_fix, strcons
 import sys
 import os
 from htmlescapes import removeHTMLEscapes
+import profiling
 
 class ExamError(Exception):
     def __init__(self,message,hint=''):
@@ -58,6 +63,114 @@ def tryLoad(data,attr,obj,altname=''):
                     else:
                         setattr(obj,altname,data[key])
 
+def percent(value):
+    return strcons_fix(value)+'%'
+
+def commas(values):
+    return strcons_fix(','.join(values))
+
+NO_DEFAULT = object()
+
+# the types of default values which can't be changed in place, so their attribute strings can be worked out in advance
+CONSTANT_TYPES = (bool,int,float,str,type(None))
+
+class Field(object):
+    """
+        A setting loaded from an object's data.
+
+        ``name`` is the setting's key in the data, matched ignoring case, and ``alias`` is the attribute it's loaded into, if that's different.
+        ``type`` turns the value into a string when it's written as an XML attribute: ``strcons``, ``strcons_fix``, ``percent`` or ``commas``.
+        ``default`` is the value the attribute has when the data doesn't give one. Fields without a default are set up by the object's constructor.
+    """
+    def __init__(self,name,alias=None,type=strcons_fix,default=NO_DEFAULT):
+        self.name = name
+        self.alias = alias or name
+        self.type = type
+        self.default = default
+
+def make_loader(fields):
+    """
+        Make a function ``load(obj,data)`` which copies the values of ``fields`` from ``data`` into ``obj``, an object or a dictionary.
+        It returns a dictionary mapping the name of each attribute it set to its value.
+
+        The result is the same as calling ``tryLoad`` for each field - a key which is exactly the field's name in lower case wins, otherwise the last key which matches ignoring case -
+        but the data is only looked through once.
+    """
+    aliases = dict((field.name.lower(),field.alias) for field in fields)
+
+    def load(obj,data):
+        values = {}
+        exact = set()
+        for key,value in data.items():
+            lower = key.lower()
+            alias = aliases.get(lower)
+            if alias is None or alias in exact:
+                continue
+            values[alias] = value
+            if key==lower:
+                exact.add(alias)
+
+        if type(obj)==dict:
+            obj.update(values)
+        else:
+            for alias,value in values.items():
+                setattr(obj,alias,value)
+        return values
+
+    return load
+
+def make_attributes(fields,attributes):
+    """
+        Make a function which gives the XML attributes for an object, or a dictionary, as a dictionary mapping attribute names to strings.
+
+        Each item in ``attributes`` is the name of a field, which is written to an attribute with the field's name in lower case,
+        an ``(attribute, field name)`` pair, or an ``(attribute, attribute of the object, type)`` triple for values which aren't loaded from the data.
+
+        Most values are left at their defaults, so the strings for defaults which can't change are made here, once, and used whenever an object still has the default value.
+    """
+    types = dict((field.alias,field.type) for field in fields)
+    defaults = dict((field.alias,field.default) for field in fields if type(field.default) in CONSTANT_TYPES)
+    spec = []
+    for attribute in attributes:
+        if isinstance(attribute,str):
+            attribute = (attribute.lower(),attribute)
+        if len(attribute)==2:
+            attribute = (attribute[0],attribute[1],types[attribute[1]])
+        name,alias,convert = attribute
+        default = defaults.get(alias,NO_DEFAULT)
+        text = convert(default) if default is not NO_DEFAULT else None
+        spec.append((name,alias,convert,default,text))
+    spec = tuple(spec)
+
+    def make(obj):
+        get = obj.__getitem__ if type(obj)==dict else obj.__getattribute__
+        attributes = {}
+        for name,alias,convert,default,text in spec:
+            value = get(alias)
+            attributes[name] = text if value is default else convert(value)
+        return attributes
+
+    return make
+
+def schema(cls):
+    """
+        Class decorator for a class with a table of ``fields``.
+        Sets the defaults of those fields, and of the fields in any other table whose name ends with ``_fields``, as class attributes, and makes the ``load_fields`` function.
+    """
+    for name,table in list(cls.__dict__.items()):
+        if name=='fields' or name.endswith('_fields'):
+            for field in table:
+                if field.default is not NO_DEFAULT:
+                    setattr(cls,field.alias,field.default)
+    cls.load_fields = make_loader(cls.fields)
+    return cls
+
+def lowerkeys(data):
+    """
+        The keys in ``data``, in lower case
+    """
+    return set(key.lower() for key in data.keys())
+
 #convert a block of content into html, wrapped in a <content> tag
 def makeContentNode(s):
     s=strcons(s)
@@ -116,18 +229,36 @@ def haskey(data,key):
     return False
 
 #exam object
+@schema
 class Exam(object):
-    name = ''                        #title of exam
-    duration = 0                    #allowed time for exam, in seconds
-    percentPass = 0                    #percentage classified as a pass
-    showactualmark = True            #show student's score to student?
-    showtotalmark = True            #show total marks available to student?
-    showanswerstate = True            #show right/wrong on questions?
-    allowrevealanswer = True        #allow student to reveal answer to question?
-    intro = ''                        #text shown on the front page
+    fields = [
+        Field('name',type=strcons,default=''),                      #title of exam
+        Field('duration',default=0),                                #allowed time for exam, in seconds
+        Field('percentPass',type=percent,default=0),                #percentage classified as a pass
+        Field('resources'),
+        Field('extensions'),
+        Field('showQuestionGroupNames',type=strcons,default=False), # show the names of question groups?
+        Field('showstudentname',default=True),
+    ]
+    navigation_fields = [Field(name) for name in ['allowregen','reverse','browse','showfrontpage','showresultspage','preventleave']]
+    timing_fields = [Field('allowPause')]
+    feedback_fields = [
+        Field('showactualmark',default=True),                       #show student's score to student?
+        Field('showtotalmark',default=True),                        #show total marks available to student?
+        Field('showanswerstate',default=True),                      #show right/wrong on questions?
+        Field('allowrevealanswer',default=True),                    #allow student to reveal answer to question?
+        Field('intro',default=''),                                  #text shown on the front page
+    ]
     feedbackMessages = []
-    showQuestionGroupNames = False          # show the names of question groups?
-    showstudentname = True
+
+    load_navigation = make_loader(navigation_fields)
+    load_timing = make_loader(timing_fields)
+    load_feedback = make_loader(feedback_fields)
+
+    exam_attributes = make_attributes(fields,['name',('percentPass','percentPass')])
+    navigation_attributes = make_attributes(navigation_fields,['allowregen','reverse','browse','showfrontpage','showresultspage','preventleave'])
+    feedback_attributes = make_attributes(fields+feedback_fields,['showactualmark','showtotalmark','showanswerstate','allowrevealanswer','showstudentname'])
+    question_groups_attributes = make_attributes(fields,[('showQuestionGroupNames','showQuestionGroupNames')])
 
 
     def __init__(self,name='Untitled Exam'):
@@ -157,40 +288,58 @@ class Exam(object):
 
         self.resources = []
         self.extensions = []
+
+        self.question_cache = None
     
     @staticmethod
-    def fromstring(string):
+    def fromstring(string,question_cache=None):
         exam_object = NumbasObject(string)
-        exam = Exam.fromDATA(exam_object.data)
+        with profiling.stage('Exam.fromDATA'):
+            exam = Exam.fromDATA(exam_object.data,question_cache)
         return exam
 
     @staticmethod
-    def fromDATA(data):
+    def dependencies(data):
+        """
+            The resources and extensions used by the exam with the given data, read without loading the rest of the exam
+        """
+        values = Exam.load_fields({},data)
+        return values.get('resources',[]), values.get('extensions',[])
+
+    @staticmethod
+    def fromDATA(data,question_cache=None):
+        """
+            Load an exam from its data.
+            Questions are loaded and converted to XML through ``question_cache``, so a question which appears more than once is only loaded and converted once.
+            If no cache is given, the exam gets one of its own; give the same cache when loading several exams to share questions between them.
+        """
+        if question_cache is None:
+            question_cache = QuestionCache()
         exam = Exam()
-        tryLoad(data,['name','duration','percentPass','resources','extensions','showQuestionGroupNames','showstudentname'],exam)
+        exam.question_cache = question_cache
+        Exam.load_fields(exam,data)
+        keys = lowerkeys(data)
 
-        if haskey(data,'navigation'):
+        if 'navigation' in keys:
             nav = data['navigation']
-            tryLoad(nav,['allowregen','reverse','browse','showfrontpage','showresultspage','preventleave'],exam.navigation)
+            Exam.load_navigation(exam.navigation,nav)
             if 'onleave' in nav:
-                tryLoad(nav['onleave'],['action','message'],exam.navigation['onleave'])
+                Event.load_fields(exam.navigation['onleave'],nav['onleave'])
 
-        if haskey(data,'timing'):
+        if 'timing' in keys:
             timing = data['timing']
-            tryLoad(timing,['allowPause'],exam.timing)
+            Exam.load_timing(exam.timing,timing)
             for event in ['timeout','timedwarning']:
                 if event in timing:
-                    tryLoad(timing[event],['action','message'],exam.timing[event])
+                    Event.load_fields(exam.timing[event],timing[event])
 
-        if haskey(data,'feedback'):
-            tryLoad(data['feedback'],['showactualmark','showtotalmark','showanswerstate','allowrevealanswer'],exam)
-            if haskey(data['feedback'],'advice'):
-                advice = data['feedback']['advice']
-            tryLoad(data['feedback'],'intro',exam,'intro')
-            if haskey(data['feedback'],'feedbackmessages'):
-                exam.feedbackMessages = [FeedbackMessage.fromDATA(f) for f in data['feedback']['feedbackmessages']]
+        if 'feedback' in keys:
+            feedback = data['feedback']
+            Exam.load_feedback(exam,feedback)
+            if 'feedbackmessages' in lowerkeys(feedback):
+                exam.feedbackMessages = [FeedbackMessage.fromDATA(f) for f in feedback['feedbackmessages']]
 
-        if haskey(data,'rulesets'):
+        if 'rulesets' in keys:
             rulesets = data['rulesets']
             for name in rulesets.keys():
                 l=[]
@@ -201,18 +350,18 @@ class Exam(object):
                         l.append(SimplificationRule.fromDATA(rule))
                 exam.rulesets[name] = l
 
-        if haskey(data,'functions'):
+        if 'functions' in keys:
             functions = data['functions']
             for function in functions.keys():
                 exam.functions.append(Function.fromDATA(function,functions[function]))
 
-        if haskey(data,'variables'):
+        if 'variables' in keys:
             variables = data['variables']
             for variable in variables.keys():
                 exam.variables.append(Variable(variables[variable]))
-        if haskey(data,'question_groups'):
+        if 'question_groups' in keys:
             for question in data['question_groups']:
-                exam.question_groups.append(QuestionGroup.fromDATA(question))
+                exam.question_groups.append(QuestionGroup.fromDATA(question,question_cache))
 
         return exam
 
@@ -232,22 +381,12 @@ class Exam(object):
                             ['variables'],
                             ['question_groups'],
                         ])
-        root.attrib = {
-                'name': strcons(self.name),
-                'percentPass': strcons_fix(self.percentPass)+'%',
-            }
+        root.attrib = self.exam_attributes()
         
         settings = root.find('settings')
 
         nav = settings.find('navigation')
-        nav.attrib = {
-            'allowregen': strcons_fix(self.navigation['allowregen']),
-            'reverse': strcons_fix(self.navigation['reverse']), 
-            'browse': strcons_fix(self.navigation['browse']),
-            'showfrontpage': strcons_fix(self.navigation['showfrontpage']),
-            'showresultspage': strcons_fix(self.navigation['showresultspage']),
-            'preventleave': strcons_fix(self.navigation['preventleave'])
-        }
+        nav.attrib = Exam.navigation_attributes(self.navigation)
 
         nav.append(self.navigation['onleave'].toxml())
 
@@ -260,13 +399,7 @@ class Exam(object):
         timing.append(self.timing['timedwarning'].toxml())
 
         feedback = settings.find('feedback')
-        feedback.attrib = {
-                'showactualmark': strcons_fix(self.showactualmark),
-                'showtotalmark': strcons_fix(self.showtotalmark),
-                'showanswerstate': strcons_fix(self.showanswerstate),
-                'allowrevealanswer': strcons_fix(self.allowrevealanswer),
-                'showstudentname': strcons_fix(self.showstudentname),
-        }
+        feedback.attrib = self.feedback_attributes()
         feedback.find('intro').append(makeContentNode(self.intro))
         feedbackmessages = feedback.find('feedbackmessages')
         for fm in self.feedbackMessages:
@@ -291,26 +424,34 @@ class Exam(object):
             functions.append(function.toxml())
 
         question_groups = root.find('question_groups')
-        question_groups.attrib = {
-            'showQuestionGroupNames': strcons(self.showQuestionGroupNames),
-        }
+        question_groups.attrib = self.question_groups_attributes()
 
         for qg in self.question_groups:
-            question_groups.append(qg.toxml())
+            question_groups.append(qg.toxml(self.question_cache))
 
         return root
 
     def tostring(self):
         try:
-            xml = self.toxml()
-            indent(xml)
-            return(etree.tostring(xml,encoding="UTF-8").decode('utf-8'))
+            with profiling.stage('Exam.toxml'):
+                xml = self.toxml()
+            with profiling.stage('indent'):
+                indent(xml)
+            with profiling.stage('etree.tostring'):
+                string = etree.tostring(xml,encoding="UTF-8").decode('utf-8')
+                profiling.add_bytes(bytes_out=len(string))
+            return string
         except etree.ParseError as err:
             raise ExamError('XML Error: %s' % strcons(err))
 
+@schema
 class SimplificationRule:
-    pattern = ''
-    result = ''
+    fields = [
+        Field('pattern',type=strcons,default=''),
+        Field('conditions'),
+        Field('result',type=strcons,default=''),
+    ]
+    rule_attributes = make_attributes(fields,['pattern','result'])
 
     def __init__(self):
         self.conditions = []
@@ -318,16 +459,14 @@ class SimplificationRule:
     @staticmethod
     def fromDATA(data):
         rule=SimplificationRule()
-        tryLoad(data,['pattern','conditions','result'],rule)
+        SimplificationRule.load_fields(rule,data)
         return rule
 
     def toxml(self):
         rule = makeTree(['ruledef',
                             ['conditions']
                         ])
-        rule.attrib = {    'pattern': strcons(self.pattern),
-                        'result': strcons(self.result)
-                        }
+        rule.attrib = self.rule_attributes()
         conditions = rule.find('conditions')
         for condition in self.conditions:
             conditions.append(etree.fromstring('<condition>'+condition+'</condition>'))
@@ -335,10 +474,13 @@ class SimplificationRule:
         return rule
 
 
+@schema
 class Event:
     kind = ''
-    action = 'none'
-    message = ''
+    fields = [
+        Field('action',type=strcons,default='none'),
+        Field('message',default=''),
+    ]
 
     def __init__(self,kind,action,message):
         self.kind = kind
@@ -351,59 +493,157 @@ class Event:
         event.append(makeContentNode(self.message))
         return event
 
+@schema
 class FeedbackMessage:
-    message = ''
-    threshold = 0
+    fields = [
+        Field('message',default=''),
+        Field('threshold',type=strcons,default=0),
+    ]
+    feedbackmessage_attributes = make_attributes(fields,['threshold'])
 
     @staticmethod
     def fromDATA(data):
         feedbackmessage = FeedbackMessage()
-        tryLoad(data,['message','threshold'],feedbackmessage)
+        FeedbackMessage.load_fields(feedbackmessage,data)
         return feedbackmessage
 
     def toxml(self):
         feedbackmessage = makeTree(['feedbackmessage'])
-        feedbackmessage.attrib = {'threshold': strcons(self.threshold)}
+        feedbackmessage.attrib = self.feedbackmessage_attributes()
         feedbackmessage.append(makeContentNode(self.message))
 
         return feedbackmessage
 
+@schema
 class QuestionGroup:
-    name = ''
-    pickingStrategy = 'all-ordered' # 'all-ordered', ''all-shuffled', 'random-subset'
-    pickQuestions = 0
+    fields = [
+        Field('name',type=strcons,default=''),
+        Field('pickingStrategy',type=strcons,default='all-ordered'), # 'all-ordered', ''all-shuffled', 'random-subset'
+        Field('pickQuestions',type=strcons,default=0),
+    ]
+    question_group_attributes = make_attributes(fields,['name',('pickingStrategy','pickingStrategy'),('pickQuestions','pickQuestions')])
 
     def __init__(self):
         self.questions = []
 
     @staticmethod
-    def fromDATA(data):
+    def fromDATA(data,question_cache=None):
         qg = QuestionGroup()
-        tryLoad(data,['name','pickingStrategy','pickQuestions'],qg)
+        QuestionGroup.load_fields(qg,data)
+        load_question = question_cache.load if question_cache is not None else Question.fromDATA
 
         if 'questions' in data:
             for q in data['questions']:
-                qg.questions.append(Question.fromDATA(q))
+                with profiling.stage('Question.fromDATA'):
+                    qg.questions.append(load_question(q))
 
         return qg
 
-    def toxml(self):
+    def toxml(self,question_cache=None):
         qg = makeTree(['question_group',['questions']])
-        qg.attrib = {
-            'name': strcons(self.name),
-            'pickingStrategy': strcons(self.pickingStrategy),
-            'pickQuestions': strcons(self.pickQuestions),
-        }
+        qg.attrib = self.question_group_attributes()
         questions = qg.find('questions')
+        question_xml = question_cache.toxml if question_cache is not None else Question.toxml
+        # the question's name is only worked out when profiling, as it's only needed to label the stage
+        profiling_active = profiling.active() is not None
         for q in self.questions:
-            questions.append(q.toxml())
+            if profiling_active:
+                with profiling.stage('Question.toxml',question=strcons(q.name)):
+                    questions.append(question_xml(q))
+            else:
+                questions.append(question_xml(q))
 
         return qg
 
+class QuestionCache(object):
+    """
+        Questions which have already been loaded, keyed by a hash of the data they were loaded from, and the XML made from them.
+        A question which appears in several question groups is only loaded and converted to XML once.
+
+        Each exam makes a cache of its own when it's loaded, unless one is given to ``Exam.fromDATA``, so questions are only shared between exams when the caller asks for it,
+        for example by giving the same cache to ``numbas.compile_exam`` for each exam in a batch.
+
+        Keeping a copy of a question's XML takes time and memory, so it's only kept once the question has been loaded more than once.
+
+        At most ``max_size`` questions are kept; the least recently used is forgotten first, along with its XML.
+        The ``Question`` objects returned are shared, so they mustn't be changed.
+    """
+    def __init__(self,max_size=1000):
+        self.max_size = max_size
+        self.questions = OrderedDict()
+        self.uses = {}  # the number of times each question in the cache has been loaded, keyed by the question's id
+        self.xml = {}   # the XML for each question in the cache which has been kept, keyed by the question's id
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'xml hits': 0, 'xml misses': 0}
+
+    def load(self,data):
+        key = hashlib.sha256(repr(data).encode('utf-8')).digest()
+        with self.lock:
+            question = self.questions.get(key)
+            if question is not None:
+                self.questions.move_to_end(key)
+                self.uses[id(question)] += 1
+                self.stats['hits'] += 1
+                return question
+            self.stats['misses'] += 1
+
+        question = Question.fromDATA(data)
+
+        with self.lock:
+            # another thread might have loaded the same question in the meantime: keep the first one, so everyone shares it
+            question = self.questions.setdefault(key,question)
+            self.questions.move_to_end(key)
+            self.uses[id(question)] = self.uses.get(id(question),0) + 1
+            while len(self.questions) > self.max_size:
+                _,forgotten = self.questions.popitem(last=False)
+                del self.uses[id(forgotten)]
+                self.xml.pop(id(forgotten),None)
+        return question
+
+    def toxml(self,question):
+        """
+            The XML for a question. If the question has been loaded through this cache more than once, its XML is only made once:
+            each call returns a copy, so the caller can change it, for example by indenting it.
+        """
+        key = id(question)
+        with self.lock:
+            xml = self.xml.get(key)
+            if xml is not None:
+                self.stats['xml hits'] += 1
+        if xml is not None:
+            return copy.deepcopy(xml)
+
+        xml = question.toxml()
+        with self.lock:
+            # the question might have been forgotten in the meantime
+            if self.uses.get(key,0) > 1:
+                self.stats['xml misses'] += 1
+                self.xml[key] = copy.deepcopy(xml)
+        return xml
+
+    def clear(self):
+        with self.lock:
+            self.questions.clear()
+            self.uses.clear()
+            self.xml.clear()
+
+@schema
 class Question:
-    name = 'Untitled Question'
-    statement =''
-    advice = ''
+    fields = [
+        Field('name',type=strcons,default='Untitled Question'),
+        Field('statement',default=''),
+        Field('advice',default=''),
+    ]
+    variables_test_fields = [
+        Field('condition',type=strcons),
+        Field('maxRuns'),
+    ]
+    preamble_fields = [Field('js'),Field('css')]
+
+    load_variables_test = make_loader(variables_test_fields)
+    load_preamble = make_loader(preamble_fields)
+
+    variables_attributes = make_attributes(variables_test_fields,['condition',('maxRuns','maxRuns')])
 
     def __init__(self,name='Untitled Question'):
         self.name = name
@@ -425,30 +665,31 @@ class Question:
     @staticmethod
     def fromDATA(data):
         question = Question()
-        tryLoad(data,['name','statement','advice'],question)
+        Question.load_fields(question,data)
+        keys = lowerkeys(data)
 
-        if haskey(data,'parts'):
+        if 'parts' in keys:
             parts = data['parts']
             for part in parts:
                 question.parts.append(Part.fromDATA(part))
 
-        if haskey(data,'variables'):
+        if 'variables' in keys:
             variables = data['variables']
             for variable in variables.keys():
                 question.variables.append(Variable(variables[variable]))
 
-        if haskey(data,'variablesTest'):
-            tryLoad(data['variablesTest'],['condition','maxRuns'],question.variablesTest)
+        if 'variablestest' in keys:
+            Question.load_variables_test(question.variablesTest,data['variablesTest'])
         
-        if haskey(data,'functions'):
+        if 'functions' in keys:
             functions = data['functions']
             for function in functions.keys():
                 question.functions.append(Function.fromDATA(function,functions[function]))
 
-        if haskey(data,'preamble'):
-            tryLoad(data['preamble'],['js','css'],question.preamble)
+        if 'preamble' in keys:
+            Question.load_preamble(question.preamble,data['preamble'])
 
-        if haskey(data,'rulesets'):
+        if 'rulesets' in keys:
             rulesets = data['rulesets']
             for name in rulesets.keys():
                 l=[]
@@ -479,15 +720,13 @@ class Question:
 
         parts = question.find('parts')
         for part in self.parts:
-            parts.append(part.toxml())
+            with profiling.stage(type(part).__name__+'.toxml'):
+                parts.append(part.toxml())
 
         variables = question.find('variables')
         for variable in self.variables:
             variables.append(variable.toxml())
-        variables.attrib = {
-            'condition': strcons(self.variablesTest['condition']),
-            'maxRuns': strcons_fix(self.variablesTest['maxRuns']),
-        }
+        variables.attrib = Question.variables_attributes(self.variablesTest)
 
         functions = question.find('functions')
         for function in self.functions:
@@ -536,11 +775,16 @@ class Variable:
         variable.find('value').text = strcons(self.definition)
         return variable
 
+@schema
 class Function:
     name = ''
-    type = ''
-    definition = ''
-    language = 'jme'
+    fields = [
+        Field('parameters'),
+        Field('type',type=strcons,default=''),
+        Field('definition',type=strcons,default=''),
+        Field('language',type=strcons,default='jme'),
+    ]
+    function_attributes = make_attributes(fields,[('name','name',strcons),('outtype','type'),'definition','language'])
 
     def __init__(self,name):
         self.name = name
@@ -549,18 +793,14 @@ class Function:
     @staticmethod
     def fromDATA(name,data):
         function = Function(name)
-        tryLoad(data,['parameters','type','definition','language'],function)
+        Function.load_fields(function,data)
         return function
     
     def toxml(self):
         function = makeTree(['function',
                                 ['parameters']
                             ])
-        function.attrib = { 'name': strcons(self.name),
-                            'outtype': strcons(self.type),
-                            'definition': strcons(self.definition),
-                            'language': strcons(self.language)
-                            }
+        function.attrib = self.function_attributes()
         
         parameters = function.find('parameters')
 
@@ -570,35 +810,40 @@ class Function:
 
         return function
 
+@schema
 class VariableReplacement:
-    variable = ''
-    part = ''
-    must_go_first = False
+    fields = [
+        Field('variable',type=strcons,default=''),
+        Field('part',type=strcons,default=''),
+        Field('must_go_first',default=False),
+    ]
+    replacement_attributes = make_attributes(fields,['variable','part','must_go_first'])
 
     @staticmethod
     def fromDATA(data):
         vr = VariableReplacement()
-        tryLoad(data,['variable','part','must_go_first'],vr)
+        VariableReplacement.load_fields(vr,data)
         return vr
 
     def toxml(self):
         replacement = etree.Element('replace')
-        replacement.attrib = {
-            'variable': strcons(self.variable),
-            'part': strcons(self.part),
-            'must_go_first': strcons_fix(self.must_go_first),
-        }
+        replacement.attrib = self.replacement_attributes()
         return replacement
 
+@schema
 class Part:
-    prompt = ''
     kind = ''
-    stepsPenalty = 0
-    enableMinimumMarks = True
-    minimumMarks = 0
-    showCorrectAnswer = True
-    showFeedbackIcon = True
-    variableReplacementStrategy = 'originalfirst'
+    fields = [
+        Field('marks'),
+        Field('prompt',default=''),
+        Field('stepsPenalty',default=0),
+        Field('minimumMarks',default=0),
+        Field('enableMinimumMarks',default=True),
+        Field('showCorrectAnswer',default=True),
+        Field('showFeedbackIcon',default=True),
+        Field('variableReplacementStrategy',default='originalfirst'),
+    ]
+    part_attributes = make_attributes(fields,[('type','kind',strcons),'marks','stepsPenalty','enableMinimumMarks','minimumMarks','showCorrectAnswer','showFeedbackIcon'])
 
     def __init__(self,marks,prompt=''):
         self.marks = marks
@@ -627,26 +872,23 @@ class Part:
                 'Invalid part type '+kind,
                 'Valid part types are '+', '.join(sorted([x for x in partConstructors]))
             )
-        part = partConstructors[kind].fromDATA(data)
-
-        tryLoad(data,['stepsPenalty','minimumMarks','enableMinimumMarks','showCorrectAnswer','showFeedbackIcon','variableReplacementStrategy'],part);
-
-        if haskey(data,'marks'):
-            part.marks = data['marks']
+        constructor = partConstructors[kind]
+        with profiling.stage(constructor.__name__+'.fromDATA'):
+            part = constructor.fromDATA(data)
 
-        if haskey(data,'prompt'):
-            part.prompt = data['prompt']
+        Part.load_fields(part,data)
+        keys = lowerkeys(data)
 
-        if haskey(data,'steps'):
+        if 'steps' in keys:
             steps = data['steps']
             for step in steps:
                 part.steps.append(Part.fromDATA(step))
 
-        if haskey(data,'scripts'):
+        if 'scripts' in keys:
             for name,script in data['scripts'].items():
                 part.scripts[name] = script
 
-        if haskey(data,'variableReplacements'):
+        if 'variablereplacements' in keys:
             part.variable_replacements = [VariableReplacement.fromDATA(vr) for vr in data['variableReplacements']]
 
         return part
@@ -661,15 +903,7 @@ class Part:
                             ]
                         ])
 
-        part.attrib = {
-            'type': strcons(self.kind), 
-            'marks': strcons_fix(self.marks), 
-            'stepspenalty': strcons_fix(self.stepsPenalty), 
-            'enableminimummarks': strcons_fix(self.enableMinimumMarks), 
-            'minimummarks': strcons_fix(self.minimumMarks), 
-            'showcorrectanswer': strcons_fix(self.showCorrectAnswer),
-            'showfeedbackicon': strcons_fix(self.showFeedbackIcon)
-        }
+        part.attrib = self.part_attributes()
 
         part.find('prompt').append(makeContentNode(self.prompt))
 
@@ -697,18 +931,23 @@ class Part:
 
         return part
 
+@schema
 class JMEPart(Part):
     kind = 'jme'
-    answer = ''
-    answerSimplification = 'basic,unitFactor,unitPower,unitDenominator,zeroFactor,zeroTerm,zeroPower,collectNumbers,zeroBase,constantsFirst,sqrtProduct,sqrtDivision,sqrtSquare,otherNumbers'
-    showPreview = True
-    checkingType = 'RelDiff'
-    checkingAccuracy = 0        #real default value depends on checkingtype - 0.0001 for difference ones, 5 for no. of digits ones
-    failureRate = 1
+    fields = [
+        Field('answer',default=''),
+        Field('answerSimplification',default='basic,unitFactor,unitPower,unitDenominator,zeroFactor,zeroTerm,zeroPower,collectNumbers,zeroBase,constantsFirst,sqrtProduct,sqrtDivision,sqrtSquare,otherNumbers'),
+        Field('showPreview',default=True),
+        Field('checkingType',type=strcons,default='RelDiff'),
+        Field('failureRate',default=1),
+        Field('vsetRangePoints',default=5),
+        Field('checkVariableNames',default=False),
+        Field('checkingAccuracy',default=0),        #real default value depends on checkingtype - 0.0001 for difference ones, 5 for no. of digits ones
+    ]
     vsetRangeStart = 0
     vsetRangeEnd = 1
-    vsetRangePoints = 5
-    checkVariableNames = False
+    answer_attributes = make_attributes(fields,['checkVariableNames',('showPreview','showPreview')])
+    checking_attributes = make_attributes(fields,[('type','checkingType'),('accuracy','checkingAccuracy'),'failureRate'])
 
     def __init__(self,marks=0,prompt=''):
         Part.__init__(self,marks,prompt)
@@ -724,32 +963,32 @@ class JMEPart(Part):
     @staticmethod
     def fromDATA(data):
         part = JMEPart()
-        tryLoad(data,['answer','answerSimplification','showPreview','checkingType','failureRate','vsetRangePoints','checkVariableNames'],part)
+        values = JMEPart.load_fields(part,data)
+        keys = lowerkeys(data)
 
-        #default checking accuracies
-        if part.checkingType.lower() == 'reldiff' or part.checkingType.lower() == 'absdiff':
-            part.checkingAccuracy = 0.0001
-        else:    #dp or sigfig
-            part.checkingAccuracy = 5
-        #get checking accuracy from data, if defined
-        tryLoad(data,'checkingAccuracy',part)
+        #default checking accuracies, if not given in the data
+        if 'checkingAccuracy' not in values:
+            if part.checkingType.lower() == 'reldiff' or part.checkingType.lower() == 'absdiff':
+                part.checkingAccuracy = 0.0001
+            else:    #dp or sigfig
+                part.checkingAccuracy = 5
 
-        if haskey(data,'maxlength'):
+        if 'maxlength' in keys:
             part.maxLength = Restriction.fromDATA('maxlength',data['maxlength'],part.maxLength)
-        if haskey(data,'minlength'):
+        if 'minlength' in keys:
             part.minLength = Restriction.fromDATA('minlength',data['minlength'],part.minLength)
-        if haskey(data,'musthave'):
+        if 'musthave' in keys:
             part.mustHave = Restriction.fromDATA('musthave',data['musthave'],part.mustHave)
-        if haskey(data,'notallowed'):
+        if 'notallowed' in keys:
             part.notAllowed = Restriction.fromDATA('notallowed',data['notallowed'],part.notAllowed)
-        if haskey(data,'expectedvariablenames'):
+        if 'expectedvariablenames' in keys:
             part.expectedVariableNames = Restriction('expectedvariablenames')
             try:
                 part.expectedVariableNames.strings = list(data['expectedvariablenames'])#
             except TypeError:
                 raise ExamError('expected variable names setting %s is not a list' % data['expectedvariablenames'])
 
-        if haskey(data,'vsetrange') and len(data['vsetrange']) == 2:
+        if 'vsetrange' in keys and len(data['vsetrange']) == 2:
             part.vsetRangeStart = data['vsetrange'][0]
             part.vsetRangeEnd = data['vsetrange'][1]
 
@@ -765,20 +1004,13 @@ class JMEPart(Part):
                             ]))
 
         answer = part.find('answer')
-        answer.attrib = {
-                'checkvariablenames': strcons_fix(self.checkVariableNames),
-                'showPreview': strcons_fix(self.showPreview),
-        }
+        answer.attrib = self.answer_attributes()
         correctAnswer = answer.find('correctanswer')
         correctAnswer.attrib = {'simplification': strcons(self.answerSimplification)}
         correctAnswer.find('math').text = strcons(self.answer)
         
         checking = answer.find('checking')
-        checking.attrib = {
-                'type': strcons(self.checkingType),
-                'accuracy': strcons_fix(self.checkingAccuracy),
-                'failurerate': strcons_fix(self.failureRate)
-        }
+        checking.attrib = self.checking_attributes()
         checking.find('range').attrib = {'start': strcons_fix(self.vsetRangeStart), 'end': strcons_fix(self.vsetRangeEnd),  'points': strcons_fix(self.vsetRangePoints)}
         answer.append(self.maxLength.toxml())
         answer.append(self.minLength.toxml())
@@ -788,10 +1020,15 @@ class JMEPart(Part):
         
         return part
 
+@schema
 class Restriction:
-    message = ''
-    length = -1
-    showStrings = False
+    fields = [
+        Field('showStrings',default=False),
+        Field('partialCredit',type=percent),
+        Field('message',default=''),
+        Field('length',default=-1),
+    ]
+    restriction_attributes = make_attributes(fields,['partialCredit','showStrings'])
 
     def __init__(self,name='',partialCredit=0,message=''):
         self.name = name
@@ -803,8 +1040,8 @@ class Restriction:
     def fromDATA(name,data,restriction=None):
         if restriction==None:
             restriction = Restriction(name)
-        tryLoad(data,['showStrings','partialCredit','message','length'],restriction)
-        if haskey(data,'strings'):
+        Restriction.load_fields(restriction,data)
+        if 'strings' in lowerkeys(data):
             for string in data['strings']:
                 restriction.strings.append(string)
 
@@ -813,7 +1050,7 @@ class Restriction:
     def toxml(self):
         restriction = makeTree([self.name,'message'])
 
-        restriction.attrib = {'partialcredit': strcons_fix(self.partialCredit)+'%', 'showstrings': strcons_fix(self.showStrings)}
+        restriction.attrib = self.restriction_attributes()
         if int(self.length)>=0:
             restriction.attrib['length'] = strcons_fix(self.length)
 
@@ -827,13 +1064,17 @@ class Restriction:
         return restriction
 
 
+@schema
 class PatternMatchPart(Part):
     kind = 'patternmatch'
-    caseSensitive = False
-    partialCredit = 0
-    answer = ''
-    displayAnswer = ''
-    matchMode = 'regex'
+    fields = [
+        Field('caseSensitive',default=False),
+        Field('partialCredit',type=percent,default=0),
+        Field('answer',default=''),
+        Field('displayAnswer',default=''),
+        Field('matchMode',default='regex'),
+    ]
+    case_attributes = make_attributes(fields,[('sensitive','caseSensitive'),'partialCredit'])
 
     def __init__(self,marks=0,prompt=''):
         Part.__init__(self,marks,prompt)
@@ -841,7 +1082,7 @@ class PatternMatchPart(Part):
     @staticmethod
     def fromDATA(data):
         part = PatternMatchPart()
-        tryLoad(data,['caseSensitive','partialCredit','answer','displayAnswer','matchMode'],part)
+        PatternMatchPart.load_fields(part,data)
 
         return part
 
@@ -854,32 +1095,36 @@ class PatternMatchPart(Part):
         part.find('correctanswer').text = strcons(self.answer)
         part.find('correctanswer').attrib = {'mode':strcons(self.matchMode)}
 
-        part.find('case').attrib = {'sensitive': strcons_fix(self.caseSensitive), 'partialcredit': strcons_fix(self.partialCredit)+'%'}
+        part.find('case').attrib = self.case_attributes()
 
         return part
 
+@schema
 class NumberEntryPart(Part):
     kind = 'numberentry'
-    allowFractions = False
-    notationStyles = ['en','si-en','plain-en']
-    checkingType = 'range'
-    answer = 0
-    checkingAccuracy = 0
-    minvalue = 0
-    maxvalue = 0
-    correctAnswerFraction = False
-    correctAnswerStyle = 'plain-en'
-    inputStep = 1
-
-    mustBeReduced = False
-    mustBeReducedPC = 0
-
-    precisionType = 'none'
-    precision = 0
-    precisionPartialCredit = 0
-    precisionMessage = ''
-    showPrecisionHint = True
-    strictPrecision = True
+    fields = [
+        Field('correctAnswerFraction',default=False),
+        Field('correctAnswerStyle',default='plain-en'),
+        Field('allowFractions',default=False),
+        Field('notationStyles',type=commas,default=['en','si-en','plain-en']),
+        Field('checkingType',type=strcons,default='range'),
+        Field('inputStep',default=1),
+        Field('mustBeReduced',default=False),
+        Field('mustBeReducedPC',type=percent,default=0),
+        Field('answer',default=0),
+        Field('checkingAccuracy',default=0),
+        Field('minvalue',default=0),
+        Field('maxvalue',default=0),
+
+        Field('precisionType',type=strcons,default='none'),
+        Field('precision',default=0),
+        Field('precisionPartialCredit',type=percent,default=0),
+        Field('precisionMessage',default=''),
+        Field('strictPrecision',default=True),
+        Field('showPrecisionHint',default=True),
+    ]
+    answer_attributes = make_attributes(fields,[('checkingType','checkingType'),'inputStep','allowFractions','notationStyles','correctAnswerFraction','correctAnswerStyle','mustBeReduced','mustBeReducedPC'])
+    precision_attributes = make_attributes(fields,[('type','precisionType'),'precision',('partialcredit','precisionPartialCredit'),('strict','strictPrecision'),'showPrecisionHint'])
 
     def __init__(self,marks=0,prompt=''):
         Part.__init__(self,marks,prompt)
@@ -887,14 +1132,10 @@ class NumberEntryPart(Part):
     @staticmethod
     def fromDATA(data):
         part = NumberEntryPart()
-        tryLoad(data,['correctAnswerFraction','correctAnswerStyle','allowFractions','notationStyles','checkingType','inputStep','mustBeReduced','mustBeReducedPC','precisionType','precision','precisionPartialCredit','precisionMessage','strictPrecision','showPrecisionHint'],part)
-        if part.checkingType == 'range':
-            if haskey(data,'answer'):
-                part.maxvalue = part.minvalue = data['answer']
-            else:
-                tryLoad(data,['minvalue','maxvalue'],part)
-        else:
-            tryLoad(data,['answer','checkingAccuracy'],part)
+        values = NumberEntryPart.load_fields(part,data)
+        # a range part given a single answer accepts only that value
+        if part.checkingType == 'range' and 'answer' in values:
+            part.maxvalue = part.minvalue = values['answer']
 
         return part
 
@@ -906,50 +1147,40 @@ class NumberEntryPart(Part):
                             ))
 
         answer = part.find('answer')
-        answer.attrib = {
-            'checkingType': strcons(self.checkingType),
-            'inputstep': strcons_fix(self.inputStep),
-            'allowfractions': strcons_fix(self.allowFractions),
-            'notationstyles': strcons_fix(','.join(self.notationStyles)),
-            'correctanswerfraction': strcons_fix(self.correctAnswerFraction),
-            'correctanswerstyle': strcons_fix(self.correctAnswerStyle),
-            'mustbereduced': strcons_fix(self.mustBeReduced),
-            'mustbereducedpc': strcons_fix(self.mustBeReducedPC)+'%'
-        }
+        answer.attrib = self.answer_attributes()
         if self.checkingType == 'range':
             answer.attrib['minvalue'] = strcons_fix(self.minvalue)
             answer.attrib['maxvalue'] = strcons_fix(self.maxvalue)
         else:
             answer.attrib['answer'] = strcons_fix(self.answer)
             answer.attrib['accuracy'] = strcons_fix(self.checkingAccuracy)
-        answer.find('precision').attrib = {
-            'type': strcons(self.precisionType), 
-            'precision': strcons_fix(self.precision), 
-            'partialcredit': strcons_fix(self.precisionPartialCredit)+'%',
-            'strict': strcons_fix(self.strictPrecision),
-            'showprecisionhint': strcons_fix(self.showPrecisionHint),
-        }
+        answer.find('precision').attrib = self.precision_attributes()
         answer.find('precision/message').append(makeContentNode(self.precisionMessage))
 
         return part
 
+@schema
 class MatrixEntryPart(Part):
     kind = 'matrix'
-    correctAnswer = ''
-    correctAnswerFractions = False
-    numRows = 3
-    numColumns = 3
-    allowResize = True
-
-    tolerance = 0
-    markPerCell = False
-    allowFractions = False
-
-    precisionType = 'none'
-    precision = 0
-    precisionPartialCredit = 0
-    precisionMessage = ''
-    strictPrecision = True
+    fields = [
+        Field('correctAnswer',type=strcons,default=''),
+        Field('correctAnswerFractions',default=False),
+        Field('numRows',default=3),
+        Field('numColumns',default=3),
+        Field('allowResize',default=True),
+
+        Field('tolerance',default=0),
+        Field('markPerCell',default=False),
+        Field('allowFractions',default=False),
+
+        Field('precisionType',default='none'),
+        Field('precision',default=0),
+        Field('precisionPartialCredit',type=percent,default=0),
+        Field('precisionMessage',default=''),
+        Field('strictPrecision',default=True),
+    ]
+    answer_attributes = make_attributes(fields,['correctAnswer','correctAnswerFractions',('rows','numRows'),('columns','numColumns'),'allowResize','tolerance','markPerCell','allowFractions'])
+    precision_attributes = make_attributes(fields,[('type','precisionType'),'precision',('partialcredit','precisionPartialCredit'),('strict','strictPrecision')])
 
     def __init__(self,marks=0,prompt=''):
         Part.__init__(self,marks,prompt)
@@ -957,7 +1188,7 @@ class MatrixEntryPart(Part):
     @staticmethod
     def fromDATA(data):
         part = MatrixEntryPart()
-        tryLoad(data,['correctAnswer','correctAnswerFractions','numRows','numColumns','allowResize','tolerance','markPerCell','allowFractions','precisionType','precision','precisionPartialCredit','precisionMessage','strictPrecision'],part)
+        MatrixEntryPart.load_fields(part,data)
 
         return part
 
@@ -969,41 +1200,33 @@ class MatrixEntryPart(Part):
         ))
 
         answer = part.find('answer')
-        answer.attrib = {
-            'correctanswer': strcons(self.correctAnswer),
-            'correctanswerfractions': strcons_fix(self.correctAnswerFractions),
-            'rows': strcons_fix(self.numRows),
-            'columns': strcons_fix(self.numColumns),
-            'allowresize': strcons_fix(self.allowResize),
-            'tolerance': strcons_fix(self.tolerance),
-            'markpercell': strcons_fix(self.markPerCell),
-            'allowfractions': strcons_fix(self.allowFractions),
-        }
+        answer.attrib = self.answer_attributes()
 
-        answer.find('precision').attrib = {
-            'type': strcons_fix(self.precisionType), 
-            'precision': strcons_fix(self.precision), 
-            'partialcredit': strcons_fix(self.precisionPartialCredit)+'%',
-            'strict': strcons_fix(self.strictPrecision)
-        }
+        answer.find('precision').attrib = self.precision_attributes()
         answer.find('precision/message').append(makeContentNode(self.precisionMessage))
 
         return part
 
+@schema
 class MultipleChoicePart(Part):
     minMarksEnabled = False
-    minMarks = 0
     maxMarksEnabled = False
-    maxMarks = 0
-    minAnswers = 0
-    maxAnswers = 0
-    shuffleChoices = False
-    shuffleAnswers = False
-    displayType = 'radiogroup'
-    displayColumns = 1
-    warningType = 'none'
-    layoutType = 'all'
-    layoutExpression = ''
+    fields = [
+        Field('minMarks',default=0),
+        Field('maxMarks',default=0),
+        Field('minAnswers',default=0),
+        Field('maxAnswers',default=0),
+        Field('shuffleChoices',default=False),
+        Field('shuffleAnswers',default=False),
+        Field('displayType',type=strcons,default='radiogroup'),
+        Field('displayColumns',default=1),
+        Field('warningType',default='none'),
+    ]
+    layout_fields = [
+        Field('type',alias='layoutType',default='all'),
+        Field('expression',alias='layoutExpression',default=''),
+    ]
+    load_layout = make_loader(layout_fields)
     
     def __init__(self,kind,marks=0,prompt=''):
         self.kind = kind
@@ -1026,35 +1249,35 @@ class MultipleChoicePart(Part):
         }
 
         part.displayType = displayTypes[kind]
-        tryLoad(data,['minMarks','maxMarks','minAnswers','maxAnswers','shuffleChoices','shuffleAnswers','displayType','displayColumns','warningType'],part)
+        values = MultipleChoicePart.load_fields(part,data)
+        keys = lowerkeys(data)
 
-        if haskey(data,'minmarks'):
+        if 'minMarks' in values:
             part.minMarksEnabled = True
-        if haskey(data,'maxmarks'):
+        if 'maxMarks' in values:
             part.maxMarksEnabled = True
 
-        if haskey(data,'choices'):
+        if 'choices' in keys:
             if isinstance(data['choices'],list):
                 part.choices = data['choices'][:]
             else:
                 part.choices = data['choices']
 
-        if haskey(data,'answers'):
+        if 'answers' in keys:
             if isinstance(data['answers'],list):
                 part.answers = data['answers'][:]
             else:
                 part.answers = data['answers']
 
-        if haskey(data,'layout'):
-            tryLoad(data['layout'],'type',part,'layoutType')
-            tryLoad(data['layout'],'expression',part,'layoutExpression')
+        if 'layout' in keys:
+            MultipleChoicePart.load_layout(part,data['layout'])
     
-        if haskey(data,'matrix'):
+        if 'matrix' in keys:
             part.matrix = data['matrix']
             if isinstance(part.matrix,list) and len(part.matrix)>0 and (not isinstance(part.matrix[0],list)):    #so you can give just one row without wrapping it in another array
                 part.matrix = [[x] for x in part.matrix]
 
-        if haskey(data,'distractors'):
+        if 'distractors' in keys:
             part.distractors = data['distractors']
             if len(part.distractors)>0 and (not isinstance(part.distractors[0],list)):
                 part.distractors = [[x] for x in part.distractors]
@@ -1101,18 +1324,34 @@ class MultipleChoicePart(Part):
         if isinstance(self.matrix,str):
             matrix.attrib = {'def': strcons(self.matrix)}
         else:
+            # When every row has the same length, only the cells which aren't 0 are written out, and the runtime fills in the rest.
+            # Grids with many choices and answers would otherwise have a <mark> element for every cell, most of them 0.
+            num_answers = len(self.matrix[0]) if len(self.matrix) else 0
+            sparse = all(len(row)==num_answers for row in self.matrix)
+            if sparse:
+                matrix.attrib = {
+                    'choices': strcons_fix(len(self.matrix)),
+                    'answers': strcons_fix(num_answers),
+                    'default': '0'
+                }
             for i in range(len(self.matrix)):
                 for j in range(len(self.matrix[i])):
+                    value = strcons_fix(self.matrix[i][j])
+                    if sparse and value=='0':
+                        continue
                     mark = etree.Element('mark',{
                         'answerindex': strcons_fix(j), 
                         'choiceindex': strcons_fix(i), 
-                        'value': strcons_fix(self.matrix[i][j])
+                        'value': value
                         })
                     matrix.append(mark)
 
         distractors = marking.find('distractors')
         for i in range(len(self.distractors)):
             for j in range(len(self.distractors[i])):
+                if not strcons(self.distractors[i][j]).strip():
+                    # the runtime treats a missing distractor as an empty message
+                    continue
                 distractor = etree.Element('distractor',{
                     'choiceindex': strcons_fix(i),
                     'answerindex': strcons_fix(j)
@@ -1157,7 +1396,7 @@ class GapFillPart(Part):
     def fromDATA(data):
         part = GapFillPart()
 
-        if haskey(data,'gaps'):
+        if 'gaps' in lowerkeys(data):
             gaps = data['gaps']
             for gap in gaps:
                 part.gaps.append(Part.fromDATA(gap))
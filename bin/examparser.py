@@ -12,7 +12,9 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 import sys
+import io
 import re
+import bisect
 try:
   # For Python > 2.7
   from collections import OrderedDict
@@ -30,12 +32,12 @@ except NameError:
 class ParseError(Exception):
     def __init__(self,parser,message,hint=''):
         self.expression = parser.source[parser.cursor:parser.cursor+50]
-        self.line = parser.source[:parser.cursor].count('\n')+1
+        self.line, self.column = parser.line_column(parser.cursor)
         self.message = message
         self.hint = hint
     
     def __str__(self):
-        msg = '%s at line %s near: \n\t %s ' % (self.message,self.line,self.expression)
+        msg = '%s at line %s, column %s near: \n\t %s ' % (self.message,self.line,self.column,self.expression)
         if self.hint:
             msg += '\nPossible fix: '+self.hint
         return msg
@@ -43,17 +45,77 @@ class ParseError(Exception):
 class ExamParser:
     source = ''
     cursor = 0
+    line_starts = None
+    recover = False
+    closers = None
 
     #parse a string into a data structure
-    def parse(self,source):
+    #if recover is True, parsing carries on after an error, from the start of the next item in the enclosing object or array: the errors are collected in self.errors, and whatever could be parsed is returned
+    def parse(self,source,recover=False):
         self.source = source
         self.cursor = 0
-        self.data = self.getthing()
+        self.line_starts = None
+        self.recover = recover
+        self.errors = []
+        self.closers = []
+        try:
+            self.data = self.getthing()
+        except ParseError as err:
+            self.error(err)
+            self.data = None
         if self.source[self.cursor:].strip()!='':
-            raise ParseError(self,"Didn't parse all input","check for unmatched brackets")
+            self.error(ParseError(self,"Didn't parse all input","check for unmatched brackets"))
 
         return self.data
 
+    #the line and column, both counting from 1, of the character at the given offset in the source
+    def line_column(self,offset):
+        if self.line_starts is None:
+            self.line_starts = [0]+[m.end() for m in re.finditer('\n',self.source)]
+        line = bisect.bisect_right(self.line_starts,offset)
+        return line, offset-self.line_starts[line-1]+1
+
+    #raise an error, or in recovery mode, record it
+    def error(self,err):
+        if not self.recover:
+            raise err
+        self.errors.append(err)
+
+    #after an error in an item of an object or array, move to the start of the next item: past the next comma or line break which isn't inside a nested object or array,
+    #or up to a closing bracket which isn't inside a nested object or array
+    def resynchronise(self,start,closer):
+        depth = 0
+        i = self.cursor
+        n = len(self.source)
+        while i<n:
+            c = self.source[i]
+            if c in '{[':
+                depth += 1
+            elif c in '}]':
+                if depth==0:
+                    break
+                depth -= 1
+            elif depth==0 and (c==',' or c=='\n'):
+                i += 1
+                break
+            i += 1
+        if i<=start and i<n and self.source[i] not in '}]':
+            i = start+1
+        self.cursor = i
+        self.lstripcomments()
+
+    #after resynchronising, decide what to do with the wrong kind of closing bracket, ``other``:
+    #if it closes an enclosing object or array, then this one's closing bracket is missing, so it ends here; otherwise it's a stray bracket, and is skipped.
+    #Returns True if the object or array ends here.
+    def missing_closer(self,other):
+        if self.source[self.cursor:self.cursor+1]!=other:
+            return False
+        if other in self.closers[:-1]:
+            return True
+        self.cursor += 1
+        self.lstripcomments()
+        return False
+
     #scan past comments
     def lstripcomments(self):
         os=self.source[self.cursor:]
@@ -72,6 +134,9 @@ class ExamParser:
     def getthing(self):
         self.lstripcomments()
 
+        if self.cursor>=len(self.source):
+            raise ParseError(self,'Unexpected end of input')
+
         f=self.source[self.cursor]
 
         if f=='{':    #object
@@ -79,41 +144,22 @@ class ExamParser:
             self.lstripcomments()
 
             obj = OrderedDict()
+            self.closers.append('}')
             while self.cursor<len(self.source) and self.source[self.cursor]!='}':
-                i=self.cursor
-                namere = re.compile(r'^[\w_]*\'*$')
-                while i<len(self.source) and self.source[i]!=':':
-                    name = self.source[self.cursor:i+1].strip()
-                    if(not namere.match(name)):
-                        raise ParseError(self,"Invalid name '%s' for an object property" % name,"check for mismatched brackets")
-                    i+=1
-                if i==len(self.source):
-                    raise ParseError(self,"Expected a colon")
-
-                name = self.source[self.cursor:i].rstrip().lower()
-                self.cursor = i+1
-                thing = self.getthing()
-                obj[name] = thing
-
-                self.stripspace()
-
-                if self.source[self.cursor]=='\n':
-                    self.cursor +=1
-                    self.lstripcomments()
-
-                elif self.source[self.cursor:self.cursor+2]=='//':
-                    self.lstripcomments()
-                else:
-                    self.lstripcomments()
-                    if self.source[self.cursor]==',' or self.source[self.cursor]=='\n':
-                        self.cursor+=1
-                        self.lstripcomments()
-                    elif self.source[self.cursor]=='}':
+                start = self.cursor
+                try:
+                    if self.getproperty(obj):
                         break
-                    else:
-                        raise ParseError(self,'Expected either } or , in object definition')
-            if self.cursor == len(self.source):
-                raise ParseError(self,'Expected a } to close an object')
+                except ParseError as err:
+                    self.error(err)
+                    self.resynchronise(start,'}')
+                    if self.missing_closer(']'):
+                        self.closers.pop()
+                        return obj
+            self.closers.pop()
+            if self.cursor >= len(self.source):
+                self.error(ParseError(self,'Expected a } to close an object'))
+                return obj
 
             self.cursor +=1
             return obj
@@ -123,27 +169,22 @@ class ExamParser:
             self.lstripcomments()
 
             arr=[]
+            self.closers.append(']')
             while self.cursor<len(self.source) and self.source[self.cursor]!=']':
-                thing = self.getthing()
-                arr.append(thing)
-
-                self.stripspace()
-
-                if self.source[self.cursor]=='\n':
-                    self.cursor+=1
-                    self.lstripcomments()
-                elif self.source[self.cursor:self.cursor+2]=='//':
-                    self.lstripcomments()
-                else:
-                    self.lstripcomments()
-                    if self.source[self.cursor]==',':
-                        self.cursor +=1
-                    elif self.source[self.cursor]==']':
+                start = self.cursor
+                try:
+                    if self.getitem(arr):
                         break
-                    else:
-                        raise ParseError(self,"Expected either , or ] in array definition")
-            if self.cursor == len(self.source):
-                raise ParseError(self,'Expected a ] to end an array')
+                except ParseError as err:
+                    self.error(err)
+                    self.resynchronise(start,']')
+                    if self.missing_closer('}'):
+                        self.closers.pop()
+                        return arr
+            self.closers.pop()
+            if self.cursor >= len(self.source):
+                self.error(ParseError(self,'Expected a ] to end an array'))
+                return arr
             self.cursor +=1
             return arr
 
@@ -207,68 +248,194 @@ class ExamParser:
             self.cursor = i
             return v
 
+    #parse a property of an object, and the separator after it. Returns True if the object ends after this property
+    def getproperty(self,obj):
+        i=self.cursor
+        namere = re.compile(r'^[\w_]*\'*$')
+        while i<len(self.source) and self.source[i]!=':':
+            name = self.source[self.cursor:i+1].strip()
+            if(not namere.match(name)):
+                raise ParseError(self,"Invalid name '%s' for an object property" % name,"check for mismatched brackets")
+            i+=1
+        if i==len(self.source):
+            raise ParseError(self,"Expected a colon")
+
+        name = self.source[self.cursor:i].rstrip().lower()
+        self.cursor = i+1
+        thing = self.getthing()
+        obj[name] = thing
+
+        self.stripspace()
+
+        if self.source[self.cursor:self.cursor+1]=='\n':
+            self.cursor +=1
+            self.lstripcomments()
+
+        elif self.source[self.cursor:self.cursor+2]=='//':
+            self.lstripcomments()
+        else:
+            self.lstripcomments()
+            if self.source[self.cursor:self.cursor+1] in (',','\n'):
+                self.cursor+=1
+                self.lstripcomments()
+            elif self.source[self.cursor:self.cursor+1]=='}':
+                return True
+            else:
+                raise ParseError(self,'Expected either } or , in object definition')
+        return False
+
+    #parse an item of an array, and the separator after it. Returns True if the array ends after this item
+    def getitem(self,arr):
+        thing = self.getthing()
+        arr.append(thing)
+
+        self.stripspace()
+
+        if self.source[self.cursor:self.cursor+1]=='\n':
+            self.cursor+=1
+            self.lstripcomments()
+        elif self.source[self.cursor:self.cursor+2]=='//':
+            self.lstripcomments()
+        else:
+            self.lstripcomments()
+            if self.source[self.cursor:self.cursor+1]==',':
+                self.cursor +=1
+            elif self.source[self.cursor:self.cursor+1]==']':
+                return True
+            else:
+                raise ParseError(self,"Expected either , or ] in array definition")
+        return False
+
 def printdata(data,ntabs=0):
-    tabs = ntabs*'\t'
+    out = io.StringIO()
+    writedata(data,out)
+    return out.getvalue()
+
+def writedata(data,out):
+    """
+        Write data to the file-like object out, in the same format as printdata.
+
+        Whether a dictionary or list is written over several lines depends on everything inside it, so that's worked out for every container first.
+        The text is then written piece by piece, so it takes time in proportion to its length and is never held in memory all at once.
+    """
+    multiline = {}
+    find_multiline(data,multiline)
+    write_value(data,out,multiline)
+
+def is_container(data):
+    return type(data)==dict or type(data)==list
+
+def find_multiline(data,multiline):
+    """
+        Does the output for data contain a line break?
+        The answer for each dictionary and list inside data is stored in multiline, keyed by id.
+    """
     if type(data)==dict or type(data)==OrderedDict:
-        s=''
+        result = len(data)>1
+        for x,value in data.items():
+            if find_multiline(value,multiline) or is_container(value) or '\n' in x:
+                result = True
+        multiline[id(data)] = result
+        return result
+    elif type(data)==list:
+        result = False
+        for x in data:
+            if find_multiline(x,multiline) or is_container(x):
+                result = True
+        multiline[id(data)] = result
+        return result
+    elif isinstance(data,basestring):
+        return '\n' in data
+    elif data is None or isinstance(data,(bool,int,float)):
+        return False
+    else:
+        return '\n' in printscalar(data)
+
+def write_value(data,out,multiline):
+    if type(data)==dict or type(data)==OrderedDict:
+        lines = multiline[id(data)]
+        out.write('{\n' if lines else '{')
         first=True
-        for x in data.keys():
+        for x,value in data.items():
             if not first:
-                s+='\n'
-            if type(data[x])==dict or type(data[x])==list:
-                s+='\n'
-            s+=x+': '+printdata(data[x],ntabs+1)
+                out.write('\n')
+            if is_container(value):
+                out.write('\n')
+            out.write(x+': ')
+            write_value(value,out,multiline)
             first=False
-        if '\n' in s: 
-            s='{\n'+s+'\n'+'}'
-        else:
-            s='{'+s+'}'
-        return s
+        out.write('\n}' if lines else '}')
     elif type(data)==list:
-        s=''
+        lines = multiline[id(data)]
+        out.write('[\n' if lines else '[')
+        # after the first line break, each item goes on a new line
+        broken = False
         first=True
         for x in data:
             if not first:
-                s+=', '
-                if '\n' in s:
-                    s+='\n'
-            if type(x)==dict or type(x)==list:
-                s+='\n'
-            s+=printdata(x,ntabs+1)
+                out.write(', \n' if broken else ', ')
+            if is_container(x):
+                out.write('\n')
+                broken = True
+            write_value(x,out,multiline)
+            if not broken:
+                broken = multiline[id(x)] if id(x) in multiline else find_multiline(x,multiline)
             first=False
-        if '\n' in s: 
-            s='[\n'+s+'\n'+']'
-        else:
-            s='['+s+']'
-        return s
+        out.write('\n]' if lines else ']')
     else:
-        if data=='infinity':
-            return '"infinity"'
-        if '"' in strcons(data) and not isinstance(data,basestring):
-            print("Unexpected type: "+str)
-
-        if isinstance(data,basestring) and ('\n' in data or '}' in data or ']' in data or ',' in data or '"' in data or "'" in data or ':' in data or '//' in data):
-            if '"' in data:
-                return '"""'+data+'"""'
-            else:
-                return '"'+data+'"'
-        elif isinstance(data,basestring) and data.strip()=='':
-            return "'"+data+"'"
+        out.write(printscalar(data))
+
+def printscalar(data):
+    if data=='infinity':
+        return '"infinity"'
+    if '"' in strcons(data) and not isinstance(data,basestring):
+        print("Unexpected type: "+str)
+
+    if isinstance(data,basestring) and ('\n' in data or '}' in data or ']' in data or ',' in data or '"' in data or "'" in data or ':' in data or '//' in data):
+        if '"' in data:
+            return '"""'+data+'"""'
         else:
-            return strcons_fix(data)
+            return '"'+data+'"'
+    elif isinstance(data,basestring) and data.strip()=='':
+        return "'"+data+"'"
+    else:
+        return strcons_fix(data)
 
 
 #utility functions
 
 """Cast data to string. Forces fixed precision output of floats, instead of scientific notation"""
 def strcons_fix(data):
+    # the common types are dealt with straight away: anything else goes through the general conversion
+    kind = type(data)
+    if kind is str:
+        start = data.lstrip()[:1]
+        if not (start in NUMBER_START or start.isdigit()):
+            return data
+    elif kind is bool:
+        return 'True' if data else 'False'
+    elif kind is int:
+        return '%i' % data
+    elif kind is float:
+        if data.is_integer():
+            return '%i' % int(data)
+        return fix_decimal('%.14f' % data)
+    return convert_fix(data)
+
+#characters other than digits which a number can start with
+NUMBER_START = set('+-.iInN')
+
+trailing_zeros_re = re.compile(r'(\.\d*[1-9])0*$')
+def fix_decimal(s):
+    return trailing_zeros_re.sub(r'\g<1>',s)
+
+def convert_fix(data):
     if (data is True) or (data is False):
         out=data
     elif is_int(data):
         out = '%i' % int(data)
     elif is_number(data):
-        out = '%.14f' % float(data)
-        out = re.sub(r'(\.\d*[1-9])0*$','\g<1>',out)
+        out = fix_decimal('%.14f' % float(data))
     else:
         out=data
     return strcons(out)
@@ -269,8 +269,12 @@ escapes = {
 '&euro;': '&#8364;'
 }
 
+named_escape_re = re.compile(r'&\w+;')
+
 def removeHTMLEscapes(s):
-    for name,code in escapes.items():
-        s = s.replace(name,code)
+    # every named escape looks like &name; and is replaced with a numeric one, so they can all be replaced in one pass
+    if '&' not in s:
+        return s
+    s = named_escape_re.sub(lambda m: escapes.get(m.group(0),m.group(0)),s)
     s = re.sub(r'&(?!(?:\w|#)+;)','&#38;',s)
     return s
@@ -15,22 +15,19 @@
 #   limitations under the License.
 
 
-import datetime
+# Only the modules needed to parse the command line are imported here, so that the script starts quickly.
+# The modules used by each stage of the compilation are imported when the stage runs.
+import abc
+import copy
 import os
 import io
 import sys
-import traceback
-import shutil
+import threading
 from optparse import OptionParser
-import examparser
-from exam import Exam,ExamError
-import xml2js
-from zipfile import ZipFile, ZipInfo
-import xml.etree.ElementTree as etree
+import profiling
 from itertools import count
-import subprocess
-import json
-import jinja2
+
+NUMBAS_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
 namespaces = {
@@ -42,11 +39,37 @@ namespaces = {
     'imsss': 'http://www.imsglobal.org/xsd/imsss',
 }
 
-# because pre-py3.2 versions of etree always put a colon in front of tag names
-# from http://stackoverflow.com/questions/8113296/supressing-namespace-prefixes-in-elementtree-1-2
-if etree.VERSION[0:3] == '1.2':
-    #in etree < 1.3, this is a workaround for supressing prefixes
+_namespaces_registered = False
+_namespaces_lock = threading.Lock()
 
+def register_namespaces():
+    """
+        Register the prefixes of the namespaces used in the SCORM manifest with ElementTree.
+        The registry is global, so this is only done once, by whichever thread gets here first.
+    """
+    global _namespaces_registered
+    with _namespaces_lock:
+        if not _namespaces_registered:
+            _register_namespaces()
+            _namespaces_registered = True
+
+def _register_namespaces():
+    import xml.etree.ElementTree as etree
+
+    # because pre-py3.2 versions of etree always put a colon in front of tag names
+    # from http://stackoverflow.com/questions/8113296/supressing-namespace-prefixes-in-elementtree-1-2
+    if etree.VERSION[0:3] == '1.2':
+        #in etree < 1.3, this is a workaround for supressing prefixes
+        register_namespaces_etree_1_2(etree)
+    else:
+        #For etree > 1.3, use register_namespace function
+        for ns,url in namespaces.items():
+            try:
+                etree.register_namespace(ns,url)        
+            except AttributeError:
+                etree._namespace_map[url]=ns
+
+def register_namespaces_etree_1_2(etree):
     def fixtag(tag, namespaces):
         import string
         # given a decorated tag (of the form {uri}tag), return prefixed
@@ -80,13 +103,6 @@ if etree.VERSION[0:3] == '1.2':
     etree.fixtag = fixtag
     for ns,url in namespaces.items():
         etree._namespace_map[url] = ns if len(ns) else None
-else:
-    #For etree > 1.3, use register_namespace function
-    for ns,url in namespaces.items():
-        try:
-            etree.register_namespace(ns,url)        
-        except AttributeError:
-            etree._namespace_map[url]=ns
 
 
 try:
@@ -100,18 +116,323 @@ def realFile(file):
     """
     return not (file[-1]=='~' or file[-4:]=='.swp')
 
+# files are copied this many bytes at a time
+CHUNK_SIZE = 1<<16
+
+class LazyFile(abc.ABC):
+    """
+        A file in the package whose contents aren't made until they're needed
+    """
+    @abc.abstractmethod
+    def write(self,f):
+        """
+            Write the contents, as bytes, to the binary file object ``f``, a piece at a time, so the whole file is never held in memory
+        """
+
+class Bundle(LazyFile):
+    """
+        A text file made by joining the files ``sources`` together, with a line break between each one.
+        Files on disk are read as text, so their line endings are normalised.
+    """
+    def __init__(self,sources):
+        self.sources = sources
+
+    def write(self,f):
+        for i,src in enumerate(self.sources):
+            if i>0:
+                f.write(b'\n')
+            if isinstance(src,basestring):
+                with open(src,encoding='utf-8') as part:
+                    for chunk in iter(lambda: part.read(CHUNK_SIZE),''):
+                        f.write(chunk.encode('utf-8'))
+            else:
+                write_file(src,f)
+
+class GeneratedTextFile(LazyFile):
+    """
+        A text file whose contents are made by calling ``generate`` with a text file object to write them to
+    """
+    def __init__(self,generate):
+        self.generate = generate
+
+    def write(self,f):
+        self.generate(EncodingWriter(f))
+
+class EncodingWriter(object):
+    """
+        A text file object which encodes the strings written to it as UTF-8 and writes them to the binary file object ``f``
+    """
+    def __init__(self,f):
+        self.f = f
+
+    def write(self,s):
+        self.f.write(s.encode('utf-8'))
+        return len(s)
+
+class ByteSink(object):
+    """
+        A binary file object which counts the bytes written to it, and passes them on to ``callback``, if it's given
+    """
+    def __init__(self,callback=None):
+        self.callback = callback
+        self.size = 0
+
+    def write(self,data):
+        self.size += len(data)
+        if self.callback is not None:
+            self.callback(data)
+        return len(data)
+
+def write_file(src,f):
+    """
+        Write the contents of a file in the package, as bytes, to the binary file object ``f``
+    """
+    if isinstance(src,basestring):
+        import shutil
+        with open(src,'rb') as s:
+            shutil.copyfileobj(s,f,CHUNK_SIZE)
+    elif isinstance(src,LazyFile):
+        src.write(f)
+    elif isinstance(src,io.BytesIO):
+        f.write(src.getvalue())
+    else:
+        f.write(src.getvalue().encode('utf-8'))
+
+def file_contents(src):
+    """
+        Get the text of a file in the package, which is either the path to a file on disk, a StringIO buffer or a ``LazyFile``
+    """
+    if isinstance(src,basestring):
+        with open(src,encoding='utf-8') as f:
+            return f.read()
+    elif isinstance(src,LazyFile):
+        return file_bytes(src).decode('utf-8')
+    else:
+        return src.getvalue()
+
+def file_bytes(src):
+    """
+        Get the contents of a file in the package, as bytes
+    """
+    if isinstance(src,basestring):
+        with open(src,'rb') as f:
+            return f.read()
+    elif isinstance(src,io.BytesIO):
+        return src.getvalue()
+    elif isinstance(src,LazyFile):
+        out = io.BytesIO()
+        src.write(out)
+        return out.getvalue()
+    else:
+        return src.getvalue().encode('utf-8')
+
+def file_digest(src):
+    """
+        The SHA-256 hash of the contents of a file in the package, worked out without reading the whole file into memory
+    """
+    import hashlib
+    digest = hashlib.sha256()
+    write_file(src,ByteSink(digest.update))
+    return digest.hexdigest()
+
+def package_path(dst):
+    """
+        The path of a file in the package, relative to the top of the package and separated with forward slashes
+    """
+    return os.path.normpath(dst).replace(os.sep,'/')
+
+def question_file_path(group_number,question_number):
+    """
+        The path of the file holding a question's XML, when each question is in a separate file
+    """
+    return os.path.join('.','questions','{}-{}.xml'.format(group_number,question_number))
+
+def file_size(src):
+    """
+        Get the size in bytes of a file in the package
+    """
+    if isinstance(src,basestring):
+        return os.path.getsize(src)
+    elif isinstance(src,io.BytesIO):
+        return len(src.getvalue())
+    elif isinstance(src,LazyFile):
+        sink = ByteSink()
+        src.write(sink)
+        return sink.size
+    else:
+        return len(src.getvalue().encode('utf-8'))
+
 
 class CompileError(Exception):
     def __init__(self, message, stdout='', stderr='', code=0):
-        super(CompileError, self).__init__()
+        super(CompileError, self).__init__(message)
         self.message = message
     def __str__(self):
         return 'Compilation error: {}'.format(self.message)
 
+class CompileOptions(object):
+    """
+        Options for compiling an exam with ``compile_exam``, given as keyword arguments.
+
+        These are the same as the command-line options, except that by default the package is kept in memory (``output`` is None), 
+        nothing is printed (``quiet`` is True), and ``path`` is the Numbas installation containing this file rather than the current directory.
+        Each option must have the same type as its default, or be None where the default is None.
+    """
+    source = ''
+    theme = 'default'
+    followlinks = False
+    action = 'update'
+    zip = False
+    scorm = False
+    path = NUMBAS_PATH
+    output = None
+    locale = 'en-GB'
+    minify = ''
+    expect_index_html = True
+    hash_filenames = False
+    gzip = False
+    lazy_questions = False
+    json_exam = False
+    profile = None
+    profile_memory = None
+    size_report = None
+    size_budgets = ()
+    mathjax_url = 'https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.0'
+    quiet = True
+    cache = None
+    cache_size = 1<<30
+    jobs = 8
+
+    def __init__(self,**kwargs):
+        for name,value in kwargs.items():
+            if not hasattr(CompileOptions,name) or name.startswith('_'):
+                raise TypeError("Unknown compile option %s" % name)
+            default = getattr(CompileOptions,name)
+            if default is None:
+                valid = value is None or isinstance(value,basestring)
+            elif isinstance(default,tuple):
+                valid = isinstance(value,(tuple,list))
+            else:
+                valid = type(value)==type(default)
+            if not valid:
+                raise TypeError("The compile option %s should be a %s, not %r" % (name,type(default).__name__ if default is not None else 'string or None',value))
+            setattr(self,name,value)
+
+    def todict(self):
+        """
+            The values of all the options, as a dictionary
+        """
+        return dict((name,getattr(self,name)) for name in dir(CompileOptions) if not name.startswith('_') and not callable(getattr(CompileOptions,name)))
+
+    def copy(self,**kwargs):
+        """
+            A copy of these options, with the given options changed
+        """
+        options = self.todict()
+        options.update(kwargs)
+        return CompileOptions(**options)
+
+def compile_exam(source,options=None,question_cache=None,**kwargs):
+    """
+        Compile an exam from its source, without writing the package to disk.
+
+        Options can be given as a ``CompileOptions`` object, or as keyword arguments, which override those in ``options``.
+        Returns a dictionary mapping the path of each file in the package to its contents as bytes, or, if the ``zip`` option is set, a ``BytesIO`` containing the package as a zip file.
+
+        To load and convert each question only once when compiling a batch of exams which share questions, give the same ``exam.QuestionCache`` as ``question_cache`` for each one.
+
+        This is safe to call from several threads at once.
+    """
+    if options is None:
+        options = CompileOptions()
+    options = options.copy(source=source,output=None,**kwargs)
+    return NumbasCompiler(options,question_cache).compile()
+
+def compile_exam_variants(source,themes,locales,options=None,question_cache=None,**kwargs):
+    """
+        Compile an exam with every combination of the given themes and locales, without writing the packages to disk.
+        Returns a dictionary mapping each (theme, locale) pair to a package, as returned by ``compile_exam``.
+    """
+    if options is None:
+        options = CompileOptions()
+    options = options.copy(source=source,output=None,**kwargs)
+    return compile_variants(options,themes,locales,question_cache)
+
+def variant_name(theme,locale):
+    return '{}-{}'.format(os.path.basename(os.path.normpath(theme)),locale)
+
+def variant_path(path,name):
+    """
+        Add the name of a variant to a file path, before its extension
+    """
+    root,ext = os.path.splitext(path)
+    return '{}-{}{}'.format(root,name,ext)
+
+def compile_variants(options,themes,locales,question_cache=None):
+    """
+        Compile the exam in ``options.source`` with every combination of the given themes and locales.
+
+        The exam is parsed and converted to XML once, and the result is used for every variant.
+        Its questions are loaded through ``question_cache``, if it's given, so they can be shared with other exams.
+        If ``options.output`` is set, it's a directory which will contain a directory or .zip file for each variant, named ``<theme>-<locale>``, 
+        and the paths of the profile and size reports have the variant's name added.
+        Returns a dictionary mapping each (theme, locale) pair to the result of ``NumbasCompiler.compile``.
+    """
+    if options.output is not None:
+        os.makedirs(options.output,exist_ok=True)
+
+    packages = {}
+    parsed = None
+    for theme in themes:
+        for locale in locales:
+            variant_options = copy.copy(options)
+            variant_options.theme = theme
+            variant_options.locale = locale
+            if options.output is not None:
+                name = variant_name(theme,locale)
+                variant_options.output = os.path.join(options.output,name+('.zip' if options.zip else ''))
+                for option in ('profile','profile_memory','size_report'):
+                    if getattr(options,option):
+                        setattr(variant_options,option,variant_path(getattr(options,option),name))
+
+            compiler = NumbasCompiler(variant_options,question_cache)
+            if parsed is not None:
+                compiler.use_parsed_exam(parsed)
+            packages[(theme,locale)] = compiler.compile()
+            if parsed is None or parsed.exam is None:
+                parsed = compiler
+    return packages
+
 class NumbasCompiler(object):
-    def __init__(self,options):
+    """
+        Compiles the exam in ``options.source``.
+        If ``question_cache`` is given, the exam's questions are loaded and converted to XML through it, so that questions shared with other exams compiled with the same cache are only handled once.
+    """
+    def __init__(self,options,question_cache=None):
         self.options = options
+        self.question_cache = question_cache
         self.get_themepaths()
+        self.exam_data = None
+        self.exam = None
+        self.examXML = None
+
+    def use_parsed_exam(self,compiler):
+        """
+            Use the exam already parsed by another compiler, instead of parsing the source again.
+            If the other compiler found its package in the cache, it only read the exam's data, so this compiler loads the exam if it needs it.
+        """
+        self.exam_data = compiler.exam_data
+        self.exam = compiler.exam
+        self.examXML = compiler.examXML
+        self.resources = compiler.resources
+        self.extensions = compiler.extensions
+
+    def log(self,message):
+        """
+            Print a message, unless the quiet option is set
+        """
+        if not getattr(self.options,'quiet',False):
+            print(message)
 
     def get_themepaths(self):
         self.themepaths = [self.options.theme]
@@ -134,42 +455,126 @@ class NumbasCompiler(object):
                 raise CompileError("Couldn't find theme %s" % theme)
 
     def compile(self):
-        self.parse_exam()
+        """
+            Compile the exam. If ``options.output`` is None, the package is returned instead of being written to disk: see ``compileToMemory``.
+        """
+        self.package = None
+
+        profiler = None
+        if self.options.profile or self.options.profile_memory:
+            profiler = profiling.Profiler(memory=bool(self.options.profile_memory))
+
+        with profiling.activate(profiler):
+            with profiling.stage('compile'):
+                self.compile_stages()
+
+        if self.options.profile:
+            profiler.write_trace(self.options.profile)
+            self.log(profiler.summary())
+            self.log("Profile trace written to %s" % os.path.relpath(self.options.profile))
+        if self.options.profile_memory:
+            profiler.write_memory_report(self.options.profile_memory)
+            self.log("Memory profile written to %s" % os.path.relpath(self.options.profile_memory))
+
+        if self.options.size_report or self.options.size_budgets:
+            self.check_sizes()
+
+        return self.package
+
+    def compile_stages(self):
+        self.files = {}
+
+        if self.exam_data is None:
+            self.run_stage('parse_source',self.parse_source)
+
+        # the size report needs information from every stage, so a cached package can't be used
+        self.use_cache = self.options.cache is not None and not (self.options.size_report or self.options.size_budgets)
+        self.cache_hit = False
+        if self.use_cache:
+            self.run_stage('cache_lookup',self.cache_lookup)
+
+        if not self.cache_hit:
+            if self.exam is None:
+                self.run_stage('load_exam',self.load_exam)
+            self.build_stages()
+            if self.use_cache:
+                self.run_stage('cache_store',self.cache_store)
+
+        if self.use_cache:
+            self.log("Output cache: %(hits)i hits, %(misses)i misses, %(stores)i stores, %(evictions)i evictions" % self.cache.stats)
+
+        if self.options.output is None:
+            self.run_stage('compileToMemory',self.compileToMemory,output=True)
+        elif self.options.zip:
+            self.run_stage('compileToZip',self.compileToZip,output=True)
+        else:
+            self.run_stage('compileToDir',self.compileToDir,output=True)
+
+    def build_stages(self):
+        """
+            Make all the files in the package
+        """
+        self.run_stage('collect_files',lambda: self.files.update(self.collect_files()))
 
-        files = self.files = self.collect_files()
+        self.run_stage('render_templates',self.render_templates)
 
-        self.render_templates()
+        self.run_stage('make_xml',self.make_xml)
 
-        self.make_xml()
-        files[os.path.join('.','settings.js')] = io.StringIO(self.xmls)
+        self.run_stage('make_locale_file',self.make_locale_file)
 
-        self.make_locale_file()
+        self.run_stage('add_source',self.add_source)
 
-        self.add_source()
+        self.run_stage('collect_stylesheets',self.collect_stylesheets)
+        self.run_stage('collect_scripts',self.collect_scripts)
+
+        if self.options.minify:
+            self.run_stage('minify',self.minify)
+
+        if self.options.hash_filenames:
+            self.run_stage('hash_filenames',self.hash_filenames)
+
+        if self.options.gzip:
+            self.run_stage('gzip_files',self.gzip_files)
 
         if self.options.scorm:
-            self.add_scorm()
+            self.run_stage('add_scorm',self.add_scorm)
 
-        self.collect_stylesheets()
-        self.collect_scripts()
+    def run_stage(self,name,fn,output=False):
+        """
+            Run a stage of the compilation.
 
-        if self.options.minify:
-            self.minify()
-            
-        if self.options.zip:
-            self.compileToZip()
-        else:
-            self.compileToDir()
+            When profiling, the sizes of the files that the stage removes or replaces are recorded as the bytes going into it, and the sizes of the files it adds as the bytes coming out.
+            Output stages take in every file in the package.
+            Measuring a generated file means generating it, so the sizes are measured outside the stage's timing.
+        """
+        with profiling.stage(name) as stage:
+            if stage is None:
+                fn()
+                return
+            if output:
+                with profiling.untimed():
+                    stage.bytes_in += sum(file_size(src) for src in self.files.values())
+                fn()
+            else:
+                before = dict(self.files)
+                fn()
+                with profiling.untimed():
+                    stage.bytes_in += sum(file_size(src) for dst,src in before.items() if self.files.get(dst) is not src)
+                    stage.bytes_out += sum(file_size(src) for dst,src in self.files.items() if before.get(dst) is not src)
 
-    def parse_exam(self):
+    def parse_source(self):
         """
-            Parse an exam definition from the given source
+            Parse the exam's source into its data, and read the resources and extensions it uses, which are all the cache needs to know about the exam.
+            The rest of the exam is only loaded by ``load_exam`` if the package isn't in the cache.
         """
+        import examparser
+        from exam import Exam,ExamError
+        from numbasobject import NumbasObject
+
         try:
-            self.exam = Exam.fromstring(self.options.source)
-            self.examXML = self.exam.tostring()
-            self.resources = self.exam.resources
-            self.extensions = self.exam.extensions
+            self.exam_data = NumbasObject(self.options.source).data
+            self.resources, self.extensions = Exam.dependencies(self.exam_data)
+            profiling.add_bytes(bytes_in=len(self.options.source))
         except ExamError as err:
             raise CompileError('Error constructing exam:\n%s' % err)
         except examparser.ParseError as err:
@@ -177,10 +582,49 @@ class NumbasCompiler(object):
         except:
             raise CompileError('Failed to compile exam.')
 
-    def collect_files(self,dirs=[('runtime','.')]):
+    def load_exam(self):
+        """
+            Load the exam from its data, and convert it to XML
+        """
+        from exam import Exam,ExamError
+
+        try:
+            with profiling.stage('Exam.fromDATA'):
+                self.exam = Exam.fromDATA(self.exam_data,self.question_cache)
+            with profiling.stage('Exam.tostring'):
+                self.examXML = self.exam.tostring()
+            profiling.add_bytes(bytes_out=len(self.examXML))
+        except ExamError as err:
+            raise CompileError('Error constructing exam:\n%s' % err)
+        except:
+            raise CompileError('Failed to compile exam.')
+
+    def cache_lookup(self):
+        """
+            If the package for this exam and these options is in the cache, use it
+        """
+        import cache
+
+        self.cache = cache.get_cache(self.options.cache,self.options.cache_size)
+        self.cache_key = cache.cache_key(self)
+        files = self.cache.get(self.cache_key)
+        if files is not None:
+            self.cache_hit = True
+            self.files = dict((os.path.join('.',*path.split('/')),io.BytesIO(data)) for path,data in files.items())
+            self.log("Using the cached package %s" % self.cache_key)
+
+    def cache_store(self):
+        """
+            Store the package in the cache. Each file is streamed into the cache, rather than being read into memory first.
+        """
+        import functools
+        self.cache.put(self.cache_key,dict((package_path(dst),functools.partial(write_file,src)) for dst,src in self.files.items()))
+
+    def collect_files(self,dirs=None):
         """
             Collect files from the given directories to be included in the compiled package
         """
+        dirs = [('runtime','.')] if dirs is None else list(dirs)
         resources = [x if isinstance(x,list) else [x,x] for x in self.resources]
 
         for name,path in resources:
@@ -199,6 +643,18 @@ class NumbasCompiler(object):
         for themepath in self.themepaths:
             dirs.append((os.path.join(themepath,'files'),'.'))
 
+        files = self.walk_dirs(dirs)
+
+        for name,path in resources:
+            if not os.path.isdir(path):
+                files[os.path.join('resources',name)] = os.path.join(self.options.path,path)
+        
+        return files
+
+    def walk_dirs(self,dirs):
+        """
+            Map the destination path of every file in the given (source, destination) directory pairs to its source path
+        """
         files = {}
         for (src,dst) in dirs:
             src = os.path.join(self.options.path,src)
@@ -207,17 +663,14 @@ class NumbasCompiler(object):
                 xdst = x[0].replace(src,dst,1)
                 for y in filter(realFile,x[2]):
                     files[os.path.join(xdst,y)] = os.path.join(xsrc,y) 
-
-        for name,path in resources:
-            if not os.path.isdir(path):
-                files[os.path.join('resources',name)] = os.path.join(self.options.path,path)
-        
         return files
 
     def make_xml(self):
         """
-            Write the javascript representation of the XML files (theme XSLT and exam XML)
+            Write the javascript representation of the XML files (theme XSLT and exam XML) to settings.js
         """
+        import xml2js
+
         xslts = {}
         for themedir in self.themepaths:
             xsltdir = os.path.join(themedir,'xslt')
@@ -226,12 +679,11 @@ class NumbasCompiler(object):
                 files = filter(lambda x: x[-5:]=='.xslt', os.listdir(xsltdir))
                 for file in files:
                     name, ext = os.path.splitext(file)
-                    xslts[name] = xml2js.encode(open(os.path.join(xsltdir,file),encoding='utf-8').read())
+                    with open(os.path.join(xsltdir,file),encoding='utf-8') as f:
+                        xslts[name] = f.read()
 
         if 'question' not in xslts and self.question_xslt is not None:
-            xslts['question'] = xml2js.encode(self.question_xslt)
-
-        xslts_js = ',\n\t\t'.join('{}: "{}"'.format(name,body) for name,body in xslts.items())
+            xslts['question'] = self.question_xslt
 
         extensionfiles = []
         for extension in self.extensions:
@@ -239,20 +691,56 @@ class NumbasCompiler(object):
             if os.path.exists(os.path.join(extension,name+'.js')):
                 extensionfiles.append('extensions/'+name+'/'+name+'.js')
 
-        self.xmls = xml2js.rawxml_js_template.format(**{
-            'extensionfiles': str(extensionfiles),
-            'templates': xslts_js,
-            'examXML': xml2js.encode(self.examXML),
-        })
+        profiling.add_bytes(bytes_in=len(self.examXML))
+
+        examXML = self.examXML
+        if self.options.lazy_questions:
+            examXML = self.split_questions()
+
+        extensionfiles = str(extensionfiles)
+        if self.options.json_exam:
+            import xml.etree.ElementTree as etree
+            examJSON, examContent = xml2js.exam_json(etree.fromstring(examXML))
+            settings_js = GeneratedTextFile(lambda out: xml2js.write_rawxml_js(out,extensionfiles,xslts,examJSON=examJSON,examContent=examContent))
+        else:
+            settings_js = GeneratedTextFile(lambda out: xml2js.write_rawxml_js(out,extensionfiles,xslts,examXML))
+        self.files[os.path.join('.','settings.js')] = settings_js
+
+    def split_questions(self):
+        """
+            Write each question's XML to a separate file, so that the runtime only needs to load the questions which are picked.
+            Returns the exam XML, with a placeholder for each question giving the path to its file.
+        """
+        import xml.etree.ElementTree as etree
+
+        root = etree.fromstring(self.examXML)
+        for group_number, group in enumerate(root.findall('question_groups/question_group')):
+            questions = group.find('questions')
+            for question_number, question in enumerate(list(questions)):
+                path = question_file_path(group_number,question_number)
+                tail = question.tail
+                question.tail = None
+                self.files[path] = io.StringIO(etree.tostring(question,encoding='unicode'))
+
+                placeholder = etree.Element('question',{'name': question.get('name',''), 'chunk': package_path(path)})
+                placeholder.tail = tail
+                questions[question_number] = placeholder
+
+        return etree.tostring(root,encoding='unicode')
 
     def render_templates(self):
         """
-            Render index.html using the theme templates
+            Render index.html using the theme templates.
+            The compiled templates are shared with other compiles in this process, and also saved in the cache directory, if there is one.
         """
+        import templating
+        import cache
+
         template_paths = [os.path.join(path,'templates') for path in self.themepaths]
         template_paths.reverse()
 
-        self.template_environment = jinja2.Environment(loader=jinja2.FileSystemLoader(template_paths))
+        bytecode_dir = os.path.join(self.options.cache,cache.TEMPLATES_DIR) if self.options.cache is not None else None
+        self.templates = templating.get_templates(template_paths,bytecode_dir)
         index_dest = os.path.join('.','index.html')
         if index_dest not in self.files:
             index_html = self.render_template('index.html')
@@ -264,10 +752,10 @@ class NumbasCompiler(object):
         self.question_xslt = self.render_template('question.xslt')
 
     def render_template(self,name):
+        import jinja2
+
         try:
-            template = self.template_environment.get_template(name)
-            output = template.render({'exam': self.exam,'options': self.options})
-            return output
+            return self.templates.render(name,self.exam,self.options)
         except jinja2.exceptions.TemplateNotFound:
             return None
         except jinja2.exceptions.TemplateSyntaxError as e:
@@ -277,6 +765,8 @@ class NumbasCompiler(object):
         """
             Make locale.js using the selected locale file
         """
+        import json
+
         localePath = os.path.join(self.options.path,'locales')
         locales = {}
         for fname in os.listdir(localePath):
@@ -294,15 +784,20 @@ class NumbasCompiler(object):
         }});
         """
         locale_js = locale_js_template.format(json.dumps(self.options.locale),json.dumps(locales))
+        self.locales = locales
 
         self.files[os.path.join('.','locale.js')] = io.StringIO(locale_js)
 
     def add_scorm(self):
         """
-            Add the necessary files for the SCORM protocol to the package
+            Add the necessary files for the SCORM protocol to the package.
+            This runs after the scripts and stylesheets have been bundled, so the manifest lists the files which are actually in the package.
         """
+        import xml.etree.ElementTree as etree
+        register_namespaces()
+
 
-        self.files.update(self.collect_files([('scormfiles','.')]))
+        self.files.update(self.walk_dirs([('scormfiles','.')]))
 
         IMSprefix = '{http://www.imsglobal.org/xsd/imscp_v1p1}'
         manifest = etree.fromstring(open(os.path.join(self.options.path,'scormfiles','imsmanifest.xml')).read())
@@ -336,19 +831,20 @@ class NumbasCompiler(object):
 
     def collect_stylesheets(self):
         """
-            Collect together all CSS files and compile them into a single file, styles.css
+            Collect together all CSS files and compile them into a single file, styles.css.
+            The files aren't read until the package is written.
         """
         stylesheets = [(dst,src) for dst,src in self.files.items() if os.path.splitext(dst)[1]=='.css']
         stylesheets.sort(key=lambda x:x[0])
         for dst,src in stylesheets:
             del self.files[dst]
         stylesheets = [src for dst,src in stylesheets]
-        stylesheets = '\n'.join(open(src,encoding='utf-8').read() if isinstance(src,basestring) else src.read() for src in stylesheets)
-        self.files[os.path.join('.','styles.css')] = io.StringIO(stylesheets)
+        self.files[os.path.join('.','styles.css')] = Bundle(stylesheets)
 
     def collect_scripts(self):
         """
-            Collect together all Javascript files and compile them into a single file, scripts.js
+            Collect together all Javascript files and compile them into a single file, scripts.js.
+            The files aren't read until the package is written.
         """
         javascripts = [(dst,src) for dst,src in self.files.items() if os.path.splitext(dst)[1]=='.js']
         for dst,src in javascripts:
@@ -356,13 +852,82 @@ class NumbasCompiler(object):
 
         javascripts.sort(key=lambda x:x[0])
 
+        numbas_loader = [(dst,src) for dst,src in javascripts if src==os.path.join(self.options.path,'runtime','scripts','numbas.js')]
+        javascripts = numbas_loader + [(dst,src) for dst,src in javascripts if (dst,src) not in numbas_loader]
+        self.bundled_scripts = javascripts
+
         javascripts = [src for dst,src in javascripts]
-        numbas_loader_path = os.path.join(self.options.path,'runtime','scripts','numbas.js')
-        javascripts.remove(numbas_loader_path)
+        self.files[os.path.join('.','scripts.js')] = Bundle(javascripts)
+
+    def hash_filenames(self):
+        """
+            Rename the script and stylesheet bundles to include a hash of their contents, e.g. scripts.<hash>.js, 
+            and update the references to them in index.html.
+            The bundles can then be served with far-future cache headers.
+        """
+        import re
+
+        renames = {}
+        for name in ['scripts.js','styles.css']:
+            dst = os.path.join('.',name)
+            if dst not in self.files:
+                continue
+            digest = file_digest(self.files[dst])[:16]
+            base, ext = os.path.splitext(name)
+            hashed_name = '{}.{}{}'.format(base,digest,ext)
+            self.files[os.path.join('.',hashed_name)] = self.files.pop(dst)
+            renames[name] = hashed_name
+
+        index_dest = os.path.join('.','index.html')
+        if renames and index_dest in self.files:
+            reference_re = re.compile(r'''(\b(?:src|href)\s*=\s*(["']))(?:\./)?({})(\2)'''.format('|'.join(re.escape(name) for name in renames)))
+            index_html = reference_re.sub(lambda m: m.group(1)+renames[m.group(3)]+m.group(4), file_contents(self.files[index_dest]))
+            self.files[index_dest] = io.StringIO(index_html)
 
-        javascripts.insert(0,numbas_loader_path)
-        javascripts = '\n'.join(open(src,encoding='utf-8').read() if isinstance(src,basestring) else src.read() for src in javascripts)
-        self.files[os.path.join('.','scripts.js')] = io.StringIO(javascripts)
+    def gzip_files(self):
+        """
+            Write a precompressed .gz copy of each script and stylesheet bundle alongside the original, so web servers can serve them without compressing on the fly.
+            When updating an existing directory, a sidecar which already holds the same contents is left alone: it's added to the package as the existing file, so it's still listed in the SCORM manifest, but it isn't compressed or written again.
+
+            The originals are streamed into the compressor, but each compressed copy is kept in memory, as a ``BytesIO``, so that its size can be reported.
+        """
+        import gzip
+        import hashlib
+
+        bundles = [dst for dst in self.files if os.path.splitext(dst)[1] in ('.js','.css')]
+        for dst in sorted(bundles):
+            src = self.files[dst]
+            gz_dst = dst+'.gz'
+            # a cached package must contain every file, so sidecars are always made when the cache is used
+            if not self.options.zip and self.options.output is not None and self.options.action != 'clean' and not self.use_cache:
+                existing_path = os.path.join(self.options.output,gz_dst)
+                if os.path.exists(existing_path):
+                    # compare hashes of the contents, so neither file has to be read into memory all at once
+                    try:
+                        existing = hashlib.sha256()
+                        with gzip.open(existing_path,'rb') as f:
+                            for chunk in iter(lambda: f.read(CHUNK_SIZE),b''):
+                                existing.update(chunk)
+                        up_to_date = existing.hexdigest() == file_digest(src)
+                    except (OSError,EOFError):
+                        up_to_date = False
+                    if up_to_date:
+                        self.files[gz_dst] = existing_path
+                        self.log("%s is up to date" % os.path.normpath(gz_dst))
+                        continue
+
+            out = io.BytesIO()
+            with gzip.GzipFile(filename='',mode='wb',fileobj=out,compresslevel=9,mtime=0) as f:
+                sink = ByteSink(f.write)
+                write_file(src,sink)
+            self.files[gz_dst] = out
+            out.seek(0)
+
+            compressed_size = len(out.getvalue())
+            if sink.size:
+                self.log("Compressed %s: %i bytes -> %i bytes (%i%%)" % (os.path.normpath(dst),sink.size,compressed_size,round(100*compressed_size/sink.size)))
+            else:
+                self.log("Compressed %s: empty file -> %i bytes" % (os.path.normpath(dst),compressed_size))
 
     def add_source(self):
         """
@@ -374,6 +939,8 @@ class NumbasCompiler(object):
         """
             Minify all javascript files in the package
         """
+        import subprocess
+
         for dst,src in self.files.items():
             if isinstance(src,basestring) and os.path.splitext(dst)[1] == '.js':
                 p = subprocess.Popen([self.options.minify,src],stdin=subprocess.PIPE,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
@@ -388,6 +955,20 @@ class NumbasCompiler(object):
         """ 
             Compile the exam as a .zip file
         """
+        self.write_zip(self.options.output)
+
+        self.log("Exam created in %s" % os.path.relpath(self.options.output))
+
+        profiling.add_bytes(bytes_out=os.path.getsize(self.options.output))
+
+    def write_zip(self,file):
+        """
+            Write the package as a zip file to ``file``, which is either a path or a file object.
+            Each file is streamed into the zip file, rather than being read into memory first.
+        """
+        import datetime
+        from zipfile import ZipFile, ZipInfo
+
         def cleanpath(path):
             if path=='': 
                 return ''
@@ -397,25 +978,43 @@ class NumbasCompiler(object):
                 dirname = os.path.join(dirname,basename)
             return dirname
 
-        f = ZipFile(self.options.output,'w')
-
-        for (dst,src) in self.files.items():
-            dst = ZipInfo(cleanpath(dst))
-            dst.external_attr = 0o644<<16
-            dst.date_time = datetime.datetime.today().timetuple()
-            if isinstance(src,basestring):
-                f.writestr(dst,open(src,'rb').read())
-            else:
-                f.writestr(dst,src.read())
+        with ZipFile(file,'w') as f:
+            for (dst,src) in self.files.items():
+                dst = ZipInfo(cleanpath(dst))
+                dst.external_attr = 0o644<<16
+                dst.date_time = datetime.datetime.today().timetuple()
+                with f.open(dst,'w') as out:
+                    write_file(src,out)
 
-        print("Exam created in %s" % os.path.relpath(self.options.output))
+    def compileToMemory(self):
+        """
+            Keep the package in memory, as ``self.package``: a ``BytesIO`` containing a zip file if the zip option is set, 
+            or otherwise a dictionary mapping the path of each file to its contents as bytes.
 
-        f.close()
+            The zip file is streamed into its buffer, but the whole package is necessarily held in memory, as it's what's returned.
+        """
+        if self.options.zip:
+            self.package = io.BytesIO()
+            self.write_zip(self.package)
+            self.package.seek(0)
+            profiling.add_bytes(bytes_out=len(self.package.getvalue()))
+        else:
+            self.package = dict((package_path(dst),file_bytes(src)) for dst,src in self.files.items())
+            profiling.add_bytes(bytes_out=sum(len(data) for data in self.package.values()))
 
     def compileToDir(self):
         """
-            Compile the exam as a directory on the filesystem
+            Compile the exam as a directory on the filesystem.
+
+            The directories are made first, then the files are written by a pool of ``options.jobs`` threads,
+            so that on a slow filesystem, such as a network drive, the file operations don't all wait for each other.
+            If any directories can't be made or files can't be written, the others are still made and written, and then the errors are reported together:
+            first the directories, in order of path, and then the files, in the order of the files in the package.
+            Files in a directory which couldn't be made aren't written.
         """
+        import shutil
+        from concurrent.futures import ThreadPoolExecutor
+
         if self.options.action == 'clean':
             try:
                 shutil.rmtree(self.options.output)
@@ -425,28 +1024,186 @@ class NumbasCompiler(object):
             os.mkdir(self.options.output)
         except OSError:
             pass
-        
-        def makepath(path):    #make sure directory hierarchy of path exists by recursively creating directories
-            dir = os.path.dirname(path)
-            if not os.path.exists(dir):
-                makepath(dir)
-                try:
-                    os.mkdir(dir)
-                except OSError:
-                    pass
-
-        for (dst,src) in self.files.items():
-            dst = os.path.join(self.options.output,dst)
-            makepath(dst)
+
+        files = [(dst,os.path.join(self.options.output,dst),src) for dst,src in self.files.items()]
+
+        # os.makedirs makes the parents of each directory, so only the directories which aren't the parent of another need to be made
+        directories = set(os.path.dirname(path) for dst,path,src in files)
+        directories = sorted(directories - set(os.path.dirname(directory) for directory in directories))
+
+        def makedir(directory):
+            """
+                Make a directory and its parents, and return the error if it can't be made
+            """
+            try:
+                os.makedirs(directory,exist_ok=True)
+            except OSError as err:
+                return err
+
+        profiling_active = profiling.active() is not None
+
+        def write(path,src):
+            """
+                Write a file, and return the size of the written file if profiling, or None if it wasn't written
+            """
             if isinstance(src,basestring):
-                if self.options.action=='clean' or not os.path.exists(dst) or os.path.getmtime(src)>os.path.getmtime(dst):
-                    shutil.copyfile(src,dst)
+                if self.options.action=='clean' or not os.path.exists(path) or os.path.getmtime(src)>os.path.getmtime(path):
+                    shutil.copyfile(src,path)
+                else:
+                    return None
+            elif isinstance(src,LazyFile):
+                with open(path,'wb') as f:
+                    src.write(f)
+            elif isinstance(src,io.BytesIO):
+                with open(path,'wb') as f:
+                    shutil.copyfileobj(src,f)
             else:
-                shutil.copyfileobj(src,open(dst,'w',encoding='utf-8'))
-        
-        print("Exam created in %s" % os.path.relpath(self.options.output))
+                with open(path,'w',encoding='utf-8') as f:
+                    shutil.copyfileobj(src,f)
+            if profiling_active:
+                return os.path.getsize(path)
+
+        def in_failed_directory(path):
+            directory = os.path.dirname(path)
+            return any(directory==failed or directory.startswith(os.path.join(failed,'')) for failed in failed_directories)
+
+        with ThreadPoolExecutor(max(1,self.options.jobs)) as executor:
+            directory_errors = [(directory,err) for directory,err in zip(directories,executor.map(makedir,directories)) if err is not None]
+            failed_directories = [directory for directory,err in directory_errors]
+            files = [(dst,path,src) for dst,path,src in files if not in_failed_directory(path)]
+            results = [executor.submit(write,path,src) for dst,path,src in files]
+
+        errors = ['%s: %s' % (package_path(os.path.relpath(directory,self.options.output)),err) for directory,err in directory_errors]
+        failed_files = 0
+        for (dst,path,src),result in zip(files,results):
+            try:
+                size = result.result()
+            except Exception as err:
+                errors.append('%s: %s' % (package_path(dst),err))
+                failed_files += 1
+                continue
+            if size is not None:
+                profiling.add_bytes(bytes_out=size)
+        if errors:
+            problems = []
+            if directory_errors:
+                problems.append('make %i director%s' % (len(directory_errors),'y' if len(directory_errors)==1 else 'ies'))
+            if failed_files:
+                problems.append('write %i file%s' % (failed_files,'' if failed_files==1 else 's'))
+            raise CompileError("Couldn't %s in %s:\n%s" % (' or '.join(problems),self.options.output,'\n'.join(errors)))
+
+        self.log("Exam created in %s" % os.path.relpath(self.options.output))
+
+    def size_report(self):
+        """
+            The sizes in bytes of the output files, of each question and part in the exam definition, of each locale in locale.js, and of each script in scripts.js.
+            When each question is in a separate file, a question's size is the size of its file, which is named in the question's ``file`` entry, and its parts' sizes are their sizes in that file.
+        """
+        import json
+        import xml.etree.ElementTree as etree
+        from exam import indent
+        import xml2js
+
+        def fragment_size(element,level,inline=True):
+            """
+                The number of bytes an element of the exam XML adds to the encoded exam definition, with the indentation it has at the given depth.
+                If ``inline`` is False, the element is in a separate file of plain XML, so it isn't encoded.
+            """
+            indent(element,level)
+            if not inline:
+                return len(etree.tostring(element,encoding='unicode').encode('utf-8'))
+            elif self.options.json_exam:
+                structure, content = xml2js.exam_json(element)
+                encoded = xml2js.json_literal(structure)+xml2js.encode(content)
+            else:
+                encoded = xml2js.encode(etree.tostring(element,encoding='unicode'))
+            return len(encoded.encode('utf-8'))
+
+        files = dict((package_path(dst),file_size(src)) for dst,src in self.files.items())
+        report = {
+            'files': files,
+            'total': sum(files.values()),
+        }
+        if self.options.zip:
+            report['zip'] = os.path.getsize(self.options.output) if self.options.output is not None else len(self.package.getvalue())
+
+        questions = []
+        for group_number,group in enumerate(self.exam.question_groups):
+            for question_number,question in enumerate(group.questions):
+                inline = not self.options.lazy_questions
+                parts = []
+                for part_number,part in enumerate(question.parts):
+                    parts.append({
+                        'part': part_number,
+                        'type': part.kind,
+                        'bytes': fragment_size(part.toxml(),6,inline),
+                    })
+                entry = {
+                    'group': group_number,
+                    'question': question_number,
+                    'name': question.name,
+                    'parts': parts,
+                }
+                if inline:
+                    entry['bytes'] = fragment_size(question.toxml(),4)
+                else:
+                    path = question_file_path(group_number,question_number)
+                    entry['file'] = package_path(path)
+                    entry['bytes'] = file_size(self.files[path])
+                questions.append(entry)
+        report['questions'] = questions
 
-def run():
+        report['locales'] = dict((name,len(json.dumps(locale).encode('utf-8'))) for name,locale in self.locales.items())
+        report['scripts'] = dict((package_path(dst),file_size(src)) for dst,src in self.bundled_scripts)
+
+        return report
+
+    def check_sizes(self):
+        """
+            Write the size report, if one was asked for, and check the sizes against the budgets given with ``--size-budget``.
+            Each budget is of the form ``name=bytes``, where ``name`` is the path of an output file, or ``total`` for the whole package, ``zip`` for the .zip file, or ``question`` or ``part`` for every question or part in the exam.
+        """
+        import json
+
+        report = self.size_report()
+
+        sizes = dict(report['files'])
+        sizes['total'] = report['total']
+        if 'zip' in report:
+            sizes['zip'] = report['zip']
+
+        failures = []
+        budgets = []
+        for budget in self.options.size_budgets:
+            name,_,limit = budget.rpartition('=')
+            try:
+                limit = int(limit)
+            except ValueError:
+                raise CompileError("Invalid size budget %s: it should be of the form name=bytes" % budget)
+            if name=='question':
+                measured = [(question['name'],question['bytes']) for question in report['questions']]
+            elif name=='part':
+                measured = [('%s part %i' % (question['name'],part['part']),part['bytes']) for question in report['questions'] for part in question['parts']]
+            elif name in sizes:
+                measured = [(name,sizes[name])]
+            else:
+                raise CompileError("Invalid size budget %s: there is no output file called %s" % (budget,name))
+            for label,size in measured:
+                ok = size<=limit
+                budgets.append({'name': name, 'item': label, 'limit': limit, 'bytes': size, 'ok': ok})
+                if not ok:
+                    failures.append("%s is %i bytes, over its budget of %i bytes" % (label,size,limit))
+        report['budgets'] = budgets
+
+        if self.options.size_report:
+            with open(self.options.size_report,'w',encoding='utf-8') as f:
+                json.dump(report,f,indent=1)
+            self.log("Size report written to %s" % os.path.relpath(self.options.size_report))
+
+        if failures:
+            raise CompileError("Size budgets exceeded:\n"+'\n'.join(failures))
+
+def make_option_parser():
     parser = OptionParser(usage="usage: %prog [options] source")
     parser.add_option('-t','--theme',
                         dest='theme',
@@ -518,17 +1275,92 @@ def run():
                         action='store_false',
                         default=True,
                         help='Don\'t expect an index.html file to be produced')
+    parser.add_option('--hash-filenames',
+                        dest='hash_filenames',
+                        action='store_true',
+                        default=False,
+                        help='Include a hash of the contents in the names of scripts.js and styles.css, so they can be cached indefinitely')
+    parser.add_option('--gzip',
+                        dest='gzip',
+                        action='store_true',
+                        default=False,
+                        help='Write a precompressed .gz copy of scripts.js and styles.css alongside each one')
+    parser.add_option('--lazy-questions',
+                        dest='lazy_questions',
+                        action='store_true',
+                        default=False,
+                        help='Put each question in a separate file, loaded only when the question is used. The exam must be served over HTTP.')
+    parser.add_option('--json-exam',
+                        dest='json_exam',
+                        action='store_true',
+                        default=False,
+                        help='Encode the structure of the exam definition in settings.js as JSON, with only the content fragments as XML')
+    parser.add_option('--profile',
+                        dest='profile',
+                        default=None,
+                        help='Time each stage of the compilation, print a summary, and write a Chrome trace-event file to the given path')
+    parser.add_option('--profile-memory',
+                        dest='profile_memory',
+                        default=None,
+                        help='Trace memory use during each stage of the compilation, and write a JSON report to the given path')
+    parser.add_option('--size-report',
+                        dest='size_report',
+                        default=None,
+                        help='Write a JSON report of the sizes of the output files, questions, parts, locales and scripts to the given path')
+    parser.add_option('--size-budget',
+                        dest='size_budgets',
+                        action='append',
+                        default=[],
+                        help='Fail if an output file, or every question or part, is bigger than a number of bytes, e.g. scripts.js=2000000 or question=50000. Can be given more than once.')
+    parser.add_option('--cache',
+                        dest='cache',
+                        default=None,
+                        help='Directory to keep compiled packages in. If the same exam is compiled again with the same theme, extensions, resources, locale and options, the stored package is used. Compiled theme templates are kept there too.')
+    parser.add_option('--cache-size',
+                        dest='cache_size',
+                        type='int',
+                        default=1<<30,
+                        help='Maximum size of the cache, in bytes. When it\'s bigger, the least recently used packages are deleted.')
+    parser.add_option('-j','--jobs',
+                        dest='jobs',
+                        type='int',
+                        default=8,
+                        help='Number of files to write at once when compiling to a directory')
+    parser.add_option('--themes',
+                        dest='themes',
+                        default=None,
+                        help='Comma-separated list of themes. The exam is compiled with each of these themes and each locale, into a directory for each variant inside the target path.')
+    parser.add_option('--locales',
+                        dest='locales',
+                        default=None,
+                        help='Comma-separated list of locales. The exam is compiled with each of these locales and each theme, into a directory for each variant inside the target path.')
+    parser.add_option('-q','--quiet',
+                        dest='quiet',
+                        action='store_true',
+                        default=False,
+                        help="Don't print progress messages")
+    parser.add_option('--validate',
+                        dest='validate',
+                        action='store_true',
+                        default=False,
+                        help="Check the exam for problems, without compiling it")
     parser.add_option('--mathjax-url',
                         dest='mathjax_url',
                         default='https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.0',
                         help='URL of MathJax')
 
+    return parser
+
+def run():
+    parser = make_option_parser()
     (options,args) = parser.parse_args()
 
+    matrix = options.themes is not None or options.locales is not None
+
     if options.pipein:
         options.source = sys.stdin.detach().read().decode('utf-8')
         if not options.output:
-            options.output = os.path.join(path,'output','exam')
+            options.output = os.path.join(options.path,'output','exam')
     else:
         try:
             source_path = args[0]
@@ -538,26 +1370,40 @@ def run():
 
         if not os.path.exists(source_path):
             osource = source_path
-            source_path = os.path.join(path,source_path)
+            source_path = os.path.join(options.path,source_path)
             if not os.path.exists(source_path):
                 print("Couldn't find source file %s" % osource)
                 exit(1)
         options.source=open(source_path,encoding='utf-8').read()
 
+    if options.validate:
+        import validate
+        errors = validate.validate_source(options.source,'<stdin>' if options.pipein else source_path,options.path)
+        for error in errors:
+            print(validate.format_error(error))
+        exit(1 if errors else 0)
+
+    if not options.pipein:
         if not options.output:
             output = os.path.basename(os.path.splitext(source_path)[0])
-            if options.zip:
+            if options.zip and not matrix:
                 output += '.zip'
             options.output=os.path.join(options.path,'output',output)
     
 
     try:
-        compiler = NumbasCompiler(options)
-        compiler.compile()
+        if matrix:
+            themes = options.themes.split(',') if options.themes else [options.theme]
+            locales = options.locales.split(',') if options.locales else [options.locale]
+            compile_variants(options,themes,locales)
+        else:
+            compiler = NumbasCompiler(options)
+            compiler.compile()
     except Exception as err:
         sys.stderr.write(str(err)+'\n')
         _,_,exc_traceback = sys.exc_info()
         if options.show_traceback:
+            import traceback
             sys.stderr.write('\n')
             traceback.print_exc()
         exit(1)
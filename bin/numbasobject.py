@@ -1,10 +1,20 @@
 # load an exam from a source file, migrating it to the latest version if necessary
 from examparser import ExamParser
 from migrations import migrations
+import profiling
 import json
 
 NUMBAS_FILE_PREFIX = '// Numbas version: '
 
+def latest_version():
+    """
+        The version that data is migrated to: the name of the last migration
+    """
+    version = '1'
+    while version in migrations:
+        version = migrations[version].__name__
+    return version
+
 class VersionError(Exception):
     def __init__(self,version):
         self.version = version
@@ -40,23 +50,27 @@ class NumbasObject:
         # Files with version numbers have a line of the format     
         # // Numbas version: <version string> 
         # at the start, and are encoded in JSON. Older files have no version number and are in the .exam format
-        if source.startswith(NUMBAS_FILE_PREFIX):
-            version, json_string = source.split('\n',1)
-            try:
-                version = version[len(NUMBAS_FILE_PREFIX):].strip()
-            except ValueError:
-                raise VersionError(version)
-            data = json.loads(json_string)
-        else:
-            version = '1'
-            data = ExamParser().parse(source)
+        with profiling.stage('parse source'):
+            profiling.add_bytes(bytes_in=len(source))
+            if source.startswith(NUMBAS_FILE_PREFIX):
+                version, json_string = source.split('\n',1)
+                try:
+                    version = version[len(NUMBAS_FILE_PREFIX):].strip()
+                except ValueError:
+                    raise VersionError(version)
+                data = json.loads(json_string)
+            else:
+                version = '1'
+                data = ExamParser().parse(source)
 
         self.version, self.data = version,data
         self.migrate_data()
 
     def migrate_data(self):
-        while self.version in migrations:
-            self.version = migrations[self.version](self)
+        with profiling.stage('migrations'):
+            while self.version in migrations:
+                with profiling.stage('migration',version=self.version):
+                    self.version = migrations[self.version](self)
 
     def __str__(self):
         return '%s%s\n%s' % (NUMBAS_FILE_PREFIX,self.version,json.dumps(self.data))
@@ -0,0 +1,320 @@
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Record how long each stage of compiling an exam takes, and how many bytes go in and out of it.
+
+    Code marks out a stage with ``with profiling.stage(name):``. This does nothing unless a ``Profiler`` has been activated on the current thread with ``profiling.activate``.
+
+    A profiler can also record memory use with ``tracemalloc``: the peak memory during each stage, the memory still allocated at its end, and the lines of code which allocated that memory.
+    ``tracemalloc`` traces the whole process, so memory profiles are only meaningful when one exam is compiled at a time.
+    It's only imported when memory is being profiled, because importing it is slow.
+
+    The profiler's own work, such as measuring the sizes of files or taking memory snapshots, is done in ``untimed`` blocks.
+    Time spent in these blocks is taken off the profiler's clock, so it isn't counted towards any stage.
+"""
+
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+_local = threading.local()
+
+class Stage(object):
+    """
+        A stage of the compilation, and the stages run inside it
+    """
+    def __init__(self,name,args):
+        self.name = name
+        self.args = args
+        self.start = None
+        self.end = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.children = []
+        self.thread = threading.get_ident()
+        self.memory_start = None
+        self.memory_end = None
+        self.memory_peak = 0
+        self.top_allocations = None
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+class Profiler(object):
+    """
+        Collects the timings of stages. The outermost stages are in ``self.stages``.
+
+        If ``memory`` is True, memory use is traced, and stages nested no more than ``snapshot_depth`` deep record the ``top_allocations`` lines of code holding the most memory when they finish.
+    """
+    def __init__(self,memory=False,snapshot_depth=1,top_allocations=10,traceback_frames=1):
+        self.stages = []
+        self._paused = 0
+        self._untimed_depth = 0
+        self.origin = self.clock()
+        self._stack = []
+        self.memory = memory
+        self.snapshot_depth = snapshot_depth
+        self.top_allocations = top_allocations
+        self.traceback_frames = traceback_frames
+        self._started_tracemalloc = False
+
+    def start(self):
+        if not self.memory:
+            return
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.traceback_frames)
+            self._started_tracemalloc = True
+
+    def stop(self):
+        if self._started_tracemalloc:
+            import tracemalloc
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def clock(self):
+        """
+            The time in seconds, not counting the time spent in ``untimed`` blocks
+        """
+        return time.perf_counter() - self._paused
+
+    @contextmanager
+    def untimed(self):
+        """
+            Don't count the time spent in this block, or the memory it allocates, towards any stage
+        """
+        if self._untimed_depth:
+            yield
+            return
+        self._untimed_depth += 1
+        if self.memory:
+            self._update_peaks()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._paused += time.perf_counter() - start
+            if self.memory:
+                import tracemalloc
+                tracemalloc.reset_peak()
+            self._untimed_depth -= 1
+
+    def _update_peaks(self):
+        """
+            Add the peak memory since the last reset to every running stage, and reset the peak
+        """
+        import tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        for stage in self._stack:
+            stage.memory_peak = max(stage.memory_peak,peak)
+        tracemalloc.reset_peak()
+        return current
+
+    @contextmanager
+    def stage(self,name,**args):
+        stage = Stage(name,args)
+        if self._stack:
+            self._stack[-1].children.append(stage)
+        else:
+            self.stages.append(stage)
+        if self.memory:
+            with self.untimed():
+                stage.memory_start = self._update_peaks()
+        self._stack.append(stage)
+        stage.start = self.clock()
+        try:
+            yield stage
+        finally:
+            stage.end = self.clock()
+            if self.memory:
+                with self.untimed():
+                    stage.memory_end = self._update_peaks()
+                    if len(self._stack) <= self.snapshot_depth+1:
+                        stage.top_allocations = self.allocation_sites()
+            self._stack.pop()
+
+    def allocation_sites(self):
+        """
+            The lines of code holding the most memory at the moment
+        """
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False,tracemalloc.__file__),
+            tracemalloc.Filter(False,'<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False,'<frozen importlib._bootstrap_external>'),
+        ])
+        sites = []
+        for stat in snapshot.statistics('traceback' if self.traceback_frames>1 else 'lineno')[:self.top_allocations]:
+            sites.append({
+                'size': stat.size,
+                'count': stat.count,
+                'traceback': [{'filename': frame.filename, 'lineno': frame.lineno} for frame in stat.traceback],
+            })
+        return sites
+
+    def current(self):
+        """
+            The innermost stage that is running, or None
+        """
+        return self._stack[-1] if self._stack else None
+
+    def walk(self):
+        """
+            Iterate over all the stages, with their depth
+        """
+        def walk_stages(stages,depth):
+            for stage in stages:
+                yield stage, depth
+                for x in walk_stages(stage.children,depth+1):
+                    yield x
+        return walk_stages(self.stages,0)
+
+    def trace_events(self):
+        """
+            The stages as Chrome trace events, which can be loaded into chrome://tracing or Perfetto
+        """
+        pid = os.getpid()
+        events = []
+        for stage,depth in self.walk():
+            args = dict(stage.args)
+            args.update({'bytes_in': stage.bytes_in, 'bytes_out': stage.bytes_out})
+            events.append({
+                'name': stage.name,
+                'cat': 'compile',
+                'ph': 'X',
+                'ts': (stage.start-self.origin)*1e6,
+                'dur': stage.duration*1e6,
+                'pid': pid,
+                'tid': stage.thread,
+                'args': args,
+            })
+        return events
+
+    def write_trace(self,path):
+        import json
+        with open(path,'w',encoding='utf-8') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'},f)
+
+    def memory_report(self):
+        """
+            The memory used by each stage, as a JSON-serialisable dictionary. Sizes are in bytes.
+
+            ``peak`` is the most memory allocated at any point during the stage, ``retained`` is the memory allocated when the stage finished, and ``allocated`` is the change in allocated memory over the stage.
+        """
+        stages = []
+        for stage,depth in self.walk():
+            report = {
+                'name': stage.name,
+                'depth': depth,
+                'args': stage.args,
+                'peak': stage.memory_peak,
+                'retained': stage.memory_end,
+                'allocated': stage.memory_end - stage.memory_start,
+            }
+            if stage.top_allocations is not None:
+                report['top_allocations'] = stage.top_allocations
+            stages.append(report)
+        return {'stages': stages}
+
+    def write_memory_report(self,path):
+        import json
+        with open(path,'w',encoding='utf-8') as f:
+            json.dump(self.memory_report(),f,indent=1)
+
+    def summary(self):
+        """
+            A table of the time taken by each stage and the bytes going in and out of it.
+            Stages with the same name and parent are added together.
+        """
+        total = sum(stage.duration for stage in self.stages) or 1
+        lines = ['%-48s %10s %7s %6s %12s %12s' % ('Stage','Time (ms)','%','Calls','Bytes in','Bytes out')]
+
+        def add_lines(stages,depth):
+            groups = {}
+            for stage in stages:
+                groups.setdefault(stage.name,[]).append(stage)
+            for name,group in groups.items():
+                duration = sum(stage.duration for stage in group)
+                lines.append('%-48s %10.1f %7.1f %6i %12i %12i' % (
+                    ('  '*depth+name)[:48],
+                    duration*1000,
+                    100*duration/total,
+                    len(group),
+                    sum(stage.bytes_in for stage in group),
+                    sum(stage.bytes_out for stage in group),
+                ))
+                add_lines([child for stage in group for child in stage.children],depth+1)
+
+        add_lines(self.stages,0)
+        return '\n'.join(lines)
+
+@contextmanager
+def activate(profiler):
+    """
+        Use the given profiler for stages run on this thread. If ``profiler`` is None, stages aren't recorded.
+    """
+    previous = getattr(_local,'profiler',None)
+    _local.profiler = profiler
+    if profiler is not None:
+        profiler.start()
+    try:
+        yield profiler
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        _local.profiler = previous
+
+def active():
+    """
+        The profiler in use on this thread, or None
+    """
+    return getattr(_local,'profiler',None)
+
+@contextmanager
+def stage(name,**args):
+    """
+        Record a stage with the active profiler, if there is one. Yields the ``Stage`` object, or None if not profiling.
+    """
+    profiler = getattr(_local,'profiler',None)
+    if profiler is None:
+        yield None
+    else:
+        with profiler.stage(name,**args) as s:
+            yield s
+
+@contextmanager
+def untimed():
+    """
+        Don't count the time spent in this block towards the active profiler's stages
+    """
+    profiler = getattr(_local,'profiler',None)
+    if profiler is None:
+        yield
+    else:
+        with profiler.untimed():
+            yield
+
+def add_bytes(bytes_in=0,bytes_out=0):
+    """
+        Add to the counts of bytes going in and out of the innermost running stage
+    """
+    profiler = getattr(_local,'profiler',None)
+    if profiler is not None:
+        current = profiler.current()
+        if current is not None:
+            current.bytes_in += bytes_in
+            current.bytes_out += bytes_out
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Index the questions in a tree of .exam files in an SQLite database, and search them.
+
+    For each question, the index records its name, the kinds of its parts, its variables and functions, the extensions it uses,
+    a hash of its content and where it is in its file. The question's data is stored too, so a selection of questions can be compiled into an exam without reading the files again.
+
+    Indexing is incremental: files whose size and modification time haven't changed are skipped, and files whose contents hash the same as before are not parsed again.
+    Changed files are parsed in parallel, in a pool of processes.
+
+    Usage:
+        questionbank.py index [--db PATH] [--jobs N] DIRECTORY...
+        questionbank.py query [--db PATH] [--part-type TYPE] [--variable NAME] [--extension NAME] [--name PATTERN] [--json] [--exam PATH] [--compile PATH]
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from optparse import OptionParser
+
+from numbasobject import NumbasObject, NUMBAS_FILE_PREFIX, latest_version
+from exam import Exam, Question
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    type TEXT,
+    name TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    group_number INTEGER NOT NULL,
+    question_number INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    offset INTEGER,
+    line INTEGER,
+    data TEXT NOT NULL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS parts (
+    question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS variables (
+    question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    definition TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS functions (
+    question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    language TEXT,
+    type TEXT,
+    parameters TEXT,
+    definition TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS extensions (
+    question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS questions_file ON questions(file_id);
+CREATE INDEX IF NOT EXISTS parts_kind ON parts(kind);
+CREATE INDEX IF NOT EXISTS parts_question ON parts(question_id);
+CREATE INDEX IF NOT EXISTS variables_name ON variables(name);
+CREATE INDEX IF NOT EXISTS variables_question ON variables(question_id);
+CREATE INDEX IF NOT EXISTS functions_question ON functions(question_id);
+CREATE INDEX IF NOT EXISTS extensions_name ON extensions(name);
+CREATE INDEX IF NOT EXISTS extensions_question ON extensions(question_id);
+'''
+
+def connect(path):
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA foreign_keys = ON')
+    db.executescript(SCHEMA)
+    # indexes made before errors were recorded for each question don't have the column
+    if 'error' not in [column[1] for column in db.execute('PRAGMA table_info(questions)')]:
+        db.execute('ALTER TABLE questions ADD COLUMN error TEXT')
+    return db
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def content_hash(data):
+    """
+        A hash of a question's data, which doesn't depend on how the file is laid out
+    """
+    return hashlib.sha256(json.dumps(data,sort_keys=True).encode('utf-8')).hexdigest()
+
+def part_kinds(parts,prefix=''):
+    """
+        The kind of each part, gap and step, with its position, e.g. ``1``, ``1/gap0`` or ``1/step2``
+    """
+    kinds = []
+    for i,part in enumerate(parts):
+        path = prefix+str(i)
+        kinds.append((path,part.kind))
+        kinds += part_kinds(getattr(part,'gaps',[]),path+'/gap')
+        kinds += part_kinds(part.steps,path+'/step')
+    return kinds
+
+def find_offsets(source,names):
+    """
+        The position of each question's name in the source, as a (character offset, line number) pair, or (None, None) if it can't be found.
+        The names are looked for in order, each after the last one found.
+    """
+    is_json = source.startswith(NUMBAS_FILE_PREFIX)
+    offsets = []
+    start = 0
+    for name in names:
+        if is_json:
+            pattern = r'"name"\s*:\s*'+re.escape(json.dumps(name))
+        else:
+            pattern = r'\bname\s*:\s*("""|"|\')?'+re.escape(name)
+        m = re.compile(pattern,re.IGNORECASE).search(source,start)
+        if m is None:
+            offsets.append((None,None))
+        else:
+            offsets.append((m.start(),source.count('\n',0,m.start())+1))
+            start = m.end()
+    return offsets
+
+def question_record(question,data,extensions):
+    """
+        The information indexed for a question, given the ``Question`` object and the data it was loaded from
+    """
+    return {
+        'name': question.name,
+        'hash': content_hash(data),
+        'data': data,
+        'parts': part_kinds(question.parts),
+        'variables': [(variable.name,variable.definition) for variable in question.variables],
+        'functions': [(function.name,function.language,function.type,json.dumps(function.parameters),function.definition) for function in question.functions],
+        'extensions': sorted(set(extensions) | set(data.get('extensions',[]))),
+        'error': None,
+    }
+
+def load_question(data,extensions):
+    """
+        Load a question and return the information indexed for it.
+        If it can't be loaded, the error is recorded, along with what can be read from the data without loading it, so the rest of the file can still be indexed.
+    """
+    try:
+        return question_record(Question.fromDATA(data),data,extensions)
+    except Exception as err:
+        name = data.get('name') if isinstance(data,dict) else None
+        return {
+            'name': name if isinstance(name,str) else '',
+            'hash': content_hash(data),
+            'data': data,
+            'parts': [],
+            'variables': [],
+            'functions': [],
+            'extensions': [],
+            'error': str(err),
+        }
+
+def index_file(path,known_hash=None):
+    """
+        Read and parse a file. If its contents have the hash ``known_hash``, it isn't parsed.
+        Each question is loaded separately, so one which can't be loaded doesn't stop the others from being indexed.
+        Runs in a worker process, so only returns plain data.
+    """
+    stat = os.stat(path)
+    result = {'path': path, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'questions': [], 'type': None, 'name': None, 'error': None}
+    with open(path,'rb') as f:
+        raw = f.read()
+    result['hash'] = file_hash(raw)
+    if result['hash']==known_hash:
+        result['unchanged'] = True
+        return result
+    result['unchanged'] = False
+
+    try:
+        source = raw.decode('utf-8')
+        data = NumbasObject(source).data
+        result['type'] = data.get('type')
+        result['name'] = data.get('name')
+        questions = []
+        if data.get('type')=='exam':
+            # load the exam's settings without its questions, which are loaded one at a time below
+            exam = Exam.fromDATA(dict((key,value) for key,value in data.items() if key.lower()!='question_groups'))
+            for group_number,group_data in enumerate(data.get('question_groups',[])):
+                for question_number,question_data in enumerate(group_data.get('questions',[])):
+                    questions.append((group_number,question_number,load_question(question_data,exam.extensions)))
+        else:
+            questions.append((0,0,load_question(data,[])))
+
+        offsets = find_offsets(source,[question['name'] for _,_,question in questions])
+        for (group_number,question_number,question),(offset,line) in zip(questions,offsets):
+            question.update({'group_number': group_number, 'question_number': question_number, 'offset': offset, 'line': line})
+            result['questions'].append(question)
+    except Exception as err:
+        result['error'] = str(err)
+    return result
+
+def store_file(db,result):
+    """
+        Replace the index entries for a file with the result of ``index_file``
+    """
+    db.execute('DELETE FROM files WHERE path=?',(result['path'],))
+    cursor = db.execute(
+        'INSERT INTO files (path,mtime_ns,size,hash,type,name,error) VALUES (?,?,?,?,?,?,?)',
+        (result['path'],result['mtime_ns'],result['size'],result['hash'],result['type'],result['name'],result['error'])
+    )
+    file_id = cursor.lastrowid
+    for question in result['questions']:
+        cursor = db.execute(
+            'INSERT INTO questions (file_id,group_number,question_number,name,hash,offset,line,data,error) VALUES (?,?,?,?,?,?,?,?,?)',
+            (file_id,question['group_number'],question['question_number'],question['name'],question['hash'],question['offset'],question['line'],json.dumps(question['data']),question['error'])
+        )
+        question_id = cursor.lastrowid
+        db.executemany('INSERT INTO parts (question_id,path,kind) VALUES (?,?,?)',[(question_id,path,kind) for path,kind in question['parts']])
+        db.executemany('INSERT INTO variables (question_id,name,definition) VALUES (?,?,?)',[(question_id,name,definition) for name,definition in question['variables']])
+        db.executemany('INSERT INTO functions (question_id,name,language,type,parameters,definition) VALUES (?,?,?,?,?,?)',[(question_id,)+function for function in question['functions']])
+        db.executemany('INSERT INTO extensions (question_id,name) VALUES (?,?)',[(question_id,name) for name in question['extensions']])
+
+def find_exam_files(roots):
+    for root in roots:
+        if os.path.isfile(root):
+            yield os.path.abspath(root)
+            continue
+        for dirpath,dirnames,filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith('.exam'):
+                    yield os.path.abspath(os.path.join(dirpath,filename))
+
+def index(db,roots,jobs=None):
+    """
+        Bring the index of the .exam files in the given directories up to date.
+        Returns counts of the files which were unchanged, parsed, touched but not changed, and removed,
+        and of the files in the directories which couldn't be parsed and the questions which couldn't be loaded, whether or not they were parsed this time.
+    """
+    known = dict((path,(mtime_ns,size,hash)) for path,mtime_ns,size,hash in db.execute('SELECT path,mtime_ns,size,hash FROM files'))
+    counts = {'unchanged': 0, 'indexed': 0, 'touched': 0, 'removed': 0, 'errors': 0, 'question errors': 0}
+
+    seen = set()
+    to_check = []
+    for path in find_exam_files(roots):
+        seen.add(path)
+        stat = os.stat(path)
+        if path in known and known[path][:2]==(stat.st_mtime_ns,stat.st_size):
+            counts['unchanged'] += 1
+        else:
+            to_check.append(path)
+
+    with ProcessPoolExecutor(jobs) as executor:
+        known_hashes = [known[path][2] if path in known else None for path in to_check]
+        for result in executor.map(index_file,to_check,known_hashes,chunksize=16):
+            if result['unchanged']:
+                db.execute('UPDATE files SET mtime_ns=?, size=? WHERE path=?',(result['mtime_ns'],result['size'],result['path']))
+                counts['touched'] += 1
+            else:
+                store_file(db,result)
+                counts['indexed'] += 1
+
+    for path in known:
+        if path not in seen and in_roots(path,roots):
+            db.execute('DELETE FROM files WHERE path=?',(path,))
+            counts['removed'] += 1
+
+    db.commit()
+    counts['errors'] = len(file_errors(db,roots))
+    counts['question errors'] = len(question_errors(db,roots))
+    return counts
+
+def in_roots(path,roots):
+    """
+        Is the absolute path ``path`` in one of the directories ``roots``?
+    """
+    for root in roots:
+        root = os.path.abspath(root)
+        if path==root or path.startswith(os.path.join(root,'')):
+            return True
+    return False
+
+def file_errors(db,roots):
+    """
+        The path of each indexed file in the given directories which couldn't be parsed, with the error, in order of path
+    """
+    return [(path,error) for path,error in db.execute('SELECT path,error FROM files WHERE error IS NOT NULL ORDER BY path') if in_roots(path,roots)]
+
+def question_errors(db,roots):
+    """
+        The path, line, group number and question number of each indexed question in the given directories which couldn't be loaded, with the error, in order of path and position in the file
+    """
+    sql = '''
+        SELECT files.path, questions.line, questions.group_number, questions.question_number, questions.error
+        FROM questions JOIN files ON questions.file_id=files.id
+        WHERE questions.error IS NOT NULL
+        ORDER BY files.path, questions.group_number, questions.question_number
+    '''
+    return [row for row in db.execute(sql) if in_roots(row[0],roots)]
+
+def query(db,part_types=(),variables=(),extensions=(),name=None):
+    """
+        The questions which have parts of all the given types, variables with all the given names, and use all the given extensions,
+        and whose names match ``name``, an SQL ``LIKE`` pattern. Questions which couldn't be loaded are left out.
+    """
+    conditions = ['questions.error IS NULL']
+    args = []
+    for kind in part_types:
+        conditions.append('EXISTS (SELECT 1 FROM parts WHERE parts.question_id=questions.id AND parts.kind=?)')
+        args.append(kind.lower())
+    for variable in variables:
+        conditions.append('EXISTS (SELECT 1 FROM variables WHERE variables.question_id=questions.id AND variables.name=?)')
+        args.append(variable)
+    for extension in extensions:
+        conditions.append('EXISTS (SELECT 1 FROM extensions WHERE extensions.question_id=questions.id AND extensions.name=?)')
+        args.append(extension)
+    if name is not None:
+        conditions.append('questions.name LIKE ?')
+        args.append(name)
+
+    sql = '''
+        SELECT questions.id, files.path, questions.line, questions.name, questions.hash, questions.data,
+            (SELECT group_concat(kind,' ') FROM parts WHERE parts.question_id=questions.id),
+            (SELECT group_concat(name,' ') FROM extensions WHERE extensions.question_id=questions.id)
+        FROM questions JOIN files ON questions.file_id=files.id
+    '''
+    sql += ' WHERE '+' AND '.join(conditions)
+    sql += ' ORDER BY files.path, questions.group_number, questions.question_number'
+
+    results = []
+    for id,path,line,question_name,hash,data,kinds,question_extensions in db.execute(sql,args):
+        results.append({
+            'id': id,
+            'path': path,
+            'line': line,
+            'name': question_name,
+            'hash': hash,
+            'data': json.loads(data),
+            'part_types': kinds.split(' ') if kinds else [],
+            'extensions': question_extensions.split(' ') if question_extensions else [],
+        })
+    return results
+
+def make_exam_source(questions,name='Selected questions'):
+    """
+        The source of an exam containing the given questions, in one question group
+    """
+    extensions = sorted(set(extension for question in questions for extension in question['extensions']))
+    data = {
+        'type': 'exam',
+        'name': name,
+        'extensions': extensions,
+        'question_groups': [{
+            'name': '',
+            'pickingStrategy': 'all-ordered',
+            'pickQuestions': 0,
+            'questions': [question['data'] for question in questions],
+        }],
+    }
+    return str(NumbasObject(data=data,version=latest_version()))
+
+def run_index(args):
+    parser = OptionParser(usage="usage: %prog index [options] directory...")
+    parser.add_option('--db',dest='db',default='questionbank.sqlite',help='Path to the index database')
+    parser.add_option('-j','--jobs',dest='jobs',type='int',default=None,help='Number of files to parse at once. Defaults to the number of CPUs.')
+    (options,args) = parser.parse_args(args)
+    if not args:
+        parser.error('Give at least one directory to index')
+
+    db = connect(options.db)
+    counts = index(db,args,options.jobs)
+    print('%(indexed)i files indexed, %(unchanged)i unchanged, %(touched)i touched but not changed, %(removed)i removed, %(errors)i could not be parsed, %(question errors)i questions could not be loaded' % counts)
+    for path,error in file_errors(db,args):
+        print('%s: %s' % (path,error))
+    for path,line,group_number,question_number,error in question_errors(db,args):
+        print('%s:%s: group %i, question %i: %s' % (path,line or '',group_number,question_number,error))
+
+def run_query(args):
+    parser = OptionParser(usage="usage: %prog query [options]")
+    parser.add_option('--db',dest='db',default='questionbank.sqlite',help='Path to the index database')
+    parser.add_option('--part-type',dest='part_types',action='append',default=[],help='Only questions with a part, gap or step of this type. Can be given more than once.')
+    parser.add_option('--variable',dest='variables',action='append',default=[],help='Only questions with a variable of this name. Can be given more than once.')
+    parser.add_option('--extension',dest='extensions',action='append',default=[],help='Only questions using this extension. Can be given more than once.')
+    parser.add_option('--name',dest='name',default=None,help='Only questions whose names match this pattern, where %% matches any text')
+    parser.add_option('--json',dest='json',action='store_true',default=False,help='Print the results as JSON')
+    parser.add_option('--exam',dest='exam',default=None,help='Write an exam containing the selected questions to this path')
+    parser.add_option('--compile',dest='compile',default=None,help='Compile an exam containing the selected questions to this path. If the path ends in .zip, a zip file is made.')
+    parser.add_option('-t','--theme',dest='theme',default='default',help='Theme to use when compiling')
+    parser.add_option('-l','--locale',dest='locale',default='en-GB',help='Locale to use when compiling')
+    parser.add_option('-s','--scorm',dest='scorm',action='store_true',default=False,help='Make a SCORM package when compiling')
+    (options,args) = parser.parse_args(args)
+
+    db = connect(options.db)
+    questions = query(db,options.part_types,options.variables,options.extensions,options.name)
+
+    if options.json:
+        print(json.dumps([dict((key,value) for key,value in question.items() if key!='data') for question in questions],indent=1))
+    else:
+        for question in questions:
+            print('%s:%s\t%s\t%s' % (question['path'],question['line'] or '',question['name'],' '.join(question['part_types'])))
+        print('%i question%s' % (len(questions),'' if len(questions)==1 else 's'))
+
+    if (options.exam or options.compile) and not questions:
+        print("No questions were selected, so there's no exam to make")
+        sys.exit(1)
+    if options.exam or options.compile:
+        source = make_exam_source(questions)
+    if options.exam:
+        with open(options.exam,'w',encoding='utf-8') as f:
+            f.write(source)
+    if options.compile:
+        import numbas
+        compile_options = numbas.CompileOptions(
+            source=source,
+            output=options.compile,
+            zip=options.compile.endswith('.zip'),
+            theme=options.theme,
+            locale=options.locale,
+            scorm=options.scorm,
+            quiet=False,
+        )
+        try:
+            numbas.NumbasCompiler(compile_options).compile()
+        except numbas.CompileError as err:
+            sys.stderr.write(str(err)+'\n')
+            sys.exit(1)
+
+def run():
+    commands = {'index': run_index, 'query': run_query}
+    if len(sys.argv)<2 or sys.argv[1] not in commands:
+        print(__doc__.strip())
+        sys.exit(1)
+    commands[sys.argv[1]](sys.argv[2:])
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,190 @@
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Compile exams from asyncio code, such as a web app.
+
+    Compiling is CPU-bound, so each compile runs in a pool of worker processes, and the event loop is never blocked.
+    Reading source files and writing packages to disk is done in a thread, for the same reason.
+
+    Requests wait in a priority queue, so that interactive previews can go ahead of bulk rebuilds,
+    and at most ``concurrency`` of them are compiled at once. Each request can have a timeout.
+
+    Example::
+
+        async with CompileService(workers=4) as service:
+            files = await service.compile_exam(source,priority=PREVIEW)
+"""
+
+import asyncio
+import io
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numbas
+
+PREVIEW = 0     # priority of a request from someone waiting for the result
+BULK = 10       # priority of a request which can wait, such as rebuilding every exam
+
+DEFAULT_TIMEOUT = object()      # use the service's default timeout for a request
+
+def compile_in_worker(source,options):
+    """
+        Compile an exam in a worker process. ``options`` is a dictionary of compile options.
+        Zip files are returned as bytes, because a ``BytesIO`` can't be sent between processes.
+    """
+    package = numbas.compile_exam(source,numbas.CompileOptions(**options))
+    if isinstance(package,io.BytesIO):
+        return package.getvalue()
+    return package
+
+def write_package(package,output):
+    """
+        Write a package returned by ``compile_exam`` to ``output``: a zip file, or a directory containing the files
+    """
+    if isinstance(package,io.BytesIO):
+        with open(output,'wb') as f:
+            f.write(package.getvalue())
+    else:
+        for path,data in package.items():
+            dst = os.path.join(output,*path.split('/'))
+            os.makedirs(os.path.dirname(dst),exist_ok=True)
+            with open(dst,'wb') as f:
+                f.write(data)
+
+def read_source(path):
+    with open(path,encoding='utf-8') as f:
+        return f.read()
+
+class CompileService(object):
+    """
+        Compiles exams in a pool of ``workers`` processes, with at most ``concurrency`` compiles running or waiting for a worker at once.
+
+        ``timeout`` is the default number of seconds a request can take, including the time spent waiting in the queue.
+        A worker can't be interrupted, so when a compile times out its result is thrown away when it finishes.
+    """
+    def __init__(self,workers=None,concurrency=None,timeout=None,executor=None):
+        self.executor = executor if executor is not None else ProcessPoolExecutor(workers)
+        self.concurrency = concurrency or workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.counter = itertools.count()
+        self.queue = None
+        self.semaphore = None
+        self.dispatcher = None
+        self.running = set()
+        self.stats = {'completed': 0, 'failed': 0, 'timed out': 0}
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self,*exc):
+        await self.close()
+
+    async def start(self):
+        """
+            Start taking requests off the queue. This must be called from the event loop which will make the requests.
+        """
+        self.queue = asyncio.PriorityQueue()
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.dispatcher = asyncio.ensure_future(self.dispatch())
+
+    async def close(self):
+        """
+            Stop taking requests, wait for the running compiles to finish, and shut down the worker processes
+        """
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+            try:
+                await self.dispatcher
+            except asyncio.CancelledError:
+                pass
+            self.dispatcher = None
+        if self.running:
+            await asyncio.gather(*self.running,return_exceptions=True)
+        while self.queue is not None and not self.queue.empty():
+            _, _, job = self.queue.get_nowait()
+            if not job['future'].done():
+                job['future'].cancel()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None,self.executor.shutdown)
+
+    async def dispatch(self):
+        """
+            Take requests off the queue, in order of priority, whenever fewer than ``concurrency`` compiles are running
+        """
+        while True:
+            await self.semaphore.acquire()
+            try:
+                _, _, job = await self.queue.get()
+            except asyncio.CancelledError:
+                self.semaphore.release()
+                raise
+            if job['future'].done():
+                # the request timed out or was cancelled while it was in the queue
+                self.semaphore.release()
+                continue
+            task = asyncio.ensure_future(self.run(job))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def run(self,job):
+        loop = asyncio.get_running_loop()
+        try:
+            package = await loop.run_in_executor(self.executor,compile_in_worker,job['source'],job['options'])
+        except Exception as err:
+            self.stats['failed'] += 1
+            if not job['future'].done():
+                job['future'].set_exception(err)
+        else:
+            self.stats['completed'] += 1
+            if not job['future'].done():
+                job['future'].set_result(io.BytesIO(package) if isinstance(package,bytes) else package)
+        finally:
+            self.semaphore.release()
+
+    async def compile_exam(self,source,options=None,priority=BULK,timeout=DEFAULT_TIMEOUT,**kwargs):
+        """
+            Compile an exam, and return the package as ``numbas.compile_exam`` does.
+
+            Requests with lower ``priority`` numbers go first; requests with the same priority go in the order they were made.
+            Raises ``asyncio.TimeoutError`` if the package isn't ready within ``timeout`` seconds. By default, the service's default timeout is used; if ``timeout`` is None, there's no time limit.
+        """
+        if self.queue is None:
+            raise RuntimeError("The compile service hasn't been started")
+        if options is None:
+            options = numbas.CompileOptions()
+        options = options.copy(**kwargs).todict()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((priority,next(self.counter),{'source': source, 'options': options, 'future': future}))
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.timeout
+        try:
+            return await asyncio.wait_for(future,timeout)
+        except asyncio.TimeoutError:
+            self.stats['timed out'] += 1
+            raise
+
+    async def compile_file(self,path,output=None,**kwargs):
+        """
+            Compile the exam in the file at ``path``. If ``output`` is given, the package is written there, as a zip file if the zip option is set or otherwise as a directory.
+            Returns the package.
+        """
+        loop = asyncio.get_running_loop()
+        source = await loop.run_in_executor(None,read_source,path)
+        package = await self.compile_exam(source,**kwargs)
+        if output is not None:
+            await loop.run_in_executor(None,write_package,package,output)
+        return package
@@ -0,0 +1,146 @@
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Render the Jinja templates in themes.
+
+    Compiling a template takes much longer than rendering it, so every compile in a process which uses the same template directories shares one Jinja environment,
+    which keeps the compiled templates and reloads a template when its file changes.
+    If a directory is given for the bytecode cache, compiled templates are also saved there, so a new process doesn't need to compile them again.
+
+    A template which doesn't refer to ``exam``, and doesn't include any template which does, renders the same way for every exam.
+    Its output is kept, and used again by any compile which gives the same values for the options the template reads.
+"""
+
+import os
+import threading
+
+import jinja2
+import jinja2.meta
+from jinja2 import nodes
+
+class ThemeTemplates(object):
+    """
+        The templates in the directories ``template_paths``, searched in that order.
+        ``stats`` counts the renders which used kept output (hits), and those which didn't (misses).
+    """
+    def __init__(self,template_paths,bytecode_dir=None):
+        bytecode_cache = None
+        if bytecode_dir is not None:
+            os.makedirs(bytecode_dir,exist_ok=True)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_dir)
+        self.environment = jinja2.Environment(loader=jinja2.FileSystemLoader(template_paths),bytecode_cache=bytecode_cache)
+        self.lock = threading.Lock()
+        self.dependencies = {}
+        self.outputs = {}
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def render(self,name,exam,options):
+        """
+            Render the template ``name``. Raises ``jinja2.exceptions.TemplateNotFound`` if there's no such template.
+        """
+        template = self.environment.get_template(name)
+        templates, option_names = self.find_dependencies(name)
+
+        if option_names is None:
+            key = None
+        else:
+            key = (name,tuple((option,repr(getattr(options,option,None))) for option in option_names))
+            with self.lock:
+                kept = self.outputs.get(key)
+            if kept is not None and up_to_date(kept[0]):
+                with self.lock:
+                    self.stats['hits'] += 1
+                return kept[1]
+
+        output = template.render({'exam': exam, 'options': options})
+        with self.lock:
+            self.stats['misses'] += 1
+            if key is not None:
+                self.outputs[key] = (templates,output)
+        return output
+
+    def find_dependencies(self,name):
+        """
+            Work out what the output of the template ``name`` depends on.
+
+            Returns a list of the templates which were looked at, and a sorted tuple of the names of the options which are read.
+            The names of the options are None if the output depends on the exam, or on something else which can't be worked out:
+            ``options`` being used other than to read an attribute, or a template being included by a name which isn't fixed.
+        """
+        with self.lock:
+            known = self.dependencies.get(name)
+        if known is not None and up_to_date(known[0]):
+            return known
+
+        templates = []
+        option_names = set()
+        seen = set()
+        todo = [name]
+        while todo:
+            template_name = todo.pop()
+            if template_name in seen:
+                continue
+            seen.add(template_name)
+            templates.append(self.environment.get_template(template_name))
+            source = self.environment.loader.get_source(self.environment,template_name)[0]
+            ast = self.environment.parse(source,template_name)
+
+            variables = jinja2.meta.find_undeclared_variables(ast)
+            if 'exam' in variables:
+                option_names = None
+                break
+            if 'options' in variables:
+                names = options_read(ast)
+                if names is None:
+                    option_names = None
+                    break
+                option_names.update(names)
+
+            included = list(jinja2.meta.find_referenced_templates(ast))
+            if None in included:
+                option_names = None
+                break
+            todo += included
+
+        result = (templates,tuple(sorted(option_names)) if option_names is not None else None)
+        with self.lock:
+            self.dependencies[name] = result
+        return result
+
+def options_read(ast):
+    """
+        The names of the attributes of ``options`` read in a template, or None if ``options`` is used in any other way
+    """
+    uses = [node for node in ast.find_all(nodes.Name) if node.name=='options' and node.ctx=='load']
+    lookups = [node for node in ast.find_all(nodes.Getattr) if isinstance(node.node,nodes.Name) and node.node.name=='options']
+    if len(lookups)!=len(uses):
+        return None
+    return set(node.attr for node in lookups)
+
+def up_to_date(templates):
+    return all(template.is_up_to_date for template in templates)
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+def get_templates(template_paths,bytecode_dir=None):
+    """
+        The ``ThemeTemplates`` for the given template directories. The same object is used by every compile in this process.
+    """
+    key = (tuple(template_paths),bytecode_dir)
+    with _templates_lock:
+        if key not in _templates:
+            _templates[key] = ThemeTemplates(template_paths,bytecode_dir)
+        return _templates[key]
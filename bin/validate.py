@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Check exams for problems without compiling them.
+
+    Each file is parsed and loaded, and its questions and parts are converted to XML. This finds the problems which would otherwise only show up in a full compile:
+    syntax errors, unknown part types, content which isn't valid XHTML, gap-fill prompts which refer to gaps that don't exist, and missing extensions and resources.
+    No templates are rendered, nothing is bundled, and nothing is written.
+
+    Each question is checked on its own, so every broken question and part in a file is reported at once, with the line it starts on.
+    A file with syntax errors is parsed in recovery mode, so all of its syntax errors are reported too.
+    Directories are searched for .exam files, which are checked in parallel in a pool of processes.
+
+    Usage: validate.py [-p PATH] [-j JOBS] [--json] FILE_OR_DIRECTORY...
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from optparse import OptionParser
+
+import examparser
+from numbasobject import NumbasObject
+from exam import Exam, Question, Part
+from questionbank import find_offsets, find_exam_files
+
+NUMBAS_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def describe_exception(err):
+    if isinstance(err,examparser.ParseError):
+        return str(err)
+    message = str(err)
+    if isinstance(err,KeyError) or not message:
+        message = '%s: %s' % (type(err).__name__,message)
+    return message
+
+def check_part(data):
+    """
+        Load a part and make its XML. Returns an error message, or None if there's nothing wrong.
+    """
+    try:
+        Part.fromDATA(data).toxml()
+    except Exception as err:
+        return describe_exception(err)
+
+def check_question(data):
+    """
+        The problems with a question, as a list of (location, message) pairs.
+        When a question can't be loaded, each part is checked on its own, to find out which parts are responsible.
+    """
+    try:
+        Question.fromDATA(data).toxml()
+        return []
+    except Exception as err:
+        question_error = describe_exception(err)
+
+    problems = []
+    parts = data.get('parts',[]) if isinstance(data,dict) else []
+    for i,part in enumerate(parts):
+        message = check_part(part)
+        if message is not None:
+            problems.append(('part %i' % i,message))
+    if not problems:
+        problems.append(('',question_error))
+    return problems
+
+def validate_source(source,path='<source>',numbas_path=NUMBAS_PATH):
+    """
+        The problems with an exam or question, given its source.
+        Each problem is a dictionary with the keys ``path``, ``line``, ``location`` and ``message``. ``line`` is None when the line isn't known.
+    """
+    errors = []
+    def add_error(message,line=None,location=''):
+        errors.append({'path': path, 'line': line, 'location': location, 'message': message})
+
+    try:
+        data = NumbasObject(source).data
+    except examparser.ParseError as err:
+        # parse the source again, carrying on after each error, so they can all be reported at once
+        parser = examparser.ExamParser()
+        parser.parse(source.replace('\ufeff',''),recover=True)
+        for parse_error in parser.errors or [err]:
+            add_error(str(parse_error),parse_error.line)
+        return errors
+    except Exception as err:
+        add_error(describe_exception(err))
+        return errors
+
+    # files without navigation settings are marked as questions when they're migrated, but they're compiled as exams if they have question groups
+    if data.get('type')=='question' and 'question_groups' not in data:
+        questions = [('',data)]
+        extensions = data.get('extensions',[])
+        resources = data.get('resources',[])
+    else:
+        settings = dict((key,value) for key,value in data.items() if key!='question_groups')
+        try:
+            exam = Exam.fromDATA(settings)
+            exam.toxml()
+        except Exception as err:
+            add_error(describe_exception(err),location='exam settings')
+            exam = Exam()
+        extensions = exam.extensions
+        resources = exam.resources
+
+        questions = []
+        for group_number,group in enumerate(data.get('question_groups',[])):
+            for question_number,question in enumerate(group.get('questions',[])):
+                questions.append(('group %i question %i' % (group_number,question_number),question))
+
+    for extension in extensions:
+        if not os.path.isdir(os.path.join(numbas_path,'extensions',extension)):
+            add_error('Extension %s not found' % extension)
+    for resource in resources:
+        resource_path = resource[1] if isinstance(resource,list) else resource
+        if not os.path.exists(os.path.join(numbas_path,resource_path)):
+            add_error('Resource %s not found' % resource_path)
+
+    names = [question.get('name','') if isinstance(question,dict) else '' for _,question in questions]
+    offsets = find_offsets(source,names)
+    for (location,question),name,(_,line) in zip(questions,names,offsets):
+        # makeContentNode prints bad content to stderr as well as raising an error: the error is enough here
+        with contextlib.redirect_stderr(io.StringIO()):
+            problems = check_question(question)
+        for part_location,message in problems:
+            full_location = ' '.join(x for x in [location,'"%s"' % name if name else '',part_location] if x)
+            add_error(message,line,full_location)
+
+    return errors
+
+def validate_file(path,numbas_path=NUMBAS_PATH):
+    """
+        The problems with the exam or question in the file at ``path``. Runs in a worker process.
+    """
+    try:
+        with open(path,encoding='utf-8') as f:
+            source = f.read()
+    except (OSError,UnicodeDecodeError) as err:
+        return [{'path': path, 'line': None, 'location': '', 'message': str(err)}]
+    return validate_source(source,path,numbas_path)
+
+def validate(paths,numbas_path=NUMBAS_PATH,jobs=None):
+    """
+        The problems with every .exam file in the given files and directories, in the order the files are found.
+        Returns the number of files checked and the list of problems.
+    """
+    files = list(find_exam_files(paths))
+    errors = []
+    if len(files)<=1:
+        for path in files:
+            errors += validate_file(path,numbas_path)
+    else:
+        with ProcessPoolExecutor(jobs) as executor:
+            for file_errors in executor.map(validate_file,files,[numbas_path]*len(files),chunksize=16):
+                errors += file_errors
+    return len(files), errors
+
+def format_error(error):
+    position = error['path']
+    if error['line'] is not None:
+        position += ':%i' % error['line']
+    if error['location']:
+        position += ': '+error['location']
+    return '%s: %s' % (position,error['message'])
+
+def run():
+    parser = OptionParser(usage="usage: %prog [options] file_or_directory...")
+    parser.add_option('-p','--path',dest='path',default=NUMBAS_PATH,help='The path to the Numbas files, where extensions and resources are looked for')
+    parser.add_option('-j','--jobs',dest='jobs',type='int',default=None,help='Number of worker processes. Defaults to the number of CPUs.')
+    parser.add_option('--json',dest='json',action='store_true',default=False,help='Write the problems as JSON')
+    (options,args) = parser.parse_args()
+
+    if not args:
+        parser.print_help()
+        return
+
+    num_files, errors = validate(args,options.path,options.jobs)
+
+    if options.json:
+        json.dump(errors,sys.stdout,indent=1)
+        sys.stdout.write('\n')
+    else:
+        for error in errors:
+            print(format_error(error))
+        files_with_errors = len(set(error['path'] for error in errors))
+        sys.stderr.write('%i file%s checked, %i with problems\n' % (num_files,'' if num_files==1 else 's',files_with_errors))
+
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    run()
@@ -12,23 +12,100 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-import re
+import json
+import xml.etree.ElementTree as etree
+
+# size of the pieces that write_encoded escapes at once
+ENCODE_CHUNK_SIZE = 1<<16
+
+def escape(xml):
+    """
+        Escape the characters that can't appear in a double-quoted JavaScript string literal. Carriage returns are dropped.
+        (Chained ``str.replace`` calls are much faster than a single ``str.translate`` with a table of multi-character replacements.)
+    """
+    return xml.replace('\r','').replace('\\','\\\\').replace('\n','\\n').replace('"','\\"')
 
 def encode(xml):
-    xml = xml.strip()
-    xml = re.sub('\r','',xml)
-    xml = re.sub('\\\\','\\\\\\\\',xml)
-    xml = re.sub('\n',r'\\n',xml)
-    xml = re.sub('"','\\"',xml)
-    return xml
-
-rawxml_js_template = """Numbas.queueScript('settings',{extensionfiles},function() {{
-    Numbas.rawxml = {{
-        templates: {{
-            {templates}
-        }},
-
-        examXML: \"{examXML}\"
-    }};
-}});
-"""
+    """
+        Escape a string so it can be put inside a double-quoted JavaScript string literal
+    """
+    return escape(xml.strip())
+
+def write_encoded(out,xml):
+    """
+        Write the output of ``encode(xml)`` to the file-like object ``out``.
+        The string is escaped a chunk at a time, in a single pass, so no escaped copy of the whole string is made.
+    """
+    start, end = 0, len(xml)
+    while start<end and xml[start].isspace():
+        start += 1
+    while end>start and xml[end-1].isspace():
+        end -= 1
+    for i in range(start,end,ENCODE_CHUNK_SIZE):
+        out.write(escape(xml[i:min(i+ENCODE_CHUNK_SIZE,end)]))
+
+def json_literal(data):
+    """
+        Encode ``data`` as compact JSON, inside a single-quoted JavaScript string literal, for the runtime to load with ``JSON.parse``.
+        JSON has a lot of double quotes, which don't need escaping in a single-quoted string.
+    """
+    s = json.dumps(data,ensure_ascii=False,separators=(',',':'))
+    return "'"+s.replace('\\','\\\\').replace("'","\\'").replace('\u2028','\\u2028').replace('\u2029','\\u2029')+"'"
+
+def exam_json(root):
+    """
+        Split the exam XML into its structure, as JsonML, and its ``<content>`` fragments, as a single string of XML.
+
+        The structure is an array ``[tag, {attributes}, child, ...]`` for each element, where text nodes are strings, and each ``<content>`` element is replaced by its index in the fragments.
+        Attribute names are lower-cased, as the runtime does when it loads an XML document.
+        Whitespace between elements outside ``<content>`` is only indentation added by ``exam.indent``, so it's dropped.
+        The content fragments are serialised whole, so whitespace inside them is kept, as the children of a single ``<contents>`` element.
+
+        The tails of the ``<content>`` elements in ``root`` are removed.
+    """
+    contents = etree.Element('contents')
+    def jsonml(element):
+        if element.tag == 'content':
+            element.tail = None
+            contents.append(element)
+            return len(contents)-1
+        node = [element.tag]
+        if element.attrib:
+            node.append({name.lower(): value for name,value in element.attrib.items()})
+        if len(element):
+            if element.text and not element.text.isspace():
+                node.append(element.text)
+            for child in element:
+                node.append(jsonml(child))
+                if child.tail and not child.tail.isspace():
+                    node.append(child.tail)
+        elif element.text:
+            node.append(element.text)
+        return node
+
+    structure = jsonml(root)
+    return structure, etree.tostring(contents,encoding='unicode')
+
+def write_rawxml_js(out,extensionfiles,templates,examXML=None,examJSON=None,examContent=None):
+    """
+        Write the contents of settings.js to the file-like object ``out``.
+
+        ``templates`` maps the names of XSLT templates to their source.
+        The exam definition is either ``examXML``, a string of XML, or the structure and content fragments produced by ``exam_json``, as ``examJSON`` and ``examContent``.
+        The strings are escaped as they're written.
+    """
+    out.write("Numbas.queueScript('settings',%s,function() {\n    Numbas.rawxml = {\n        templates: {\n            " % extensionfiles)
+    for i,(name,body) in enumerate(templates.items()):
+        if i>0:
+            out.write(',\n\t\t')
+        out.write('%s: "' % name)
+        write_encoded(out,body)
+        out.write('"')
+    out.write('\n        },\n\n        ')
+    if examJSON is not None:
+        out.write('examJSON: %s,\n\n        examContent: "' % json_literal(examJSON))
+        write_encoded(out,examContent)
+    else:
+        out.write('examXML: "')
+        write_encoded(out,examXML)
+    out.write('"\n    };\n});\n')
@@ -412,12 +412,22 @@ Exam.prototype = /** @lends Numbas.Exam.prototype */ {
 		this.questionList = [];
         var questionAcc = 0;
         
+        // if the questions are in separate files, fetch the picked ones all at once before making any of them
+        var pickedNodes = [];
+        this.question_groups.forEach(function(group) {
+            var questionNodes = group.xml.selectNodes("questions/question");
+            group.questionSubset.forEach(function(n) {
+                pickedNodes.push(questionNodes[n]);
+            });
+        });
+        Numbas.xml.loadQuestionChunks(pickedNodes);
+
         this.question_groups.forEach(function(group) {
             group.questionList = [];
             var questionNodes = group.xml.selectNodes("questions/question");
             group.questionSubset.forEach(function(n) {
                 job(function(n) {
-    				var question = new Numbas.Question( exam, group, questionNodes[n], questionAcc++, loading, exam.scope );
+    				var question = new Numbas.Question( exam, group, Numbas.xml.loadQuestionXML(questionNodes[n]), questionAcc++, loading, exam.scope );
                     exam.questionList.push(question);
                     group.questionList.push(question);
                 },group,n);
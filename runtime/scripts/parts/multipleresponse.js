@@ -278,11 +278,9 @@ var MultipleResponsePart = Numbas.parts.MultipleResponsePart = function(xml, pat
 		for( i=0; i<this.numAnswers; i++ ) {
 			markingMatrixArray.push([]);
 		}
-		for( i=0; i<matrixNodes.length; i++ ) {
-			var cell = {value: ""};
-			tryGetAttribute(cell,null, matrixNodes[i], ['answerIndex', 'choiceIndex', 'value']);
-
-			if(this.flipped) {
+		var part = this;
+		function setMark(cell) {
+			if(part.flipped) {
 				// possible answers are recorded as choices in the multiple choice types.
 				// switch the indices round, so we don't have to worry about this again
 				cell.answerIndex = cell.choiceIndex;
@@ -290,16 +288,39 @@ var MultipleResponsePart = Numbas.parts.MultipleResponsePart = function(xml, pat
 			}
 
 			//take into account shuffling
-			cell.answerIndex = this.shuffleAnswers[cell.answerIndex];
-			cell.choiceIndex = this.shuffleChoices[cell.choiceIndex];
+			cell.answerIndex = part.shuffleAnswers[cell.answerIndex];
+			cell.choiceIndex = part.shuffleChoices[cell.choiceIndex];
 
 			markingMatrixArray[cell.answerIndex][cell.choiceIndex] = cell.value;
 		}
+
+		// a sparse matrix only has <mark> elements for the cells which aren't the default value
+		var defaultMark = markingMatrixNode.getAttribute('default');
+		if(defaultMark!==null) {
+			var size = {choices: 0, answers: 0};
+			tryGetAttribute(size,null,markingMatrixNode,['choices','answers']);
+			for( i=0; i<size.choices; i++ ) {
+				for(var j=0; j<size.answers; j++ ) {
+					setMark({answerIndex: j, choiceIndex: i, value: defaultMark});
+				}
+			}
+		}
+
+		for( i=0; i<matrixNodes.length; i++ ) {
+			var cell = {value: ""};
+			tryGetAttribute(cell,null, matrixNodes[i], ['answerIndex', 'choiceIndex', 'value']);
+			setMark(cell);
+		}
 	}
 
+	// empty distractors aren't written out, so every cell starts with an empty message
 	var distractors = [];
 	for( i=0; i<this.numAnswers; i++ ) {
-		distractors.push([]);
+		var row = [];
+		for(var j=0; j<this.numChoices; j++ ) {
+			row.push('');
+		}
+		distractors.push(row);
 	}
 	var distractorNodes = this.xml.selectNodes('marking/distractors/distractor');
 	for( i=0; i<distractorNodes.length; i++ )
@@ -48,6 +48,17 @@ Numbas.schedule = /** @lends Numbas.schedule */ {
 	 */
 	halt:false,
 
+	/** Number of things, such as files being loaded, that must finish before any more tasks are run
+	 * @type {Number}
+	 * @see Numbas.schedule.wait
+	 */
+	waiting: 0,
+
+	/** Number of times a task would have been run while the scheduler was waiting
+	 * @type {Number}
+	 */
+	missed: 0,
+
     /** @typedef {Object} Numbas.schedule.task_object
      * @property {function} task - The function to execute.
      * @property {function} error - A callback, used if an error is raised.
@@ -93,6 +104,38 @@ Numbas.schedule = /** @lends Numbas.schedule */ {
 		schedule.total++;
 	},
 
+	/** Stop running tasks until something asynchronous, such as loading a file, has finished.
+	 *
+	 * Returns a function to call when it has finished. If it's called with an error, the scheduler halts and shows the error.
+	 * @returns {function}
+	 */
+	wait: function()
+	{
+		var schedule = Numbas.schedule;
+
+		schedule.waiting++;
+		var finished = false;
+		return function(error) {
+			if(finished) {
+				return;
+			}
+			finished = true;
+			schedule.waiting--;
+			if(error) {
+				Numbas.display.die(error);
+				schedule.halt = true;
+				return;
+			}
+			if(schedule.waiting==0) {
+				var missed = schedule.missed;
+				schedule.missed = 0;
+				for(var i=0;i<missed;i++) {
+					setTimeout(schedule.pop,0);
+				}
+			}
+		};
+	},
+
 	/** Pop the first task off the queue and run it.
 	 *
 	 * If there's an error, the scheduler halts and shows the error.
@@ -101,6 +144,11 @@ Numbas.schedule = /** @lends Numbas.schedule */ {
 	{
 		var schedule = Numbas.schedule;
 
+		if(schedule.waiting) {
+			schedule.missed++;
+			return;
+		}
+
 		var calls = schedule.calls;
 		if(!calls.length || schedule.halt){return;}
 
@@ -28,10 +28,17 @@ var xml = Numbas.xml = {
 	 */
 	dp: new DOMParser(),
 
-	/** Load in all the XSLT/XML documents from {@link Numbas.rawxml} */
+	/** Load in all the XSLT/XML documents from {@link Numbas.rawxml}.
+	 *
+	 * The exam definition is either a string of XML, `Numbas.rawxml.examXML`, or its structure as a string of JSON, `Numbas.rawxml.examJSON`, with the content fragments in `Numbas.rawxml.examContent`.
+	 */
 	loadXMLDocs: function()
 	{
-		var examXML = xml.examXML = xml.loadXML(Numbas.rawxml.examXML);
+		if(Numbas.rawxml.examJSON!==undefined) {
+			xml.examXML = xml.loadJSONExam(JSON.parse(Numbas.rawxml.examJSON),Numbas.rawxml.examContent);
+		} else {
+			xml.examXML = xml.loadXML(Numbas.rawxml.examXML);
+		}
 
 		var templates = xml.templates = {};
 		for(var x in Numbas.rawxml.templates)
@@ -41,6 +48,89 @@ var xml = Numbas.xml = {
 		}
 	},
 
+	/** Questions which have been loaded from separate files, indexed by path
+	 * @type {Object.<Element>}
+	 * @see Numbas.xml.loadQuestionChunks
+	 */
+	questionChunks: {},
+
+	/** Fetch the files containing the given questions, if the exam was compiled with each question in a separate file.
+	 *
+	 * In that case, the exam XML only contains a placeholder `<question>` element for each question, whose `chunk` attribute gives the path of the file containing the question's XML.
+	 * The files are all requested at once, and the scheduler waits until they've all loaded, so they're ready when the questions are made.
+	 * @param {Element[]} questionNodes - `<question>` elements from the exam XML
+	 */
+	loadQuestionChunks: function(questionNodes)
+	{
+		var paths = [];
+		questionNodes.forEach(function(questionNode) {
+			var path = questionNode.getAttribute('chunk');
+			if(path && !xml.questionChunks[path] && paths.indexOf(path)==-1) {
+				paths.push(path);
+			}
+		});
+		if(!paths.length) {
+			return;
+		}
+
+		var done = Numbas.schedule.wait();
+		var remaining = paths.length;
+		paths.forEach(function(path) {
+			var req = new XMLHttpRequest();
+			function fail(message) {
+				done(new Numbas.Error('xml.could not load question',{path:path,message:message}));
+			}
+			req.onload = function() {
+				// a status of 0 means there was no response from a server, for example because the exam was opened from a file
+				if(req.status==0 || !req.responseText) {
+					fail(R('xml.no response'));
+					return;
+				}
+				if(req.status!=200) {
+					fail(req.status+' '+req.statusText);
+					return;
+				}
+				try {
+					xml.questionChunks[path] = xml.loadXML(req.responseText).selectSingleNode('question');
+				} catch(e) {
+					done(e);
+					return;
+				}
+				remaining--;
+				if(remaining==0) {
+					done();
+				}
+			};
+			req.onerror = function() {
+				fail(R('xml.no response'));
+			};
+			try {
+				req.open('GET',path,true);
+				req.send(null);
+			} catch(e) {
+				fail(e.message);
+			}
+		});
+	},
+
+	/** Get the XML for a question. 
+	 *
+	 * If the question is in a separate file, it must already have been loaded by {@link Numbas.xml.loadQuestionChunks}.
+	 * @param {Element} questionNode - the `<question>` element from the exam XML
+	 * @returns {Element}
+	 */
+	loadQuestionXML: function(questionNode)
+	{
+		var path = questionNode.getAttribute('chunk');
+		if(!path) {
+			return questionNode;
+		}
+		if(!xml.questionChunks[path]) {
+			throw(new Numbas.Error('xml.could not load question',{path:path,message:R('xml.no response')}));
+		}
+		return xml.questionChunks[path];
+	},
+
 	/** Load in a single XML document
 	 * @param {String} xmlstring
 	 * @returns {XMLDocument}
@@ -85,6 +175,56 @@ var xml = Numbas.xml = {
 		return doc;
 	},
 
+	/** Build the exam XML document from its structure and content fragments, as produced by the compiler's `--json-exam` option.
+	 *
+	 * The structure is a JsonML array, `[tag, {attributes}, child, ...]`, where text nodes are strings and each `<content>` element is replaced by its index in the content fragments.
+	 * The fragments are the children of a single `<contents>` element, so they're parsed in one go, and their nodes are moved into the exam document, keeping their whitespace.
+	 * The rest of the document is made directly with DOM calls. The compiler has already lower-cased its attribute names.
+	 * @param {Array} structure
+	 * @param {String} contentXML
+	 * @returns {XMLDocument}
+	 */
+	loadJSONExam: function(structure,contentXML)
+	{
+		var doc = xml.loadXML(contentXML);
+		var fragments = [];
+		var nodes = doc.documentElement.childNodes;
+		for(var i=0;i<nodes.length;i++) {
+			fragments.push(nodes[i]);
+		}
+		doc.replaceChild(xml.jsonMLToNode(doc,structure,fragments),doc.documentElement);
+		return doc;
+	},
+
+	/** Create a DOM node from a JsonML array, a string, or the index of a content fragment
+	 * @param {XMLDocument} doc - the document the node will belong to
+	 * @param {Array|String|Number} data
+	 * @param {Element[]} fragments - the `<content>` elements, already in `doc`
+	 * @returns {Node}
+	 */
+	jsonMLToNode: function(doc,data,fragments)
+	{
+		if(typeof(data)=='string') {
+			return doc.createTextNode(data);
+		}
+		if(typeof(data)=='number') {
+			return fragments[data];
+		}
+		var elem = doc.createElement(data[0]);
+		var i = 1;
+		if(data.length>1 && typeof(data[1])=='object' && !Array.isArray(data[1])) {
+			var attributes = data[1];
+			for(var name in attributes) {
+				elem.setAttribute(name,attributes[name]);
+			}
+			i = 2;
+		}
+		for(;i<data.length;i++) {
+			elem.appendChild(xml.jsonMLToNode(doc,data[i],fragments));
+		}
+		return elem;
+	},
+
     /** The definition of a custom JME function.
      * @typedef func_data
 	 * @type {Object}
@@ -0,0 +1,52 @@
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Check that sharing questions between exams through a ``QuestionCache`` doesn't change the exam XML.
+
+    Run from the top of the repository with ``python -m unittest tests.test_exam``.
+"""
+
+import os
+import sys
+import unittest
+
+NUMBAS_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,os.path.join(NUMBAS_PATH,'bin'))
+
+from exam import Exam, QuestionCache
+from benchmarks.generate import ExamSize, make_exam_source
+
+class QuestionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.source = make_exam_source(ExamSize(groups=2,questions=3,content_length=200))
+        self.expected = Exam.fromstring(self.source).tostring()
+
+    def test_shared_between_exams(self):
+        cache = QuestionCache()
+        for i in range(3):
+            self.assertEqual(Exam.fromstring(self.source,cache).tostring(),self.expected)
+        # the XML is kept from the second exam on
+        self.assertEqual(cache.stats,{'hits': 12, 'misses': 6, 'xml hits': 6, 'xml misses': 6})
+
+    def test_forgotten_questions(self):
+        cache = QuestionCache(max_size=2)
+        for i in range(3):
+            self.assertEqual(Exam.fromstring(self.source,cache).tostring(),self.expected)
+        self.assertEqual(len(cache.questions),2)
+        self.assertEqual(len(cache.uses),2)
+        self.assertLessEqual(len(cache.xml),2)
+
+if __name__ == '__main__':
+    unittest.main()
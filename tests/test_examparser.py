@@ -0,0 +1,145 @@
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Check that data written by ``examparser.writedata`` is read back the same by ``ExamParser.parse``,
+    and that syntax errors are reported at the right place.
+
+    Run from the top of the repository with ``python -m unittest tests.test_examparser``.
+"""
+
+import io
+import os
+import random
+import sys
+import unittest
+
+NUMBAS_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,os.path.join(NUMBAS_PATH,'bin'))
+
+from examparser import ExamParser, ParseError, printdata, writedata
+from benchmarks.generate import ExamSize, make_exam_data
+
+# The original format can't tell a string which looks like a number from the number, drops whitespace at either end of a string,
+# and lower-cases keys, so the generated strings avoid those.
+WORDS = ['a','value','x^2','{x}','[1,2]','a, b','say "hi"','key: value','http://numbas.org.uk','//','#','é','tab\there','line 1\nline 2','"""','infinity','true story','}',']']
+
+def random_value(rng,depth):
+    kind = rng.randrange(6 if depth>0 else 4)
+    if kind==0:
+        return rng.choice(WORDS)
+    elif kind==1:
+        return rng.choice([True,False])
+    elif kind==2:
+        return rng.randint(-1000,1000)
+    elif kind==3:
+        return rng.randint(-1000,1000)/8
+    elif kind==4:
+        return [random_value(rng,depth-1) for i in range(rng.randrange(4))]
+    else:
+        return random_dict(rng,depth-1)
+
+def random_dict(rng,depth):
+    return dict(('key{}'.format(i),random_value(rng,depth)) for i in range(rng.randrange(5)))
+
+class RoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = ExamParser()
+
+    def assertRoundTrips(self,data):
+        out = io.StringIO()
+        writedata(data,out)
+        self.assertEqual(self.parser.parse(out.getvalue()),data)
+
+    def test_stability_exam(self):
+        with open(os.path.join(NUMBAS_PATH,'tests','stability-test.exam'),encoding='utf-8') as f:
+            data = self.parser.parse(f.read())
+        self.assertRoundTrips(data)
+
+    def test_synthetic_exam(self):
+        self.assertRoundTrips(make_exam_data(ExamSize(groups=2,questions=3,content_length=500)))
+
+    def test_random_structures(self):
+        rng = random.Random(0)
+        for i in range(200):
+            data = random_dict(rng,4)
+            with self.subTest(i=i):
+                self.assertRoundTrips(data)
+
+    def test_printdata(self):
+        data = make_exam_data(ExamSize(groups=1,questions=2,content_length=200))
+        self.assertEqual(self.parser.parse(printdata(data)),data)
+
+# Several mistakes: a missing ], an unterminated string, a } where ] was meant, and a ] where } was meant.
+BROKEN_SOURCE = """{
+    a: 1
+    b: {x: 1, y: [1, 2, }
+    c: "unterminated
+    d: 4
+    e: [1, {p: 2], 3]
+    f: 6
+    g: {h: [1, 2}
+    i: 9
+}"""
+
+class ErrorLocationTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = ExamParser()
+
+    def assertErrorAt(self,source,line,column,message):
+        with self.assertRaises(ParseError) as cm:
+            self.parser.parse(source)
+        err = cm.exception
+        self.assertEqual((err.line,err.column,err.message),(line,column,message))
+        self.assertIn('at line {}, column {} near'.format(line,column),str(err))
+
+    def test_strict_reports_first_error(self):
+        self.assertErrorAt(BROKEN_SOURCE,3,25,'Expected either , or ] in array definition')
+
+    def test_recover_reports_every_error(self):
+        data = self.parser.parse(BROKEN_SOURCE,recover=True)
+        self.assertEqual([(e.line,e.column,e.message) for e in self.parser.errors],[
+            (3,25,'Expected either , or ] in array definition'),
+            (4,8,'Expected " to end string literal'),
+            (6,17,'Expected either } or , in object definition'),
+            (6,20,"Invalid name '3]' for an object property"),
+            (8,17,'Expected either , or ] in array definition'),
+        ])
+        self.assertEqual(list(data.keys()),['a','b','d','e','f','g','i'])
+        self.assertEqual(data['e'],[1,{'p': 2}])
+        self.assertEqual(data['g'],{'h': [1,2]})
+        self.assertEqual(data['i'],9)
+
+    def test_recover_without_errors(self):
+        data = self.parser.parse('{a: [1, 2], b: "x"}',recover=True)
+        self.assertEqual(data,{'a': [1,2], 'b': 'x'})
+        self.assertEqual(self.parser.errors,[])
+
+    def test_start_of_file(self):
+        self.assertErrorAt('',1,1,'Unexpected end of input')
+        self.assertErrorAt(']',1,1,"Didn't parse all input")
+
+    def test_end_of_file(self):
+        self.assertErrorAt('{a: 1',1,6,'Expected either } or , in object definition')
+        self.assertErrorAt('{a: [1,\n',2,1,'Unexpected end of input')
+
+    def test_line_column(self):
+        source = '{a: 1}\n'
+        self.parser.parse(source)
+        self.assertEqual(self.parser.line_column(0),(1,1))
+        self.assertEqual(self.parser.line_column(len(source)-1),(1,7))
+        self.assertEqual(self.parser.line_column(len(source)),(2,1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#Copyright 2011-18 Newcastle University
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+    Check that the document the runtime builds from the ``--json-exam`` encoding is the same as the one it parses from the exam XML.
+
+    Run from the top of the repository with ``python -m unittest tests.test_xml2js``.
+"""
+
+import json
+import os
+import sys
+import unittest
+import xml.etree.ElementTree as etree
+
+NUMBAS_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,os.path.join(NUMBAS_PATH,'bin'))
+
+from exam import Exam
+import xml2js
+
+def build(data,fragments):
+    """
+        Do what ``Numbas.xml.jsonMLToNode`` does in the runtime, with ElementTree
+    """
+    if isinstance(data,int):
+        return fragments[data]
+    element = etree.Element(data[0])
+    children = data[1:]
+    if children and isinstance(children[0],dict):
+        element.attrib.update(children[0])
+        children = children[1:]
+    last = None
+    for child in children:
+        if isinstance(child,str):
+            if last is None:
+                element.text = (element.text or '')+child
+            else:
+                last.tail = (last.tail or '')+child
+        else:
+            last = build(child,fragments)
+            element.append(last)
+    return element
+
+def normalise(element,in_content=False):
+    """
+        Lower-case attribute names, as the runtime does, and drop the indentation between elements outside ``<content>``
+    """
+    in_content = in_content or element.tag == 'content'
+    element.attrib = {name.lower(): value for name,value in element.attrib.items()}
+    if element.tag == 'content':
+        element.tail = None
+    if not in_content and len(element):
+        if element.text and element.text.isspace():
+            element.text = None
+        for child in element:
+            if child.tail and child.tail.isspace():
+                child.tail = None
+    for child in element:
+        normalise(child,in_content)
+    return element
+
+class ExamJSONTest(unittest.TestCase):
+    def test_stability_exam(self):
+        with open(os.path.join(NUMBAS_PATH,'tests','stability-test.exam'),encoding='utf-8') as f:
+            examXML = Exam.fromstring(f.read()).tostring()
+
+        structure, content = xml2js.exam_json(etree.fromstring(examXML))
+        structure = json.loads(json.dumps(structure))
+        fragments = list(etree.fromstring(content))
+        self.assertEqual(len(fragments),examXML.count('<content>'))
+
+        built = build(structure,fragments)
+        expected = normalise(etree.fromstring(examXML))
+        self.assertEqual(etree.tostring(built,encoding='unicode'),etree.tostring(expected,encoding='unicode'))
+
+    def test_content_whitespace(self):
+        root = etree.fromstring('<exam><statement>\n\t<content><pre>  a\n\n  b</pre>\n\t\t</content>\n</statement></exam>')
+        structure, content = xml2js.exam_json(root)
+        self.assertEqual(structure,['exam',['statement',0]])
+        self.assertEqual(content,'<contents><content><pre>  a\n\n  b</pre>\n\t\t</content></contents>')
+
+    def test_json_literal(self):
+        literal = xml2js.json_literal(['a',{'b': 'it\'s \\ "q"\n\u2028'}])
+        self.assertEqual(literal,'\'["a",{"b":"it\\\'s \\\\\\\\ \\\\"q\\\\"\\\\n\\u2028"}]\'')
+        self.assertNotIn('\u2028',literal)
+
+if __name__ == '__main__':
+    unittest.main()